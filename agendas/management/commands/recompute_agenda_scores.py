@@ -0,0 +1,34 @@
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand, CommandError
+from django.db import transaction
+
+from agendas.models import Agenda, AgendaMemberScore
+
+class Command(NoArgsCommand):
+    help = "Rebuild the materialized member and party scores of agendas"
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--agenda', action='store', dest='agenda', type='int',
+            help="recompute only the scores of the agenda with this id"),
+    )
+
+    def handle_noargs(self, **options):
+        agenda = options.get('agenda')
+        if agenda is not None and not Agenda.objects.filter(pk=agenda).exists():
+            raise CommandError('Agenda %d does not exist' % agenda)
+
+        self.recompute(agenda)
+
+    @transaction.commit_manually
+    def recompute(self, agenda):
+        print('Recalculating member and party scores')
+        try:
+            AgendaMemberScore.objects.rebuild(agenda_ids=None if agenda is None else [agenda])
+        except Exception as e:
+            transaction.rollback()
+            print(e)
+            print('Failed to recompute scores, no worries I rolled back')
+        else:
+            transaction.commit()
+            print('Completed recalculation of agenda scores')
@@ -1,21 +1,47 @@
 from __future__ import division
+import datetime
+from optparse import make_option
 
-from django.core.management.base import NoArgsCommand
+from django.core.management.base import NoArgsCommand, CommandError
 from django.db import transaction
 
-from agendas.models import SummaryAgenda,AgendaVote
+from agendas.models import SummaryAgenda, AgendaVote, Agenda
 
 class Command(NoArgsCommand):
 
-    @transaction.commit_manually
+    option_list = NoArgsCommand.option_list + (
+        make_option('--agenda', action='store', dest='agenda', type='int',
+            help="recompute only the summaries of the agenda with this id"),
+        make_option('--since', action='store', dest='since',
+            help="recompute only the summaries from this month on (YYYY-MM)"),
+    )
+
     def handle_noargs(self, **options):
-        print('Deleting existing summary objects')
-        SummaryAgenda.objects.all().delete()
-        numAgendaVotes = AgendaVote.objects.count()
-        print('Summary agenda objects deleted, recalculating for %d votes' % \
-                    numAgendaVotes)
+        agenda = options.get('agenda')
+        since = options.get('since')
+        if agenda is not None:
+            try:
+                agenda = Agenda.objects.get(pk=agenda)
+            except Agenda.DoesNotExist:
+                raise CommandError('Agenda %d does not exist' % agenda)
+        if since:
+            try:
+                since = datetime.datetime.strptime(since, '%Y-%m')
+            except ValueError:
+                raise CommandError('--since should be in the form YYYY-MM')
+
+        self.recompute(agenda, since)
+
+    @transaction.commit_manually
+    def recompute(self, agenda, since):
+        agenda_votes = AgendaVote.objects.all()
+        if agenda is not None:
+            agenda_votes = agenda_votes.filter(agenda=agenda)
+        if since:
+            agenda_votes = agenda_votes.filter(vote__time__gte=since)
+        print('Recalculating summary objects for %d votes' % agenda_votes.count())
         try:
-            AgendaVote.objects.compute_all()
+            SummaryAgenda.objects.rebuild(agenda=agenda, since=since)
         except Exception as e:
             transaction.rollback()
             print(e)
@@ -5,8 +5,12 @@ from operator import attrgetter, itemgetter
 from collections import defaultdict
 import math
 
+import numpy
+
 from django.db import connection
 from django.db import models
+from django.db.models.signals import pre_delete, post_delete, post_save
+from django.dispatch import receiver
 from django.db.models import Sum, Q, Count, F
 from django.utils.translation import ugettext_lazy as _
 from django.contrib.contenttypes.models import ContentType
@@ -16,9 +20,12 @@ from django.conf import settings
 
 from django.contrib.auth.models import User
 from laws.models import VoteAction, Vote
+from laws.vote_matrix import get_vote_matrix
+from knesset.utils import disable_for_loaddata
 
 from mks.models import Member, Knesset
 import queries
+from summary_index import get_summary_index, invalidate_summary_index
 
 AGENDAVOTE_SCORE_CHOICES = (
     ('', _("Not selected")),
@@ -52,11 +59,23 @@ class AgendaVoteManager(models.Manager):
         'postgresql_psycopg2':{'monthfunc':"date_trunc('month'", 'nowfunc':'now()'}
     }
 
-    def compute_all(self):
+    def compute_all(self, agenda=None, since=None):
+        """Inserts SummaryAgenda rows for all agenda votes, optionally only
+        for a single agenda and/or for votes from the month of `since` on.
+        The relevant summary rows should be deleted before calling this.
+        """
         db_engine = settings.DATABASES['default']['ENGINE']
-        db_functions = self.db_month_trunc_functions[db_engine.split('.')[-1]]
-        agenda_query = queries.BASE_AGENDA_QUERY % db_functions
+        db_functions = dict(self.db_month_trunc_functions[db_engine.split('.')[-1]])
+        filters = []
+        if agenda is not None:
+            agenda_id = agenda.id if isinstance(agenda, models.Model) else agenda
+            filters.append('AND a.agenda_id = %d' % int(agenda_id))
+        if since is not None:
+            filters.append("AND v.time >= '%s'" % dateMonthTruncate(since).strftime('%Y-%m-%d'))
+        db_functions['filters'] = ' '.join(filters)
         cursor = connection.cursor()
+
+        agenda_query = queries.BASE_AGENDA_QUERY % db_functions
         cursor.execute(agenda_query)
 
         mk_query = queries.BASE_MK_QUERY % db_functions
@@ -118,53 +137,40 @@ class AgendaVote(Important):
     def __unicode__(self):
         return u"{} {}".format(self.agenda, self.vote)
 
-    def update_monthly_counters(self):
-        agendaScore = float(self.score) * float(self.importance)
-        objMonth = dateMonthTruncate(self.vote.time)
-
-        summaryObjects = SummaryAgenda.objects.filter(agenda=self.agenda,  month=objMonth).all()
-#        <<<<<<< HEAD
-        agendasByMk = [s.mk_id for s in summaryObjects if s.summary_type != 'AG']
-#         =======
-#         agendaSummary   = None
-#         if not filter(lambda summary:summary.summary_type=='AG',summaryObjects):
-#             agendaSummary   = SummaryAgenda(month=objMonth,
-#                                             agenda=self.agenda,
-#                                             summary_type='AG',
-#                                             score=abs(agendaScore),
-#                                             votes=1)
-#         else:
-#             existingAgenda = filter(lambda summary:summary.summary_type=='AG',summaryObjects)[0]
-#             existingAgenda.votes += 1
-#             existingAgenda.score += abs(agendaScore)
-#             existingAgenda.save()
-# 
-#         agendasByMk     = dict(map(lambda summary:(summary.mk_id,summary),
-#                                    filter(lambda summary:summary.summary_type=='MK',
-#                                           summaryObjects)))
-# >>>>>>> 4b160480cb5b568e1be245905f8a384732e39d61
-        newObjects = []
-        if len(agendasByMk) == len(summaryObjects):
-            newObjects.append(SummaryAgenda(agenda=self.agenda, month=objMonth,  votes=1,
-                                            summary_type='AG',   score=agendaScore))
+    def update_monthly_counters(self, previous=None):
+        """Applies this agenda vote's contribution to the SummaryAgenda rows.
 
-        voters = defaultdict(list)
-        for voteaction in self.vote.voteaction_set.all():
-            if voteaction.member_id in agendasByMk:
-                voters[voteaction.type].append(voteaction.member_id)
-            else:
-                newObjects.append(SummaryAgenda(agenda=self.agenda, month=objMonth,  votes=1,
-                                            summary_type='MK',   mk_id=voteaction.member_id,
-                                            score=agendaScore * (1 if voteaction.type == 'for' else -1)))
-        fvotes = F('votes') + 1
-        SummaryAgenda.objects.filter(mk_id__in=voters['for']).update(votes=fvotes, score=F('score') + agendaScore)
-        SummaryAgenda.objects.filter(mk_id__in=voters['against']).update(votes=fvotes, score=F('score') - agendaScore)
-        if newObjects:
-            SummaryAgenda.objects.bulk_create(newObjects)
+        :param previous: dict of agenda_id, vote_id, score and importance of
+                         this agenda vote before it was saved, or ``None``
+                         if it was just created.
+        """
+        weight = float(self.score) * float(self.importance)
+        if previous and (previous['agenda_id'], previous['vote_id']) == (self.agenda_id, self.vote_id):
+            old_weight = float(previous['score']) * float(previous['importance'])
+            SummaryAgenda.objects.add_agenda_vote(self.agenda_id, self.vote,
+                                                  weight - old_weight,
+                                                  abs(weight) - abs(old_weight), 0)
+            return
+        if previous:
+            old_weight = float(previous['score']) * float(previous['importance'])
+            SummaryAgenda.objects.add_agenda_vote(previous['agenda_id'],
+                                                  Vote.objects.get(pk=previous['vote_id']),
+                                                  -old_weight, -abs(old_weight), -1)
+        SummaryAgenda.objects.add_agenda_vote(self.agenda_id, self.vote, weight, abs(weight), 1)
 
     def save(self, *args, **kwargs):
+        # the counters and scores are updated in the caller's transaction
+        previous = None
+        if self.pk:
+            previous = AgendaVote.objects.filter(pk=self.pk).values(
+                'agenda_id', 'vote_id', 'score', 'importance')
+            previous = previous[0] if previous else None
         super(AgendaVote, self).save(*args, **kwargs)
-        self.update_monthly_counters()
+        self.update_monthly_counters(previous)
+        agenda_ids = set([self.agenda_id])
+        if previous:
+            agenda_ids.add(previous['agenda_id'])
+        AgendaMemberScore.objects.rebuild(agenda_ids=agenda_ids)
 
 @Listener()
 class AgendaMeeting(Scorable):
@@ -236,8 +242,10 @@ class AgendaManager(models.Manager):
     def get_selected_for_instance(self, instance, user=None, top=3, bottom=3):
         # Returns interesting agendas for model instances such as: member, party
         agendas = list(self.get_relevant_for_user(user))
+        groups = member_groups(type(instance), ids=[instance.id])
+        groups.setdefault(instance.id, [])
         for agenda in agendas:
-            agenda.score = getattr(agenda, '{}_score'.format(type(instance).__name__.lower()))(instance)
+            agenda.score = agenda.score_all(type(instance), groups)[instance.id]
             agenda.significance = agenda.score * agenda.num_followers
         agendas.sort(key=attrgetter('significance'))
         agendas = get_top_bottom(agendas, top, bottom)
@@ -277,7 +285,7 @@ class AgendaManager(models.Manager):
     def get_mks_values(self):
         mks_values = cache.get('agendas_mks_values')
         if not mks_values:
-            q = queries.agendas_mks_grade()
+            q = AgendaMemberScore.objects.grades()
             # outer join - add missing mks to agendas
             # generates a set of all the current mk ids that have ever voted for any agenda
             # its not perfect, but its better than creating another query to generate all known mkids
@@ -333,7 +341,7 @@ class AgendaManager(models.Manager):
     #     return mks_values
 
     def get_all_party_values(self):
-        return queries.getAllAgendaPartyVotes()
+        return AgendaPartyScore.objects.grades()
 
 @Follower
 class Agenda(models.Model):
@@ -364,40 +372,48 @@ class Agenda(models.Model):
     def get_edit_absolute_url(self):
         return ('agenda-detail-edit', [str(self.id)])
     
-    def calculate_score(self, members):
-        # Since we're already calculating python side, no need to do 2 queries
-        # with joins, select for and against, and calcualte the things        
-        qs = list(AgendaVote.objects.filter(
-            agenda=self,
-            vote__voteaction__member__in=members,
-            vote__voteaction__type__in=['for', 'against']).extra(
-                select={'weighted_score':'agendas_agendavote.score * agendas_agendavote.importance'}
-            ).values_list('weighted_score', 'vote__voteaction__type'))
-        
-        total_score = 0
-        for score, action_type in qs:
-            if action_type == 'against':
-                total_score -= score
-            else:
-                total_score += score
-        
-        # To save the queries, make sure to pass prefetch/select related
-        # Removed the values call, so that we can utilize the prefetched stuf
-        # This reduces the number of queries when called for example from
-        # AgendaResource.dehydrate        
-        max_score = sum(abs(x.score * x.importance) for x in self.agendavotes.all())
-        max_score *= len(members)
+    def calculate_score(self, member_ids):
+        # Scores are computed against the in-memory vote matrix, so the only
+        # data needed from the db is the agenda's votes. Make sure to pass
+        # prefetch_related('agendavotes') to save that query too, for
+        # example when called from AgendaManager.get_selected_for_instance
+        weights = [(av.vote_id, av.score * av.importance) for av in self.agendavotes.all()]
+        total_score = get_vote_matrix().score(member_ids, weights)
+        max_score = sum(abs(weight) for _, weight in weights)
+        max_score *= len(member_ids)
         return max_score and (total_score * 100.0 / max_score)
-         
+
+    def score_all(self, cls, groups=None):
+        """Scores of all the instances of cls (Member, Party or
+        CandidateList) on this agenda, computed in one pass over the vote
+        matrix.
+
+        :param groups: dict of instance id -> member ids to score instead of
+                       all the instances of cls
+        :returns: dict of instance id -> score
+        """
+        if groups is None:
+            groups = member_groups(cls)
+        weights = [(av.vote_id, av.score * av.importance) for av in self.agendavotes.all()]
+        totals = get_vote_matrix().group_totals(groups, weights)
+        max_score = sum(abs(weight) for _, weight in weights)
+
+        scores = {}
+        for instance_id, member_ids in groups.items():
+            total_score = totals[instance_id]
+            group_max_score = max_score * len(member_ids)
+            scores[instance_id] = group_max_score and (total_score * 100.0 / group_max_score)
+        return scores
+
     def member_score(self, member):
-        return self.calculate_score([member])
-    
+        return self.calculate_score([member.id])
+
     def party_score(self, party):
-        return self.calculate_score(party.members.all())
+        return self.calculate_score(get_vote_matrix().party_members.get(party.id, []))
 
     def candidate_list_score(self, candidate_list):
         return self.calculate_score(candidate_list.member_ids)
-    
+
     def related_mk_votes(self, member):
         # Find all votes that
         #   1) This agenda is ascribed to
@@ -419,8 +435,9 @@ class Agenda(models.Model):
 
     def selected_instances(self, cls, top=3, bottom=3):
         instances = list(cls.objects.all())
+        scores = self.score_all(cls)
         for instance in instances:
-            instance.score = self.__getattribute__('{}_score'.format(instance.__class__.__name__.lower()))(instance)
+            instance.score = scores.get(instance.id, 0.0)
         instances.sort(key=attrgetter('score'))
         instances = get_top_bottom(instances, top, bottom)
         instances['top'].sort(key=attrgetter('score'), reverse=True)
@@ -439,69 +456,46 @@ class Agenda(models.Model):
 
         return qs
 
-    def generate_summary_filters(self, ranges):
-        results = Q()
-        for gte, lt in ranges:
-            queryFields = {}
-            if gte:
-                queryFields['month__gte'] = gte
-            if lt:
-                queryFields['month__lt']  = lt
-            if not queryFields:
-                # might as well not filter at all
-                return Q()
-            results |= Q(**queryFields)
-        return results
-
     def get_mks_values(self, ranges=((None, None),)):
-        fullRange = (None, None) in ranges
-        mks_values = fullRange and cache.get('agenda_{}_mks_values'.format(self.id))
-        if not mks_values:
+        """Scores, ranks and volumes of all members on this agenda.
 
-            # query summary
-            filterList = self.generate_summary_filters(ranges)
-            summaries = list(SummaryAgenda.objects.filter(filterList, agenda=self))
-
-            # import pdb; pdb.set_trace()
-            # group summaries for respective ranges
-            summaries_for_ranges = []
-            for gte, lt in ranges:
-                summaries_for_range = defaultdict(list)
-                for s in summaries:
-                    if (not gte or s.month >= gte) and (not lt or s.month < lt ):
-                        summaries_for_range[s.summary_type].append(s)
-                summaries_for_ranges.append(summaries_for_range)
-                
-
-            # get list of mk ids
-            mk_ids = Member.objects.all().values_list('id', flat=True)
-            # compute agenda measures, store results per MK
-            mk_results = { mk_id:[] for mk_id in mk_ids }
-            for summaries in summaries_for_ranges:
-                agenda_data = summaries['AG']
-                total_votes = sum(x.votes for x in agenda_data)
-                total_score = sum(x.score for x in agenda_data)
-                current_mks_data = indexby(summaries['MK'], attrgetter('id'))
-                
-                # calculate results per mk
-                range_mk_results = []
-                for mk_id in mk_ids:
-                    mk_data = current_mks_data[mk_id]
-                    mk_votes = sum(x.votes for x in mk_data)
-                    mk_volume = total_votes and 100*mk_votes / total_votes
-                    mk_score = total_score and 100*sum(x.score for x in mk_data) / total_score
-                    range_mk_results.append( (mk_id, mk_votes, mk_score, mk_volume) )
-
-                # sort results by score descending
-                range_mk_results.sort(key=itemgetter(2, 0), reverse=True)
-                for rank, (mk_id, mk_votes, mk_score, mk_volume) in enumerate(range_mk_results):
-                    mk_range_data = dict(score=mk_score, rank=rank, volume=mk_volume, numvotes=mk_votes)
-                    if fullRange:
-                        mk_results[mk_id] = mk_range_data
-                    else:
-                        mk_results[mk_id].append(mk_range_data)
-            if fullRange:
-                cache.set('agenda_{}_mks_values'.format(self.id), mks_values, 1800)
+        :param ranges: list of (gte, lt) month ranges, ``None`` meaning
+                       unbounded. If the full range ``(None, None)`` is
+                       requested a list of (mk_id, values) sorted by rank is
+                       returned, otherwise a dict of mk_id to a list of values
+                       per range.
+        """
+        fullRange = (None, None) in ranges
+        if fullRange:
+            ranges = ((None, None),)
+        index = get_summary_index(self)
+        # the index has only the members that voted on the agenda, the others
+        # are added with zero values
+        indexed = set(index.mk_ids)
+        missing = [mk_id for mk_id in Member.objects.values_list('id', flat=True) if mk_id not in indexed]
+        mk_ids = index.mk_ids + missing
+        padding = numpy.zeros(len(missing))
+
+        mk_results = dict((mk_id, []) for mk_id in mk_ids)
+        for gte, lt in ranges:
+            scores, votes = index.totals(gte, lt)
+            total_score, total_votes = scores[-1], votes[-1]
+            mk_votes = numpy.concatenate((votes[:-1], padding))
+            mk_scores = 100 * scores[:-1] / total_score if total_score else numpy.zeros(len(indexed))
+            mk_scores = numpy.concatenate((mk_scores, padding))
+            mk_volumes = 100 * votes[:-1] / total_votes if total_votes else numpy.zeros(len(indexed))
+            mk_volumes = numpy.concatenate((mk_volumes, padding))
+
+            range_mk_results = [(mk_id, int(mk_votes[i]), float(mk_scores[i]), float(mk_volumes[i]))
+                                for i, mk_id in enumerate(mk_ids)]
+            # sort results by score descending
+            range_mk_results.sort(key=itemgetter(2, 0), reverse=True)
+            for rank, (mk_id, mk_votes, mk_score, mk_volume) in enumerate(range_mk_results):
+                mk_range_data = dict(score=mk_score, rank=rank, volume=mk_volume, numvotes=mk_votes)
+                if fullRange:
+                    mk_results[mk_id] = mk_range_data
+                else:
+                    mk_results[mk_id].append(mk_range_data)
         if fullRange:
             mk_results = sorted(mk_results.items(), key=lambda (k, v):v['rank'])
         return mk_results
@@ -560,6 +554,71 @@ SUMMARY_TYPES = (
     ('MK', 'MK Counter')
 )
 
+class SummaryAgendaManager(models.Manager):
+
+    def add_agenda_vote(self, agenda_id, vote, score_delta, abs_score_delta, votes_delta):
+        """Adds deltas to the monthly summary rows affected by an agenda vote.
+
+        The AG row gets abs_score_delta, members who voted for get
+        score_delta and members who voted against get -score_delta. Missing
+        rows are only created when votes are added, and rows left with no
+        votes are removed.
+        """
+        month = dateMonthTruncate(vote.time)
+        rows = self.filter(agenda__id=agenda_id, month=month)
+
+        updated = rows.filter(summary_type='AG').update(score=F('score') + abs_score_delta,
+                                                        votes=F('votes') + votes_delta)
+        new_rows = []
+        if not updated and votes_delta > 0:
+            new_rows.append(SummaryAgenda(agenda_id=agenda_id, month=month, summary_type='AG',
+                                          score=abs_score_delta, votes=votes_delta))
+
+        voters = defaultdict(list)
+        for member_id, vote_type in VoteAction.objects.filter(
+                vote=vote, type__in=('for', 'against')).values_list('member_id', 'type').distinct():
+            voters[vote_type].append(member_id)
+        mk_rows = rows.filter(summary_type='MK')
+        existing = set(mk_rows.filter(mk__in=voters['for'] + voters['against']).values_list('mk_id', flat=True))
+        for vote_type, sign in (('for', 1), ('against', -1)):
+            mk_ids = voters[vote_type]
+            if not mk_ids:
+                continue
+            mk_rows.filter(mk__in=mk_ids).update(score=F('score') + sign * score_delta,
+                                                 votes=F('votes') + votes_delta)
+            if votes_delta > 0:
+                new_rows.extend(SummaryAgenda(agenda_id=agenda_id, month=month, summary_type='MK',
+                                              mk_id=mk_id, score=sign * score_delta, votes=votes_delta)
+                                for mk_id in mk_ids if mk_id not in existing)
+        if new_rows:
+            self.bulk_create(new_rows)
+        if votes_delta < 0:
+            rows.filter(votes__lte=0).delete()
+        invalidate_summary_index(agenda_id)
+
+    def agenda_totals(self):
+        """Returns a dict of agenda id -> (sum of absolute agenda vote
+        weights, number of agenda votes), taken from the AG rows"""
+        return dict((row['agenda'], (row['total_score'], row['total_votes'])) for row in
+                    self.filter(summary_type='AG').values('agenda').annotate(
+                        total_score=Sum('score'), total_votes=Sum('votes')))
+
+    def rebuild(self, agenda=None, since=None):
+        """Recomputes summary rows from scratch, optionally only for one
+        agenda and/or from the month of `since` on"""
+        rows = self.all()
+        if agenda is not None:
+            rows = rows.filter(agenda=agenda)
+        if since is not None:
+            rows = rows.filter(month__gte=dateMonthTruncate(since))
+        rows.delete()
+        AgendaVote.objects.compute_all(agenda=agenda, since=since)
+        if agenda is not None:
+            invalidate_summary_index(agenda.id)
+        else:
+            invalidate_summary_index(*Agenda.objects.values_list('id', flat=True))
+
+
 class SummaryAgenda(models.Model):
     agenda = models.ForeignKey(Agenda, related_name='score_summaries')
     month = models.DateTimeField(db_index=True)
@@ -570,11 +629,226 @@ class SummaryAgenda(models.Model):
     db_created = models.DateTimeField(auto_now_add=True)
     db_updated = models.DateTimeField(auto_now=True)
 
+    objects = SummaryAgendaManager()
+
     def __unicode__(self):
         return u'{} {} {} {} ({},{})'.format(self.agenda, self.month, self.summary_type,
                                             self.mk or 'n/a', self.score, self.votes)
 
 
+def _id_list(ids):
+    return ','.join(str(int(x)) for x in ids)
+
+
+def _add_to_score(manager, score_delta, votes_delta, **key):
+    """Adds deltas to the score row with the given key. A missing row is
+    only created when votes are added, and a row left with no votes is
+    removed"""
+    rows = manager.filter(**key)
+    if not rows.update(score=F('score') + score_delta, votes=F('votes') + votes_delta) and votes_delta > 0:
+        manager.create(score=score_delta, votes=votes_delta, **key)
+    if votes_delta < 0:
+        rows.filter(votes__lte=0).delete()
+
+
+class AgendaMemberScoreManager(models.Manager):
+
+    def rebuild(self, agenda_ids=None, member_ids=None):
+        """Recomputes the member scores, optionally only of the given agendas
+        and/or members, and then the party scores of the affected agendas"""
+        rows = self.all()
+        filters = []
+        if agenda_ids is not None:
+            agenda_ids = list(agenda_ids)
+            if not agenda_ids:
+                return
+            rows = rows.filter(agenda__in=agenda_ids)
+            filters.append('AND a.agenda_id IN (%s)' % _id_list(agenda_ids))
+        if member_ids is not None:
+            member_ids = list(member_ids)
+            if not member_ids:
+                return
+            rows = rows.filter(member__in=member_ids)
+            filters.append('AND v.member_id IN (%s)' % _id_list(member_ids))
+        rows.delete()
+        cursor = connection.cursor()
+        cursor.execute(queries.AGENDA_MEMBER_SCORE_QUERY % {'filters': ' '.join(filters)})
+        cache.delete('agendas_mks_values')
+        AgendaPartyScore.objects.rebuild(agenda_ids=agenda_ids)
+
+    def add_vote_action(self, member_id, vote_id, vote_type, sign=1):
+        """Adds a member's position on a vote to the member's scores and
+        the current party's scores on the agendas of the vote, or removes it
+        if sign is -1"""
+        if vote_type not in ('for', 'against'):
+            return
+        position = sign if vote_type == 'for' else -sign
+        party_id = Member.objects.filter(pk=member_id).values_list('current_party_id', flat=True)
+        party_id = party_id[0] if party_id else None
+        for agenda_id, score, importance in AgendaVote.objects.filter(vote__id=vote_id).values_list(
+                'agenda_id', 'score', 'importance'):
+            score_delta = position * float(score) * float(importance)
+            _add_to_score(self, score_delta, sign, agenda_id=agenda_id, member_id=member_id)
+            if party_id is not None:
+                _add_to_score(AgendaPartyScore.objects, score_delta, sign,
+                              agenda_id=agenda_id, party_id=party_id)
+        cache.delete('agendas_mks_values')
+        cache.delete('AllAgendaPartyVotes')
+
+    def grades(self):
+        """Returns a dict of agenda id -> list of (member id, score, volume,
+        number of votes), sorted by score descending"""
+        totals = SummaryAgenda.objects.agenda_totals()
+        grades = dict((agenda_id, []) for agenda_id in totals)
+        for agenda_id, member_id, score, votes in self.values_list('agenda', 'member', 'score', 'votes'):
+            total_score, total_votes = totals.get(agenda_id, (0, 0))
+            grades.setdefault(agenda_id, []).append(
+                (member_id,
+                 round(total_score and score * 100.0 / total_score, 2),
+                 round(total_votes and votes * 100.0 / total_votes, 2),
+                 votes))
+        for agenda_grades in grades.values():
+            agenda_grades.sort(key=itemgetter(1), reverse=True)
+        return grades
+
+
+class AgendaMemberScore(models.Model):
+    """Sum of a member's weighted for/against positions on the votes of an
+    agenda, kept up to date as agenda votes and vote actions change"""
+    agenda = models.ForeignKey(Agenda, related_name='member_scores')
+    member = models.ForeignKey(Member, related_name='agenda_scores')
+    score = models.FloatField(default=0.0)
+    votes = models.IntegerField(default=0)
+
+    objects = AgendaMemberScoreManager()
+
+    class Meta:
+        unique_together = (('agenda', 'member'),)
+
+    def __unicode__(self):
+        return u'{} {} ({},{})'.format(self.agenda, self.member, self.score, self.votes)
+
+
+class AgendaPartyScoreManager(models.Manager):
+
+    def rebuild(self, agenda_ids=None):
+        """Recomputes the party scores from the member scores of the
+        parties' current members, optionally only of the given agendas"""
+        rows = self.all()
+        filters = ''
+        if agenda_ids is not None:
+            agenda_ids = list(agenda_ids)
+            if not agenda_ids:
+                return
+            rows = rows.filter(agenda__in=agenda_ids)
+            filters = 'AND s.agenda_id IN (%s)' % _id_list(agenda_ids)
+        rows.delete()
+        cursor = connection.cursor()
+        cursor.execute(queries.AGENDA_PARTY_SCORE_QUERY % {'filters': filters})
+        cache.delete('AllAgendaPartyVotes')
+
+    def grades(self):
+        """Returns a dict of agenda id -> list of (party id, score, volume),
+        sorted by score descending"""
+        totals = SummaryAgenda.objects.agenda_totals()
+        grades = {}
+        for agenda_id, party_id, score, votes, seats in self.values_list(
+                'agenda', 'party', 'score', 'votes', 'party__number_of_seats'):
+            total_score, total_votes = totals.get(agenda_id, (0, 0))
+            grades.setdefault(agenda_id, []).append(
+                (party_id,
+                 (total_score and seats) and score * 100.0 / (total_score * seats) or 0.0,
+                 (total_votes and seats) and votes * 100.0 / (total_votes * seats) or 0.0))
+        for agenda_grades in grades.values():
+            agenda_grades.sort(key=itemgetter(1), reverse=True)
+        return grades
+
+
+class AgendaPartyScore(models.Model):
+    """Sum of the member scores of a party's current members on an agenda"""
+    agenda = models.ForeignKey(Agenda, related_name='party_scores')
+    party = models.ForeignKey('mks.Party', related_name='agenda_scores')
+    score = models.FloatField(default=0.0)
+    votes = models.IntegerField(default=0)
+
+    objects = AgendaPartyScoreManager()
+
+    class Meta:
+        unique_together = (('agenda', 'party'),)
+
+    def __unicode__(self):
+        return u'{} {} ({},{})'.format(self.agenda, self.party, self.score, self.votes)
+
+
+@receiver(pre_delete, sender=AgendaVote, dispatch_uid='agendavote_summary_delete')
+def remove_agendavote_from_summary(sender, instance, **kwargs):
+    # runs before the delete, while the vote actions still exist
+    weight = float(instance.score) * float(instance.importance)
+    SummaryAgenda.objects.add_agenda_vote(instance.agenda_id, instance.vote,
+                                          -weight, -abs(weight), -1)
+
+
+@receiver(post_delete, sender=AgendaVote, dispatch_uid='agendavote_scores_delete')
+def remove_agendavote_from_scores(sender, instance, **kwargs):
+    AgendaMemberScore.objects.rebuild(agenda_ids=[instance.agenda_id])
+
+
+@receiver(post_save, sender=VoteAction, dispatch_uid='voteaction_agenda_scores_save')
+@disable_for_loaddata
+def update_voteaction_agenda_scores(sender, instance, **kwargs):
+    # the previous position is remembered by laws.listeners
+    previous = getattr(instance, '_previous_counted_fields', None)
+    previous = previous and previous[:3]
+    current = (instance.member_id, instance.vote_id, instance.type)
+    if previous == current:
+        return
+    if previous:
+        AgendaMemberScore.objects.add_vote_action(*previous, sign=-1)
+    AgendaMemberScore.objects.add_vote_action(*current)
+
+
+@receiver(post_delete, sender=VoteAction, dispatch_uid='voteaction_agenda_scores_delete')
+@disable_for_loaddata
+def remove_voteaction_from_agenda_scores(sender, instance, **kwargs):
+    AgendaMemberScore.objects.add_vote_action(instance.member_id, instance.vote_id, instance.type, sign=-1)
+
+
+@receiver(post_save, sender=Member, dispatch_uid='member_agenda_party_scores')
+@disable_for_loaddata
+def update_member_agenda_party_scores(sender, instance, created, **kwargs):
+    # the member's current party might have changed
+    if not created and AgendaMemberScore.objects.filter(member=instance).exists():
+        AgendaPartyScore.objects.rebuild()
+
+
+def member_groups(cls, ids=None):
+    """Returns a dict of instance id -> member ids for the instances of cls,
+    which is one of Member, Party or CandidateList.
+
+    :param ids: ids of the instances to include, ``None`` for all of them
+    """
+    name = cls.__name__
+    if name not in ('Member', 'Party', 'CandidateList'):
+        raise ValueError('Can not score instances of %s' % name)
+    instances = cls.objects.all()
+    if ids is not None:
+        instances = instances.filter(id__in=ids)
+    instance_ids = instances.values_list('id', flat=True)
+    if name == 'Member':
+        return dict((member_id, [member_id]) for member_id in instance_ids)
+    if name == 'Party':
+        party_members = get_vote_matrix().party_members
+        return dict((party_id, party_members.get(party_id, [])) for party_id in instance_ids)
+    from polyorg.models import Candidate
+    groups = dict((list_id, []) for list_id in instance_ids)
+    candidates = Candidate.objects.filter(person__mk__isnull=False)
+    if ids is not None:
+        candidates = candidates.filter(candidates_list__in=ids)
+    for list_id, member_id in candidates.values_list('candidates_list', 'person__mk__id'):
+        groups.setdefault(list_id, []).append(member_id)
+    return groups
+
+
 def dateMonthTruncate(dt):
     return dt.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
 
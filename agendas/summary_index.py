@@ -0,0 +1,83 @@
+'''
+Prefix-sum index over the monthly SummaryAgenda rows of an agenda.
+
+The summary rows are laid out as one (mk x month) array of scores and one of
+vote counts, with an extra last row for the agenda (AG) totals, and stored
+cumulatively along the months axis. The totals of any [gte, lt) range of
+months are then the difference of two columns, so range queries cost the same
+no matter how many months they span.
+'''
+from bisect import bisect_left
+
+import numpy
+from django.conf import settings
+from django.core.cache import cache
+
+
+def _month_key(dt):
+    return (dt.year, dt.month)
+
+
+class MonthlySummaryIndex(object):
+
+    def __init__(self, rows):
+        """
+        :param rows: iterable of (summary_type, mk_id, month, score, votes).
+                     The members indexed are the ones that have rows.
+        """
+        rows = list(rows)
+        self.mk_ids = sorted(set(row[1] for row in rows if row[0] != 'AG'))
+        self.months = sorted(set(_month_key(row[2]) for row in rows))
+        mk_index = dict((mk_id, i) for i, mk_id in enumerate(self.mk_ids))
+        month_index = dict((month, i) for i, month in enumerate(self.months))
+
+        # column 0 is left empty so a range starting at the first month can
+        # subtract it like any other column
+        shape = (len(self.mk_ids) + 1, len(self.months) + 1)
+        scores = numpy.zeros(shape)
+        votes = numpy.zeros(shape, dtype=numpy.int64)
+        agenda_row = len(self.mk_ids)
+        for summary_type, mk_id, month, score, count in rows:
+            if summary_type == 'AG':
+                row = agenda_row
+            else:
+                row = mk_index[mk_id]
+            col = month_index[_month_key(month)] + 1
+            scores[row, col] += score
+            votes[row, col] += count
+        self.scores = scores.cumsum(axis=1)
+        self.votes = votes.cumsum(axis=1)
+
+    def _columns(self, gte, lt):
+        start = bisect_left(self.months, _month_key(gte)) if gte else 0
+        end = bisect_left(self.months, _month_key(lt)) if lt else len(self.months)
+        return start, max(start, end)
+
+    def totals(self, gte=None, lt=None):
+        """Returns (scores, votes) arrays summed over the months in [gte, lt).
+
+        Item i of each array belongs to mk_ids[i], the last item holds the
+        agenda totals.
+        """
+        start, end = self._columns(gte, lt)
+        return (self.scores[:, end] - self.scores[:, start],
+                self.votes[:, end] - self.votes[:, start])
+
+
+def summary_index_cache_key(agenda_id):
+    return 'agenda_{}_summary_index'.format(agenda_id)
+
+
+def get_summary_index(agenda):
+    """Returns the (cached) summary index of the given agenda"""
+    cache_key = summary_index_cache_key(agenda.id)
+    index = cache.get(cache_key)
+    if index is None:
+        index = MonthlySummaryIndex(
+            agenda.score_summaries.values_list('summary_type', 'mk_id', 'month', 'score', 'votes'))
+        cache.set(cache_key, index, settings.LONG_CACHE_TIME)
+    return index
+
+
+def invalidate_summary_index(*agenda_ids):
+    cache.delete_many([summary_index_cache_key(agenda_id) for agenda_id in agenda_ids])
@@ -8,7 +8,8 @@ from django.contrib.sites.models import Site
 from django.utils import translation
 from django.conf import settings
 
-from models import Agenda, AgendaVote, AgendaBill, AgendaMeeting
+from models import (Agenda, AgendaVote, AgendaBill, AgendaMeeting, SummaryAgenda,
+                    AgendaMemberScore)
 from laws.models import Vote, VoteAction, Bill
 from mks.models import Party, Member, Membership, Knesset
 from committees.models import Committee
@@ -332,6 +333,97 @@ I have a deadline''')
         self.assertEqual(int(res.context['score']), -33)
         self.assertEqual(len(res.context['related_votes']), 2)
 
+    def test_party_score(self):
+        # mk_1 voted for both agenda_1 votes, mk_2 voted on none of them
+        self.assertAlmostEqual(self.agenda_1.party_score(self.party_1), -100.0 / 6)
+        self.assertAlmostEqual(self.agenda_1.member_score(self.mk_2), 0.0)
+
+    def test_score_all(self):
+        self.assertEqual(self.agenda_1.score_all(Party),
+                         {self.party_1.id: self.agenda_1.party_score(self.party_1)})
+        scores = self.agenda_1.score_all(Member)
+        self.assertAlmostEqual(scores[self.mk_1.id], -100.0 / 3)
+        self.assertEqual(scores[self.mk_2.id], 0)
+        selected = self.agenda_1.selected_instances(Member, top=1, bottom=1)
+        self.assertEqual(selected['bottom'], [self.mk_1])
+
+    def _scores(self, agenda):
+        return (sorted(agenda.member_scores.values_list('member', 'score', 'votes')),
+                sorted(agenda.party_scores.values_list('party', 'score', 'votes')))
+
+    def test_materialized_scores(self):
+        self.assertEqual(self._scores(self.agenda_1),
+                         ([(self.mk_1.id, -0.5, 2)], [(self.party_1.id, -0.5, 2)]))
+        party_values = Agenda.objects.get_all_party_values()[self.agenda_1.id]
+        self.assertEqual(len(party_values), 1)
+        self.assertAlmostEqual(party_values[0][1], -100.0 / 3)
+        self.assertEqual(party_values[0][2], 100)
+
+        action = VoteAction.objects.create(vote=self.vote_1, member=self.mk_2, type='against')
+        self.assertEqual(self._scores(self.agenda_1),
+                         ([(self.mk_1.id, -0.5, 2), (self.mk_2.id, 1.0, 1)],
+                          [(self.party_1.id, 0.5, 3)]))
+        action.type = 'for'
+        action.save()
+        self.assertEqual(self._scores(self.agenda_1),
+                         ([(self.mk_1.id, -0.5, 2), (self.mk_2.id, -1.0, 1)],
+                          [(self.party_1.id, -1.5, 3)]))
+        action.delete()
+        self.assertEqual(self._scores(self.agenda_1),
+                         ([(self.mk_1.id, -0.5, 2)], [(self.party_1.id, -0.5, 2)]))
+        VoteAction.objects.create(vote=self.vote_1, member=self.mk_2, type='against')
+
+        self.agendavote_1.delete()
+        self.assertEqual(self._scores(self.agenda_1),
+                         ([(self.mk_1.id, 0.5, 1)], [(self.party_1.id, 0.5, 1)]))
+
+        incremental = self._scores(self.agenda_1)
+        AgendaMemberScore.objects.rebuild()
+        self.assertEqual(self._scores(self.agenda_1), incremental)
+
+    def _summary(self, agenda):
+        return sorted(SummaryAgenda.objects.filter(agenda=agenda).values_list(
+            'summary_type', 'mk', 'score', 'votes'))
+
+    def test_summary_incremental_updates(self):
+        self.assertEqual(self._summary(self.agenda_1),
+                         [('AG', None, 1.5, 2), ('MK', self.mk_1.id, -0.5, 2)])
+
+        self.agendavote_1.score = 1
+        self.agendavote_1.save()
+        self.assertEqual(self._summary(self.agenda_1),
+                         [('AG', None, 1.5, 2), ('MK', self.mk_1.id, 1.5, 2)])
+        # other agendas are left alone
+        self.assertEqual(self._summary(self.agenda_2),
+                         [('AG', None, 0.5, 1), ('MK', self.mk_1.id, 0.5, 1)])
+
+        self.agendavote_3.delete()
+        self.assertEqual(self._summary(self.agenda_1),
+                         [('AG', None, 1.0, 1), ('MK', self.mk_1.id, 1.0, 1)])
+
+        incremental = self._summary(self.agenda_1)
+        SummaryAgenda.objects.rebuild(agenda=self.agenda_1)
+        self.assertEqual(self._summary(self.agenda_1), incremental)
+
+    def test_mks_values_ranges(self):
+        mks_values = self.agenda_1.get_mks_values()
+        self.assertEqual(mks_values[-1][0], self.mk_1.id)
+        # members that didn't vote on the agenda are there too, with zeros
+        self.assertEqual(sorted(dict(mks_values)), sorted(Member.objects.values_list('id', flat=True)))
+        mk_1_values = dict(mks_values)[self.mk_1.id]
+        self.assertAlmostEqual(mk_1_values['score'], -100.0 / 3)
+        self.assertEqual(mk_1_values['numvotes'], 2)
+        self.assertEqual(mk_1_values['volume'], 100)
+
+        this_month = self.vote_1.time.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        next_month = (this_month + datetime.timedelta(days=31)).replace(day=1)
+        mks_values = self.agenda_1.get_mks_values([(this_month, next_month), (next_month, None)])
+        in_range, after = mks_values[self.mk_1.id]
+        self.assertAlmostEqual(in_range['score'], -100.0 / 3)
+        self.assertEqual(in_range['numvotes'], 2)
+        self.assertEqual(after['score'], 0)
+        self.assertEqual(after['numvotes'], 0)
+
     def testAgendaDetailOptCacheFail(self):
         self.client.get(reverse('agenda-detail', kwargs={'pk': self.agenda_1.id}))
 
@@ -52,9 +52,7 @@ class AgendaListView(ListView):
         allAgendaPartyVotes = cache.get('AllAgendaPartyVotes')
         if not allAgendaPartyVotes:
             # filtering for current knesset is done here
-
-            #TODO: this is embarassingly slow. ~1300ms !
-            allAgendaPartyVotes = queries.getAllAgendaPartyVotes()
+            allAgendaPartyVotes = Agenda.objects.get_all_party_values()
 
             for agenda_id, party_votes in allAgendaPartyVotes.iteritems():
                 allAgendaPartyVotes[agenda_id] = [
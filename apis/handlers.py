@@ -9,7 +9,7 @@ from piston.utils import rc
 from mks.models import Member, Party
 from laws.models import Vote, Bill
 from agendas.models import Agenda
-from committees.models import Committee, CommitteeMeeting
+from committees.models import Committee, CommitteeMeeting, CommitteeMeetingProtocol
 from links.models import Link
 from tagging.models import Tag, TaggedItem
 from events.models import Event
@@ -51,7 +51,7 @@ class MemberHandler(BaseHandler, HandlerExtensions):
     qs = Member.current_knesset.all()
 
     def queryset(self, request):
-        return self.model.current_knesset.all()
+        return self.model.current_knesset.select_related('current_party', 'voting_statistics')
 
     @staticmethod
     def gender(member):
@@ -351,10 +351,14 @@ class BillHandler(BaseHandler, HandlerExtensions):
 
 class PartyHandler(BaseHandler):
     fields = ('id', 'name', 'start_date', 'end_date', 'members',
-              'is_coalition', 'number_of_seats')
+              'is_coalition', 'number_of_seats', 'votes_count',
+              'votes_per_seat', 'discipline', 'coalition_discipline')
     allowed_methods = ('GET',)
     model = Party
 
+    def queryset(self, request):
+        return self.model.objects.select_related('voting_statistics')
+
     def read(self, request, **kwargs):
         if 'id' not in kwargs and 'q' in request.GET:
             q = urllib.unquote(request.GET['q'])
@@ -365,6 +369,27 @@ class PartyHandler(BaseHandler):
     def members(party):
         return party.members.values_list('id',flat=True)
 
+    @staticmethod
+    def votes_count(party):
+        return party.voting_statistics.votes_count()
+
+    @staticmethod
+    def votes_per_seat(party):
+        if party.number_of_seats:
+            return party.voting_statistics.votes_per_seat
+
+    @staticmethod
+    def discipline(party):
+        x = party.voting_statistics.discipline
+        if isinstance(x, float):
+            return x
+
+    @staticmethod
+    def coalition_discipline(party):
+        x = party.voting_statistics.coalition_discipline
+        if isinstance(x, float):
+            return x
+
 
 def read_helper(getter, success_case, fail_case, kwargs):
     # Handle API calls of type /agenda/[agenda_id]
@@ -465,7 +490,9 @@ class CommitteeHandler(BaseHandler, HandlerExtensions):
 
 class CommitteeMeetingHandler(BaseHandler, HandlerExtensions):
     # fields = ('committee__name', 'url', 'date', 'topics', 'protocol_text', 'src_url',
-    fields = (('committee', ('name', 'url')), 'url', 'date', 'topics', 'protocol_text', 'src_url',
+    # protocol_text is left out, so meeting lists don't read and send every
+    # protocol. single meetings are sent with it, see CommitteeMeetingProtocolHandler
+    fields = (('committee', ('name', 'url')), 'url', 'date', 'topics', 'src_url',
               'mks_attended',
               )
     allowed_methods = ('GET',)
@@ -479,12 +506,18 @@ class CommitteeMeetingHandler(BaseHandler, HandlerExtensions):
 
     def read(self, request, **kwargs):
         ''' returns a meeting or a list of meetings '''
-        r = super(CommitteeMeetingHandler, self).read(request, **kwargs)
         if 'id' in kwargs:
-            return r
-        else:
-            self.qs = r
-            return self.limit_by_request(request)
+            try:
+                return CommitteeMeetingProtocol.objects.get(pk=kwargs['id'])
+            except CommitteeMeetingProtocol.DoesNotExist:
+                return rc.NOT_FOUND
+        self.qs = super(CommitteeMeetingHandler, self).read(request, **kwargs)
+        return self.limit_by_request(request)
+
+class CommitteeMeetingProtocolHandler(CommitteeMeetingHandler):
+    ''' emits the single meetings read by CommitteeMeetingHandler '''
+    fields = CommitteeMeetingHandler.fields + ('protocol_text',)
+    model = CommitteeMeetingProtocol
 
 class EventHandler(BaseHandler, HandlerExtensions):
     # exclude = ('which_object')
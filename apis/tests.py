@@ -280,6 +280,10 @@ I have a deadline''')
         self.assertEqual(res_json['committee']['name'], self.committee_1.name)
         self.assertEqual(res_json['committee']['url'], self.committee_1.get_absolute_url())
         self.assertEqual(res_json['url'], self.meeting_1.get_absolute_url())
+        self.assertEqual(res_json['protocol_text'], self.meeting_1.protocol_text)
+        res = self.client.get(reverse('committee-meeting-handler'))
+        self.assertEqual(res.status_code, 200)
+        self.assertNotIn('protocol_text', json.loads(res.content)[0])
 
 class EventTest(TestCase):
     def setUp(self):
@@ -5,6 +5,7 @@ from django.contrib import admin
 from video.models import Video
 from models import Committee, CommitteeMeeting, Topic
 from links.models import Link
+from forms import CommitteeMeetingForm
 
 class CommitteeRelatedVideosInline(generic.GenericTabularInline):
     model = Video
@@ -32,6 +33,7 @@ admin.site.register(Committee, CommitteeAdmin)
 
 class CommitteeMeetingAdmin(admin.ModelAdmin):
     ordering = ('-date', )
+    form = CommitteeMeetingForm
 
 
 admin.site.register(CommitteeMeeting, CommitteeMeetingAdmin)
@@ -1,7 +1,7 @@
 from django import forms
 from django.forms.models import modelformset_factory
 
-from models import Topic
+from models import Topic, CommitteeMeeting
 from links.models import Link
 
 class EditTopicForm(forms.ModelForm):
@@ -9,6 +9,24 @@ class EditTopicForm(forms.ModelForm):
         model = Topic
         fields = ('title','description','committees')
 
+class CommitteeMeetingForm(forms.ModelForm):
+    # the protocol text is stored in ProtocolText, not in a model field
+    protocol_text = forms.CharField(widget=forms.Textarea, required=False)
+
+    class Meta:
+        model = CommitteeMeeting
+        exclude = ('protocol_parts_hash', 'protocol_fingerprint', 'protocol_signature', 'parts_summary')
+
+    def __init__(self, *args, **kwargs):
+        super(CommitteeMeetingForm, self).__init__(*args, **kwargs)
+        if self.instance.pk:
+            self.fields['protocol_text'].initial = self.instance.protocol_text
+
+    def save(self, commit=True):
+        if self.cleaned_data['protocol_text'] != (self.instance.protocol_text or u''):
+            self.instance.protocol_text = self.cleaned_data['protocol_text']
+        return super(CommitteeMeetingForm, self).save(commit)
+
 LinksFormset = modelformset_factory(Link,
                                     can_delete=True,
                                     fields=('url', 'title'),
@@ -0,0 +1,76 @@
+from __future__ import print_function
+
+import datetime
+from multiprocessing import Pool
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand, CommandError
+from django.db import transaction
+
+from committees.models import CommitteeMeeting, ProtocolPart, ProtocolText, split_protocol, protocol_hash
+
+# number of meetings whose protocols are read from the db at once
+CHUNK_SIZE = 100
+
+
+def _split(args):
+    """Splits a protocol in a pool worker"""
+    meeting_id, protocol_text = args
+    return meeting_id, protocol_hash(protocol_text), split_protocol(protocol_text)
+
+
+class Command(NoArgsCommand):
+
+    help = "Break the protocols of committee meetings to parts again, replacing their existing parts"
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--committee', action='store', dest='committee', type='int',
+            help="reparse only the meetings of the committee with this id"),
+        make_option('--since', action='store', dest='since',
+            help="reparse only meetings from this date on (YYYY-MM-DD)"),
+        make_option('--only-changed', action='store_true', dest='only_changed',
+            help="reparse only meetings whose protocol changed since their parts were created"),
+        make_option('--workers', action='store', dest='workers', type='int',
+            help="number of processes splitting the protocols (default: one per core)"),
+    )
+
+    def handle_noargs(self, **options):
+        # plenum protocols are parsed by parse_plenum_protocols
+        meetings = CommitteeMeeting.objects.exclude(committee__type='plenum').exclude(protocol_fingerprint='')
+        if options.get('committee'):
+            meetings = meetings.filter(committee=options['committee'])
+        if options.get('since'):
+            try:
+                since = datetime.datetime.strptime(options['since'], '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError('--since should be in the form YYYY-MM-DD')
+            meetings = meetings.filter(date__gte=since)
+        meeting_ids = list(meetings.order_by('id').values_list('id', flat=True))
+        only_changed = options.get('only_changed', False)
+        print("Reparsing the protocols of up to {0} meetings".format(len(meeting_ids)))
+
+        workers = options.get('workers')
+        pool = Pool(workers) if workers != 1 else None
+        reparsed = 0
+        try:
+            for i in range(0, len(meeting_ids), CHUNK_SIZE):
+                chunk = meeting_ids[i:i + CHUNK_SIZE]
+                parts_hashes = dict(CommitteeMeeting.objects.filter(id__in=chunk).values_list(
+                    'id', 'protocol_parts_hash'))
+                protocols = []
+                for meeting_id, protocol_text in ProtocolText.objects.iter_texts(chunk, CHUNK_SIZE):
+                    if not only_changed or protocol_hash(protocol_text) != parts_hashes[meeting_id]:
+                        protocols.append((meeting_id, protocol_text))
+                results = pool.imap_unordered(_split, protocols) if pool else map(_split, protocols)
+                for meeting_id, parts_hash, parts in results:
+                    with transaction.commit_on_success():
+                        ProtocolPart.objects.delete_for_meetings([meeting_id])
+                        ProtocolPart.objects.create_for_meeting(meeting_id, parts)
+                        CommitteeMeeting.objects.filter(id=meeting_id).update(protocol_parts_hash=parts_hash)
+                    reparsed += 1
+                print("{0}/{1}".format(min(i + CHUNK_SIZE, len(meeting_ids)), len(meeting_ids)))
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+        print("Reparsed {0} protocols".format(reparsed))
@@ -1,6 +1,12 @@
 # encoding: utf-8
 import re
+import zlib
+import json
+import base64
+import bisect
+import colorsys
 import logging
+import hashlib
 from datetime import datetime
 from django.db import models
 from django.utils.translation import ugettext_lazy as _, ugettext
@@ -70,12 +76,15 @@ class Committee(models.Model):
         If ids is not provided, this will return committee members. if ids is
         provided, this will return presence data for the given members.
         """
-        def count_percentage(res_set, total_count):
-            return (100 * res_set.count() / total_count) if total_count else 0
+        def count_percentage(count, total_count):
+            return (100 * count / total_count) if total_count else 0
 
         def filter_this_year(res_set):
             return res_set.filter(date__gte='%d-01-01' % datetime.now().year)
 
+        def count_by_member(meetings):
+            return dict(meetings.values_list('member').annotate(models.Count('id')))
+
         if ids is not None:
             members = list(Member.objects.filter(id__in=ids))
         else:
@@ -87,12 +96,16 @@ class Committee(models.Model):
         all_meet_count = self.meetings.filter(date__gte=d).count()
 
         year_meet_count = filter_this_year(self.meetings).count()
+        # the meetings each member attended are counted in two grouped queries
+        attended = CommitteeMeeting.mks_attended.through.objects.filter(
+            committeemeeting__committee=self, committeemeeting__date__gte=d,
+            member__in=[m.id for m in members])
+        all_counts = count_by_member(attended)
+        year_counts = count_by_member(attended.filter(
+            committeemeeting__date__gte='%d-01-01' % datetime.now().year))
         for m in members:
-            all_member_meetings = m.committee_meetings.filter(committee=self,
-                                                              date__gte=d)
-            year_member_meetings = filter_this_year(all_member_meetings)
-            m.meetings_percentage = count_percentage(all_member_meetings, all_meet_count)
-            m.meetings_percentage_year = count_percentage(year_member_meetings, year_meet_count)
+            m.meetings_percentage = count_percentage(all_counts.get(m.id, 0), all_meet_count)
+            m.meetings_percentage_year = count_percentage(year_counts.get(m.id, 0), year_meet_count)
 
         members.sort(key=lambda x: x.meetings_percentage, reverse=True)
         return members
@@ -141,13 +154,127 @@ def legitimate_header(line):
         return True
     return line.endswith(':') and len(line)<=50 and not not_header.search(line)
 
+def protocol_hash(protocol_text):
+    """The sha1 of a protocol text, identifying the text parts were created from"""
+    return hashlib.sha1((protocol_text or u'').encode('utf8')).hexdigest()
+
+# number of hashes in a protocol signature, and of words in each shingle
+SIGNATURE_HASHES = 16
+SHINGLE_WORDS = 5
+# signature similarity above which two protocols are of the same meeting
+NEAR_DUPLICATE_SIMILARITY = 0.8
+
+def _protocol_words(protocol_text):
+    """The words of a protocol text, without the markup of plenum protocols"""
+    return re.sub(r'<[^>]*>', ' ', protocol_text or u'').split()
+
+def protocol_fingerprint(protocol_text):
+    """The sha1 of a protocol text, ignoring markup and whitespace, so
+       duplicate meetings have the same fingerprint. Empty for empty texts.
+    """
+    words = _protocol_words(protocol_text)
+    if not words:
+        return ''
+    return hashlib.sha1(u' '.join(words).encode('utf8')).hexdigest()
+
+def protocol_signature(protocol_text):
+    """A bottom-k sketch of the word shingles of a protocol text: the
+       SIGNATURE_HASHES smallest shingle hashes, as fixed width hex digits.
+       Near duplicate protocols have similar signatures.
+    """
+    words = _protocol_words(protocol_text)
+    if not words:
+        return ''
+    hashes = set(hashlib.sha1(u' '.join(words[i:i+SHINGLE_WORDS]).encode('utf8')).hexdigest()[:8]
+                 for i in range(max(1, len(words) - SHINGLE_WORDS + 1)))
+    return ''.join(sorted(hashes)[:SIGNATURE_HASHES])
+
+def signature_similarity(signature1, signature2):
+    """Estimates the fraction of shingles two protocols share, from their
+       signatures"""
+    hashes1 = set(signature1[i:i+8] for i in range(0, len(signature1), 8))
+    hashes2 = set(signature2[i:i+8] for i in range(0, len(signature2), 8))
+    smallest = sorted(hashes1 | hashes2)[:SIGNATURE_HASHES]
+    if not smallest:
+        return 0.0
+    return float(len([h for h in smallest if h in hashes1 and h in hashes2])) / len(smallest)
+
+def compress_protocol(protocol_text):
+    """zlib compresses a protocol text, base64 encoded for a text column"""
+    if isinstance(protocol_text, str):
+        protocol_text = protocol_text.decode('utf8')
+    return base64.b64encode(zlib.compress(protocol_text.encode('utf8'), 9))
+
+def decompress_protocol(data):
+    """The protocol text compressed by compress_protocol"""
+    return zlib.decompress(base64.b64decode(data)).decode('utf8')
+
+def summarize_parts(parts):
+    """Summarizes the parts of a meeting for showing its protocol page by
+       page. parts are (order, header, speaker's member id) of all the parts.
+       Returns a dict of the number of parts, the order of the first part of
+       each page, and the colors of the speakers by header.
+    """
+    parts = sorted(parts)
+    speakers = sorted(set((mk is None, mk, header) for order, header, mk in parts))
+    colors = {}
+    for (i, (no_mk, mk, header)) in enumerate(speakers):
+        (r, g, b) = colorsys.hsv_to_rgb(float(i)/len(speakers), 0.3 if no_mk else 0.5, 255)
+        colors[header] = 'rgb(%i, %i, %i)' % (r, g, b)
+    return {'count': len(parts),
+            'pages': [order for order, header, mk in parts[::COMMITTEE_PROTOCOL_PAGINATE_BY]],
+            'colors': colors}
+
+def split_protocol(protocol_text):
+    """Breaks a committee protocol text to its parts.
+       Returns a list of (order, header, body) of the parts.
+    """
+    # first, fix places where the colon is in the begining of next line
+    # (move it to the end of the correct line)
+    lines = []
+    for line in re.sub("[ ]+"," ", protocol_text).split('\n'):
+        #if re.match(r'^\<.*\>\W*$',line): # this line start and ends with
+        #                                  # <...>. need to remove it.
+        #    line = line[1:-1]
+        if line.startswith(':'):
+            lines[-1] += ':'
+            lines.append(line[1:])
+        else:
+            lines.append(line)
+
+    parts = []
+    i = 1
+    section = []
+    header = ''
+    # now create the sections
+    for line in lines:
+        if legitimate_header(line):
+            if i > 1 or section:
+                parts.append((i, header, '\n'.join(section)))
+            i += 1
+            header = re.sub(r'(^[\< ]+)|([\>:]+$)','',line)
+            section = []
+        else:
+            section.append(line)
+
+    # don't forget the last section
+    parts.append((i, header, '\n'.join(section)))
+    return parts
+
 class CommitteeMeeting(models.Model):
     committee = models.ForeignKey(Committee, related_name='meetings')
     date_string = models.CharField(max_length=256)
     date = models.DateField(db_index=True)
     mks_attended = models.ManyToManyField('mks.Member', related_name='committee_meetings')
     votes_mentioned = models.ManyToManyField('laws.Vote', related_name='committee_meetings', blank=True)
-    protocol_text = models.TextField(null=True,blank=True)
+    # protocol_hash of the protocol text the parts were created from
+    protocol_parts_hash = models.CharField(max_length=40, blank=True, default='')
+    # summarize_parts of the parts, as json. empty until first needed
+    parts_summary = models.TextField(blank=True, default='')
+    # protocol_fingerprint and protocol_signature of the protocol text, set
+    # on save. the fingerprint is empty for meetings without a protocol
+    protocol_fingerprint = models.CharField(max_length=40, blank=True, default='', db_index=True)
+    protocol_signature = models.CharField(max_length=8*SIGNATURE_HASHES, blank=True, default='')
     topics = models.TextField(null=True,blank=True)
     src_url  = models.URLField(max_length=1024,null=True,blank=True)
 
@@ -191,22 +318,60 @@ class CommitteeMeeting(models.Model):
 
     tags = property(Tag.objects.get_for_object, Tag.objects.update_tags)
 
+    def _get_protocol_text(self):
+        # the text is kept compressed in ProtocolText, and read on first access
+        if not hasattr(self, '_protocol_text'):
+            self._protocol_text = ProtocolText.objects.texts([self.id]).get(self.id) if self.id else None
+        return self._protocol_text
+
+    def _set_protocol_text(self, protocol_text):
+        if isinstance(protocol_text, str):
+            protocol_text = protocol_text.decode('utf8')
+        self._protocol_text = protocol_text
+        self._protocol_text_changed = True
+
+    protocol_text = property(_get_protocol_text, _set_protocol_text)
+
+    @property
+    def has_protocol(self):
+        """Whether the meeting has a protocol, without reading it"""
+        return bool(self.protocol_fingerprint)
+
     def save(self, **kwargs):
+        protocol_changed = getattr(self, '_protocol_text_changed', False)
+        if protocol_changed:
+            self.protocol_fingerprint = protocol_fingerprint(self._protocol_text)
+            self.protocol_signature = protocol_signature(self._protocol_text)
         super(CommitteeMeeting, self).save(**kwargs)
-
-    def create_protocol_parts(self, delete_existing=False, mks=None, mk_names=None):
+        if protocol_changed:
+            ProtocolText.objects.set_text(self.id, self._protocol_text)
+            self._protocol_text_changed = False
+
+    def get_parts_summary(self):
+        """Returns the summarize_parts of the meeting's parts, computing and
+           storing it if it isn't stored"""
+        if not self.parts_summary:
+            self.parts_summary = json.dumps(summarize_parts(
+                self.parts.values_list('order', 'header', 'speaker__mk')))
+            CommitteeMeeting.objects.filter(pk=self.pk).update(parts_summary=self.parts_summary)
+        return json.loads(self.parts_summary)
+
+    def page_of(self, order):
+        """The protocol page number of the part with the given order"""
+        return max(1, bisect.bisect_right(self.get_parts_summary()['pages'], order))
+
+    def create_protocol_parts(self, delete_existing=False, name_matcher=None):
         """ Create protocol parts from this instance's protocol_text
             Optionally, delete existing parts.
+            name_matcher is the MemberNameMatcher plenum protocols are
+            searched for attending members with (all members by default).
             If the meeting already has parts, and you don't ask to
             delete them, a ValidationError will be thrown, because
             it doesn't make sense to create the parts again.
         """
         if delete_existing:
-            ppct = ContentType.objects.get_for_model(ProtocolPart)
-            annotations = Annotation.objects.filter(content_type=ppct, object_id__in=self.parts.all)
-            logger.debug('deleting %d annotations, because I was asked to delete the relevant protocol parts on cm.id=%d' % (annotations.count(), self.id))
-            annotations.delete()
-            self.parts.all().delete()
+            logger.debug('deleting the protocol parts of cm.id=%d and their annotations' % self.id)
+            ProtocolPart.objects.delete_for_meetings([self.id])
         else:
             if self.parts.count():
                 raise ValidationError('CommitteeMeeting already has parts. delete them if you want to run create_protocol_parts again.')
@@ -214,41 +379,12 @@ class CommitteeMeeting(models.Model):
             return # then we don't need to do anything here.
 
         if self.committee.type=='plenum':
-            create_plenum_protocol_parts(self,mks=mks,mk_names=mk_names)
+            create_plenum_protocol_parts(self,name_matcher=name_matcher)
             return
 
-        # break the protocol to its parts
-        # first, fix places where the colon is in the begining of next line
-        # (move it to the end of the correct line)
-        protocol_text = []
-        for line in re.sub("[ ]+"," ", self.protocol_text).split('\n'):
-            #if re.match(r'^\<.*\>\W*$',line): # this line start and ends with
-            #                                  # <...>. need to remove it.
-            #    line = line[1:-1]
-            if line.startswith(':'):
-                protocol_text[-1] += ':'
-                protocol_text.append(line[1:])
-            else:
-                protocol_text.append(line)
-
-        i = 1
-        section = []
-        header = ''
-        # now create the sections
-        for line in protocol_text:
-            if legitimate_header(line):
-                if i > 1 or section:
-                    ProtocolPart(meeting=self, order=i,
-                        header=header, body='\n'.join(section)).save()
-                i += 1
-                header = re.sub(r'(^[\< ]+)|([\>:]+$)','',line)
-                section = []
-            else:
-                section.append(line)
-
-        # don't forget the last section
-        ProtocolPart(meeting=self, order=i,
-            header=header, body='\n'.join(section)).save()
+        self.parts_summary = ProtocolPart.objects.create_for_meeting(self.id, split_protocol(self.protocol_text))
+        self.protocol_parts_hash = protocol_hash(self.protocol_text)
+        CommitteeMeeting.objects.filter(pk=self.pk).update(protocol_parts_hash=self.protocol_parts_hash)
 
     def get_bg_material(self):
         """
@@ -277,10 +413,70 @@ class CommitteeMeeting(models.Model):
                     content_type=ContentType.objects.get_for_model(CommitteeMeeting).id)
 
 
+class CommitteeMeetingProtocol(CommitteeMeeting):
+    """A committee meeting the API sends with its protocol text"""
+    class Meta:
+        proxy = True
+
+
+class ProtocolTextManager(models.Manager):
+    def texts(self, meeting_ids):
+        """Returns a dict of the protocol texts of the given meetings, by
+           meeting id. Meetings without a protocol are missing"""
+        return dict((meeting_id, decompress_protocol(data)) for meeting_id, data in
+                    self.filter(meeting__in=meeting_ids).values_list('meeting', 'data'))
+
+    def iter_texts(self, meeting_ids, chunk_size=100):
+        """Yields (meeting id, protocol text) of the given meetings that have
+           a protocol, reading chunk_size protocols at a time"""
+        meeting_ids = list(meeting_ids)
+        for i in range(0, len(meeting_ids), chunk_size):
+            texts = self.texts(meeting_ids[i:i+chunk_size])
+            for meeting_id in meeting_ids[i:i+chunk_size]:
+                if meeting_id in texts:
+                    yield meeting_id, texts[meeting_id]
+
+    def set_text(self, meeting_id, protocol_text):
+        """Stores the protocol text of a meeting, or deletes it if empty"""
+        if not protocol_text:
+            self.filter(meeting=meeting_id).delete()
+        elif self.filter(meeting=meeting_id).update(data=compress_protocol(protocol_text)) == 0:
+            self.create(meeting_id=meeting_id, data=compress_protocol(protocol_text))
+
+class ProtocolText(models.Model):
+    """The protocol text of a committee meeting, kept compressed apart from
+       the meetings, so loading meetings doesn't read their protocols.
+       Accessed through CommitteeMeeting.protocol_text.
+    """
+    meeting = models.OneToOneField(CommitteeMeeting, primary_key=True, related_name='+')
+    data = models.TextField()
+    objects = ProtocolTextManager()
+
 class ProtocolPartManager(models.Manager):
     def list(self):
         return self.order_by("order")
 
+    def delete_for_meetings(self, meeting_ids):
+        """Deletes the parts of the given meetings, and their annotations"""
+        parts = self.filter(meeting__in=meeting_ids)
+        ppct = ContentType.objects.get_for_model(self.model)
+        Annotation.objects.filter(content_type=ppct,
+                                  object_id__in=list(parts.values_list('id', flat=True))).delete()
+        parts.delete()
+        CommitteeMeeting.objects.filter(id__in=meeting_ids).update(parts_summary='')
+
+    def create_for_meeting(self, meeting_id, parts, types=None):
+        """Creates the given (order, header, body) parts of a meeting in bulk,
+           and stores their summary, which is returned. types are the types
+           of the parts, if any"""
+        parts = list(parts)
+        types = types or [''] * len(parts)
+        self.bulk_create([self.model(meeting_id=meeting_id, order=order, header=header, body=body, type=type)
+                          for (order, header, body), type in zip(parts, types)])
+        parts_summary = json.dumps(summarize_parts((order, header, None) for order, header, body in parts))
+        CommitteeMeeting.objects.filter(id=meeting_id).update(parts_summary=parts_summary)
+        return parts_summary
+
 class ProtocolPart(models.Model):
     meeting = models.ForeignKey(CommitteeMeeting, related_name='parts')
     order = models.IntegerField()
@@ -299,7 +495,7 @@ class ProtocolPart(models.Model):
         if self.order == 1:
             return self.meeting.get_absolute_url()
         else:
-            page_num = 1 + (self.order-1)/COMMITTEE_PROTOCOL_PAGINATE_BY
+            page_num = self.meeting.page_of(self.order)
             if page_num==1: # this is on first page
                 return "%s#speech-%d-%d" % (self.meeting.get_absolute_url(),
                                             self.meeting.id, self.order)
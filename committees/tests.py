@@ -2,16 +2,21 @@ from datetime import datetime, timedelta
 from django.test import TestCase
 from django.conf import settings
 from django.core.urlresolvers import reverse
+from django.core.management import call_command
 from django.contrib.auth.models import User,Group,Permission
 from django.contrib.contenttypes.models import ContentType
 import unittest
+import json
 from annotatetext.models import Annotation
 from actstream.models import Action
 from tagging.models import Tag, TaggedItem
 from laws.models import Bill
-from mks.models import Member, Knesset
+from mks.models import Member, Knesset, Party, Membership
+from mks.name_matcher import get_member_name_matcher
+from plenum.create_protocol_parts import PlenumProtocolParser
+from plenum.management.commands.parse_plenum_protocols_subcommands import download
 from links.models import LinkType
-from models import Committee, CommitteeMeeting, Topic
+from models import Committee, CommitteeMeeting, ProtocolText, Topic
 from models import TOPIC_REJECTED
 
 just_id = lambda x: x.id
@@ -61,6 +66,29 @@ I have a deadline''')
         self.assertEqual(parts_list[1].header, u'adrian')
         self.assertEqual(parts_list[1].body, 'I have a deadline')
 
+    def testReparseProtocols(self):
+        meeting_2_parts = list(self.meeting_2.parts.values_list('id', flat=True))
+        ProtocolText.objects.set_text(self.meeting_1.id, 'jacob:\nhello\nadrian:\nhi\ncharlie:\nbye')
+        call_command('reparse_protocols', only_changed=True, workers=1)
+        self.assertEqual(list(self.meeting_1.parts.list().values_list('header', 'body')),
+                         [(u'jacob', u'hello'), (u'adrian', u'hi'), (u'charlie', u'bye')])
+        # unchanged protocols are not reparsed
+        self.assertEqual(list(self.meeting_2.parts.values_list('id', flat=True)), meeting_2_parts)
+
+    def testProtocolText(self):
+        self.assertNotIn('protocol_text', CommitteeMeeting.objects.filter(id=self.meeting_1.id).values()[0])
+        meeting = CommitteeMeeting.objects.get(id=self.meeting_1.id)
+        self.assertTrue(meeting.has_protocol)
+        self.assertEqual(meeting.protocol_text, u'jacob:\nI am a perfectionist\nadrian:\nI have a deadline')
+        meeting.protocol_text = u'\u05e9\u05dc\u05d5\u05dd'
+        meeting.save()
+        self.assertEqual(ProtocolText.objects.texts([meeting.id]), {meeting.id: u'\u05e9\u05dc\u05d5\u05dd'})
+        meeting.protocol_text = ''
+        meeting.save()
+        meeting = CommitteeMeeting.objects.get(id=self.meeting_1.id)
+        self.assertFalse(meeting.has_protocol)
+        self.assertEqual(meeting.protocol_text, None)
+
     def testPartAnnotation(self):
         '''this is more about testing the annotatext app '''
         self.assertTrue(self.client.login(username='jacob', password='JKM'))
@@ -182,6 +210,22 @@ I have a deadline''')
                          [self.mk_1.id],
                          'members has wrong objects: %s' % members)
 
+    def test_committee_meeting_pages(self):
+        protocol = '\n'.join('speaker %d:\nspeech %d' % (i % 3, i) for i in range(250))
+        meeting = self.committee_1.meetings.create(date=datetime.now(), protocol_text=protocol)
+        meeting.create_protocol_parts()
+        res = self.client.get(meeting.get_absolute_url(), {'page': 2})
+        self.assertEqual(res.status_code, 200)
+        parts = list(res.context['parts'])
+        self.assertEqual(len(parts), 120)
+        self.assertEqual(parts[0].body, 'speech 120')
+        self.assertEqual(set(json.loads(res.context['parts_lengths'])), set(str(part.id) for part in parts))
+        self.assertEqual(len(res.context['colors']), 3)
+        self.assertEqual(parts[0].get_absolute_url(), '%s?page=2#speech-%d-%d' % (
+            meeting.get_absolute_url(), meeting.id, parts[0].order))
+        res = self.client.get(meeting.get_absolute_url(), {'page': 4})
+        self.assertEqual(res.status_code, 404)
+
     def testLoginRequired(self):
         res = self.client.post(reverse('committee-meeting',
                            kwargs={'pk': self.meeting_1.id}))
@@ -280,6 +324,64 @@ I have a deadline''')
         self.mk_1.delete()
         self.topic.delete()
 
+class PlenumProtocolParserTest(TestCase):
+
+    def test_parse(self):
+        mk = Member.objects.create(name='mk 1')
+        Membership.objects.create(member=mk, party=Party.objects.create(name='party'),
+                                  start_date=datetime(2010, 1, 1).date())
+        protocol = u"""<document>
+<para><emphasis>opening</emphasis></para>
+<para>the meeting opened</para>
+<para><emphasis>mk 1:</emphasis></para>
+<para>a speech long enough to count as attending the meeting</para>
+<para><emphasis>mk 2:</emphasis></para>
+<para>a speech long enough to count as attending the meeting</para>
+</document>"""
+        parser = PlenumProtocolParser(datetime(2012, 1, 1).date(), get_member_name_matcher())
+        parts, mks_attended = parser.parse(protocol)
+        self.assertEqual([(order, header, type) for order, header, body, type in parts],
+                         [(0, u'opening', 'title'), (1, u'mk 1:', 'speaker'), (2, u'mk 2:', 'speaker')])
+        self.assertEqual(parts[0][2], u'the meeting opened')
+        self.assertEqual(mks_attended, set([mk.id]))
+        # each parser starts from a clean state
+        parser = PlenumProtocolParser(datetime(2012, 1, 1).date(), get_member_name_matcher())
+        self.assertEqual(len(parser.parse(u'<document></document>')[0]), 0)
+
+class PlenumDownloadTest(TestCase):
+
+    def test_update_db_skips_unchanged(self):
+        plenum = Committee.objects.create(name='plenum', type='plenum')
+        download._updateDb('<document>1</document>', 'http://example.com/1.doc', '2012', '01', '01')
+        meeting = CommitteeMeeting.objects.get(committee=plenum)
+        meeting.parts.create(order=0, header='header', body='body')
+        # an unchanged protocol keeps its parts
+        download._updateDb('<document>1</document>', 'http://example.com/1.doc', '2012', '01', '01')
+        self.assertEqual(meeting.parts.count(), 1)
+        # a changed one is parsed again
+        download._updateDb('<document>2</document>', 'http://example.com/1.doc', '2012', '01', '01')
+        self.assertEqual(meeting.parts.count(), 0)
+        self.assertEqual(CommitteeMeeting.objects.get(id=meeting.id).protocol_text, '<document>2</document>')
+
+    def test_update_db_merges_duplicates(self):
+        plenum = Committee.objects.create(name='plenum', type='plenum')
+        words = ' '.join('word%d' % i for i in range(200))
+        download._updateDb('<document>%s</document>' % words, 'http://example.com/1.doc', '2012', '01', '01')
+        meeting = CommitteeMeeting.objects.get(committee=plenum)
+        meeting.parts.create(order=0, header='header', body='body')
+        # the same protocol with different markup is the same meeting, which is kept as it is
+        download._updateDb('<document><para>%s</para></document>' % words, 'http://example.com/2.doc', '2012', '01', '01')
+        self.assertEqual(list(CommitteeMeeting.objects.filter(committee=plenum).values_list('id', 'src_url')),
+                         [(meeting.id, 'http://example.com/1.doc')])
+        self.assertEqual(meeting.parts.count(), 1)
+        # a longer near duplicate replaces it
+        download._updateDb('<document>%s more words</document>' % words, 'http://example.com/3.doc', '2012', '01', '01')
+        replaced = CommitteeMeeting.objects.get(committee=plenum)
+        self.assertEqual(replaced.id, meeting.id)
+        self.assertEqual(replaced.src_url, 'http://example.com/3.doc')
+        self.assertEqual(meeting.parts.count(), 0)
+        self.assertTrue(replaced.protocol_text.endswith('more words</document>'))
+
 class TopicsTest(TestCase):
 
     def setUp(self):
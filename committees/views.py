@@ -1,7 +1,6 @@
 import datetime
 import re
 
-import colorsys
 import difflib
 import logging
 import tagging
@@ -11,6 +10,7 @@ from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.contrib.contenttypes.models import ContentType
 from django.core.cache import cache
+from django.core.paginator import Paginator, InvalidPage
 from django.core.urlresolvers import reverse
 from django.http import (HttpResponse, HttpResponseRedirect, Http404,
                          HttpResponseForbidden)
@@ -102,12 +102,18 @@ class MeetingDetailView(DetailView):
     def get_context_data(self, *args, **kwargs):
         context = super(MeetingDetailView, self).get_context_data(*args, **kwargs)
         cm = context['object']
-        colors = {}
-        speakers = cm.parts.order_by('speaker__mk').values_list('header','speaker__mk').distinct()
-        n = speakers.count()
-        for (i,(p,mk)) in enumerate(speakers):
-            (r,g,b) = colorsys.hsv_to_rgb(float(i)/n, 0.5 if mk else 0.3, 255)
-            colors[p] = 'rgb(%i, %i, %i)' % (r, g, b)
+        # only the parts of the requested page are read, using the stored summary of the parts
+        summary = cm.get_parts_summary()
+        paginator = Paginator(range(summary['count']), models.COMMITTEE_PROTOCOL_PAGINATE_BY)
+        try:
+            page_obj = paginator.page(self.request.GET.get('page', 1))
+        except InvalidPage:
+            raise Http404
+        parts = cm.parts.list()
+        if summary['pages']:
+            parts = parts.filter(order__gte=summary['pages'][page_obj.number-1])
+            if page_obj.has_next():
+                parts = parts.filter(order__lt=summary['pages'][page_obj.number])
         context['title'] = _('%(committee)s meeting on %(date)s') % {'committee':cm.committee.name, 'date':cm.date_string}
         context['description'] = _('%(committee)s meeting on %(date)s on topic %(topic)s') \
                                    % {'committee':cm.committee.name,
@@ -117,11 +123,11 @@ class MeetingDetailView(DetailView):
         page = self.request.GET.get('page', None)
         if page:
             context['description'] += _(' page %(page)s') % {'page': page}
-        context['colors'] = colors
-        parts_lengths = {}
-        for part in cm.parts.all():
-            parts_lengths[part.id] = len(part.body)
-        context['parts_lengths'] = json.dumps(parts_lengths)
+        context['colors'] = summary['colors']
+        context['parts'] = parts
+        context['paginator'] = paginator
+        context['page_obj'] = page_obj
+        context['parts_lengths'] = json.dumps(dict((part.id, len(part.body)) for part in parts))
         context['paginate_by'] = models.COMMITTEE_PROTOCOL_PAGINATE_BY
 
         if cm.committee.type == 'plenum':
@@ -0,0 +1,235 @@
+'''
+Shared HTTP fetching for the scrapers.
+
+A Fetcher rate limits the requests to each host, retries failed requests with
+exponential backoff, and keeps the fetched pages in an on-disk cache:
+
+* bodies are stored once per content, under objects/ by their sha1
+* each request (url + POST data) has a small json entry under requests/
+  pointing to its body, along with the ETag and Last-Modified headers
+
+Entries younger than max_age are served without touching the network. Older
+ones are revalidated with a conditional request, and served from the cache
+if the server answers 304. max_age defaults to 0, since most scraped pages
+are indexes that change, and callers fetching documents that don't (protocols,
+bill texts) pass document_max_age(). In replay mode everything is served from the
+cache, and requests that aren't cached fail, so parsers can be re-run and
+tested offline.
+
+prefetch() fetches urls in the background with a bounded thread pool, so
+callers walking a list of pages can keep a few requests in flight while
+they parse the current one. At most MAX_PENDING prefetched results that were
+not fetched yet are kept.
+'''
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import urllib2
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+from urlparse import urlparse
+
+from django.conf import settings
+
+logger = logging.getLogger("open-knesset.fetcher")
+
+# HTTP status codes worth retrying
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# number of prefetched results kept until they are fetched
+MAX_PENDING = 1000
+
+
+class FetchError(IOError):
+    pass
+
+
+class Fetcher(object):
+
+    def __init__(self, cache_dir=None, max_age=0, replay=False, workers=4,
+                 min_interval=1.0, retries=5, backoff=1.0, timeout=60):
+        """
+        :param cache_dir: directory of the on-disk cache, or None for no cache
+        :param max_age: seconds a cached page is served without revalidation
+        :param replay: serve only from the cache, never from the network
+        :param workers: number of threads used by prefetch
+        :param min_interval: minimal seconds between two requests to a host
+        :param retries: number of retries of failed requests
+        :param backoff: seconds to wait before the first retry, doubled on
+                        each further retry
+        :param timeout: socket timeout of each request, in seconds
+        """
+        self.cache_dir = cache_dir
+        self.max_age = max_age
+        self.replay = replay
+        self.workers = workers
+        self.min_interval = min_interval
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._next_request = {}  # host -> earliest time of the next request
+        self._pending = OrderedDict()  # request key -> AsyncResult of prefetch
+        self._pool = None
+
+    def fetch(self, url, data=None, max_age=None):
+        """Returns the body of url (POSTing data if given) as a str.
+        max_age overrides the fetcher's max_age for this request.
+        Raises FetchError if it couldn't be fetched"""
+        key = self._key(url, data)
+        with self._lock:
+            pending = self._pending.pop(key, None)
+        if pending is not None:
+            return pending.get()
+        return self._fetch(url, data, key, max_age)
+
+    def prefetch(self, urls, data=None, max_age=None):
+        """Starts fetching urls in the background. Later fetch calls of the
+        same urls wait for these results instead of fetching again"""
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPool(self.workers)
+            for url in urls:
+                key = self._key(url, data)
+                if key not in self._pending:
+                    self._pending[key] = self._pool.apply_async(self._fetch, (url, data, key, max_age))
+            self._trim_pending()
+
+    def _trim_pending(self):
+        """Drops the oldest completed prefetches beyond MAX_PENDING, which
+        no one fetched"""
+        for key in list(self._pending):
+            if len(self._pending) <= MAX_PENDING:
+                break
+            if self._pending[key].ready():
+                del self._pending[key]
+
+    def _key(self, url, data):
+        if isinstance(url, unicode):
+            url = url.encode('utf8')
+        return hashlib.sha1('%s\n%s' % (url, data or '')).hexdigest()
+
+    def _fetch(self, url, data, key, max_age=None):
+        if max_age is None:
+            max_age = self.max_age
+        entry = self._read_entry(key)
+        if entry is not None:
+            if self.replay or time.time() - entry['fetched'] < max_age:
+                return self._read_object(entry['object'])
+        elif self.replay:
+            raise FetchError('%s is not in the fetch cache' % url)
+
+        headers = {}
+        if entry is not None:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+        for attempt in range(self.retries + 1):
+            if attempt:
+                delay = self.backoff * 2 ** (attempt - 1)
+                logger.warn('retrying %s in %.0f seconds (# of retries = %d)' % (url, delay, attempt))
+                time.sleep(delay)
+            self._wait_for_host(url)
+            try:
+                response = urllib2.urlopen(urllib2.Request(url, data, headers), timeout=self.timeout)
+                body = response.read()
+            except urllib2.HTTPError, e:
+                if e.code == 304 and entry is not None:
+                    entry['fetched'] = time.time()
+                    self._write_entry(key, entry)
+                    return self._read_object(entry['object'])
+                if e.code not in RETRY_STATUSES:
+                    raise FetchError('%s: %s' % (url, e))
+                error = e
+            except Exception, e:  # URLError, socket errors and timeouts
+                error = e
+            else:
+                if self.cache_dir:
+                    self._write_entry(key, {
+                        'url': url,
+                        'data': data,
+                        'etag': response.info().getheader('ETag'),
+                        'last_modified': response.info().getheader('Last-Modified'),
+                        'object': self._write_object(body),
+                        'fetched': time.time()})
+                return body
+        raise FetchError('%s: failed %d times, last error: %s' % (url, self.retries + 1, error))
+
+    def _wait_for_host(self, url):
+        host = urlparse(url).netloc
+        with self._lock:
+            now = time.time()
+            at = max(now, self._next_request.get(host, 0))
+            self._next_request[host] = at + self.min_interval
+        if at > now:
+            time.sleep(at - now)
+
+    def _path(self, kind, name):
+        return os.path.join(self.cache_dir, kind, name[:2], name)
+
+    def _write_file(self, path, content):
+        """Writes content to path atomically, so concurrent readers never see
+        partial files"""
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:  # created by another thread
+                pass
+        fd, tmp = tempfile.mkstemp(dir=directory)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+        os.rename(tmp, path)
+
+    def _read_entry(self, key):
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self._path('requests', key)) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return None
+
+    def _write_entry(self, key, entry):
+        self._write_file(self._path('requests', key), json.dumps(entry))
+
+    def _read_object(self, name):
+        with open(self._path('objects', name), 'rb') as f:
+            return f.read()
+
+    def _write_object(self, body):
+        name = hashlib.sha1(body).hexdigest()
+        path = self._path('objects', name)
+        if not os.path.exists(path):
+            self._write_file(path, body)
+        return name
+
+
+_fetcher = None
+
+
+def get_fetcher():
+    """Returns the process wide fetcher, configured by the FETCH_* settings"""
+    global _fetcher
+    if _fetcher is None:
+        _fetcher = Fetcher(cache_dir=getattr(settings, 'FETCH_CACHE_DIR', None),
+                           max_age=getattr(settings, 'FETCH_CACHE_MAX_AGE', 0),
+                           replay=getattr(settings, 'FETCH_REPLAY', False),
+                           workers=getattr(settings, 'FETCH_WORKERS', 4),
+                           min_interval=getattr(settings, 'FETCH_MIN_INTERVAL', 1.0),
+                           retries=getattr(settings, 'FETCH_RETRIES', 5))
+    return _fetcher
+
+
+def fetch(url, data=None, max_age=None):
+    return get_fetcher().fetch(url, data, max_age)
+
+
+def document_max_age():
+    """The max age of fetched documents, which don't change once published"""
+    return getattr(settings, 'FETCH_DOCUMENT_MAX_AGE', 0)
@@ -0,0 +1,65 @@
+'''
+Multi-pattern substring matching.
+
+MultiMatcher compiles a set of patterns into an Aho-Corasick automaton once,
+and then finds all the patterns occurring in a text in a single pass over it,
+instead of searching the text once per pattern. Texts and patterns are matched
+as given, so callers should normalize both the same way (e.g. with cannonize).
+'''
+from collections import deque
+
+
+class MultiMatcher(object):
+
+    def __init__(self, patterns):
+        """
+        :param patterns: iterable of (key, pattern) pairs. Several patterns
+                         can share a key, and empty patterns are ignored
+        """
+        self._goto = [{}]  # state -> {char: next state}
+        self._fail = [0]   # state -> longest proper suffix state
+        self._keys = [()]  # state -> keys of the patterns ending there
+        for key, pattern in patterns:
+            if pattern:
+                self._add(key, pattern)
+        self._build()
+
+    def _add(self, key, pattern):
+        state = 0
+        for char in pattern:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._keys.append(())
+                self._goto[state][char] = next_state
+            state = next_state
+        self._keys[state] += (key,)
+
+    def _build(self):
+        """Computes the failure links breadth first, merging the keys of
+        every state with those of its failure state"""
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                self._keys[next_state] += self._keys[self._fail[next_state]]
+
+    def find(self, text):
+        """Returns the set of keys of the patterns occurring in text"""
+        goto, fail, keys = self._goto, self._fail, self._keys
+        found = set()
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if keys[state]:
+                found.update(keys[state])
+        return found
@@ -235,6 +235,25 @@ CACHES = {
 
 LONG_CACHE_TIME = 18000  # 5 hours
 
+# on-disk cache of the pages fetched by the scrapers (see knesset/fetcher.py).
+# pages younger than FETCH_CACHE_MAX_AGE seconds are not fetched again, older
+# ones are revalidated. documents that don't change once published (protocols,
+# bill texts) use FETCH_DOCUMENT_MAX_AGE instead. FETCH_REPLAY serves only
+# from the cache, for running the parsers offline
+FETCH_CACHE_DIR = os.path.join(DATA_ROOT, 'fetch_cache', '')
+FETCH_CACHE_MAX_AGE = 0
+FETCH_DOCUMENT_MAX_AGE = 3600 * 24 * 7
+FETCH_REPLAY = False
+
+# cache of the RTF documents converted by syncdata (see simple/rtf.py), by
+# content hash. RTF_WORKERS conversion processes are used, one per core if None
+RTF_CACHE_DIR = os.path.join(DATA_ROOT, 'rtf_cache', '')
+RTF_WORKERS = None
+
+# number of antiword processes converting the downloaded plenum protocols.
+# the .doc files and their conversions are kept under DATA_ROOT/plenum_protocols
+ANTIWORD_WORKERS = 4
+
 ANNOTATETEXT_FLAGS = (
     gettext('Statement'),
     gettext('Funny :-)'),
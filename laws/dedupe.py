@@ -0,0 +1,78 @@
+'''
+Finding and merging duplicate laws and bills.
+
+Laws are duplicates if their cannonized titles are equal, and so are bills of
+the same law. Both are grouped by that canonical key in a single pass, so
+planning the merges is linear in the number of laws and bills. A plan is a
+list of (target id, [duplicate ids]) pairs, which can be reported before (or
+instead of) being applied.
+'''
+import logging
+from collections import OrderedDict
+
+from django.db import transaction
+from django.db.models import Count
+
+from knesset.utils import cannonize
+from laws.models import Law, Bill
+
+logger = logging.getLogger("open-knesset.laws.dedupe")
+
+# number of merges done in each transaction
+MERGE_BATCH_SIZE = 100
+
+
+def plan_law_merges():
+    """Groups the laws that weren't merged yet by canonical title. The target
+    of each group is the law with the most bills (the later one on ties)"""
+    groups = OrderedDict()
+    laws = Law.objects.filter(merged_into=None).annotate(bills_count=Count('bills')).order_by('id')
+    for law_id, title, bills_count in laws.values_list('id', 'title', 'bills_count'):
+        groups.setdefault(cannonize(title), []).append((law_id, bills_count))
+
+    plan = []
+    for group in groups.values():
+        if len(group) < 2:
+            continue
+        target, target_count = group[0]
+        for law_id, bills_count in group[1:]:
+            if bills_count >= target_count:
+                target, target_count = law_id, bills_count
+        plan.append((target, [law_id for law_id, _ in group if law_id != target]))
+    return plan
+
+
+def plan_bill_merges(law_merges=()):
+    """Groups the bills by law and canonical title, as if law_merges were
+    already applied. The target of each group is its first bill in the
+    default ordering"""
+    law_targets = dict((law_id, target) for target, law_ids in law_merges for law_id in law_ids)
+    groups = OrderedDict()
+    for bill_id, law_id, title in Bill.objects.filter(law__isnull=False).values_list('id', 'law', 'title'):
+        groups.setdefault((law_targets.get(law_id, law_id), cannonize(title)), []).append(bill_id)
+    return [(bill_ids[0], bill_ids[1:]) for bill_ids in groups.values() if len(bill_ids) > 1]
+
+
+def apply_merges(model, plan, batch_size=MERGE_BATCH_SIZE):
+    """Merges the duplicates of each group into its target with model.merge,
+    in transactions of batch_size groups"""
+    for i in range(0, len(plan), batch_size):
+        chunk = plan[i:i + batch_size]
+        with transaction.commit_on_success():
+            objects = model.objects.in_bulk([object_id for target, duplicates in chunk
+                                             for object_id in [target] + duplicates])
+            for target, duplicates in chunk:
+                for duplicate in duplicates:
+                    logger.info('merging %s %d into %d' % (model.__name__.lower(), duplicate, target))
+                    objects[target].merge(objects[duplicate])
+
+
+def merge_duplicates(dry_run=False):
+    """Plans the merges of the duplicate laws and bills, and applies them
+    unless dry_run. Returns the (law merges, bill merges) plans"""
+    law_merges = plan_law_merges()
+    bill_merges = plan_bill_merges(law_merges)
+    if not dry_run:
+        apply_merges(Law, law_merges)
+        apply_merges(Bill, bill_merges)
+    return law_merges, bill_merges
@@ -1,5 +1,5 @@
 #encoding: utf-8
-from django.db.models.signals import m2m_changed, post_save
+from django.db.models.signals import m2m_changed, pre_save, post_save, post_delete
 from django.contrib.contenttypes.models import ContentType
 from django.dispatch import receiver
 
@@ -8,9 +8,10 @@ from actstream.models import Action
 
 from knesset.utils import disable_for_loaddata
 from mks.models import Member, Party
-from laws.models import PrivateProposal, VoteAction, MemberVotingStatistics,\
-    PartyVotingStatistics, CandidateListVotingStatistics
+from laws.models import PrivateProposal, Vote, VoteAction, MemberVotingStatistics,\
+    PartyVotingStatistics, CandidateListVotingStatistics, vote_action_counters, month_of
 from polyorg.models import CandidateList
+from laws import vote_matrix
 
 def record_bill_proposal(**kwargs):
     if kwargs['action'] != "post_add":
@@ -40,6 +41,58 @@ def record_vote_action(sender, created, instance, **kwargs):
                     target = instance.vote,
                     timestamp=instance.vote.time)
 
+@receiver(post_save, sender=VoteAction, dispatch_uid='vote_action_vote_matrix')
+def update_vote_matrix(sender, created, instance, **kwargs):
+    previous = getattr(instance, '_previous_counted_fields', None)
+    vote_matrix.vote_action_saved(instance, created, previous and previous[:3])
+
+@receiver(post_delete, sender=VoteAction, dispatch_uid='vote_action_delete_vote_matrix')
+def invalidate_vote_matrix(sender, instance, **kwargs):
+    vote_matrix.invalidate_vote_matrix()
+
+def _voting_statistics_counts(member_id, vote_id, vote_type, *flags):
+    vote_time = Vote.objects.filter(pk=vote_id).values_list('time', flat=True)
+    if not vote_time:  # the vote is being deleted
+        return None, None
+    return (member_id, month_of(vote_time[0])), vote_action_counters(vote_type, *flags)
+
+_COUNTED_FIELDS = ('member_id', 'vote_id', 'type', 'against_party', 'against_coalition',
+                   'against_opposition')
+
+@receiver(pre_save, sender=VoteAction, dispatch_uid='vote_action_previous_counts')
+def remember_vote_action_counts(sender, instance, **kwargs):
+    previous = None
+    if instance.pk:
+        previous = VoteAction.objects.filter(pk=instance.pk).values_list(*_COUNTED_FIELDS)
+        previous = previous[0] if previous else None
+    instance._previous_counted_fields = previous
+
+@receiver(post_save, sender=VoteAction, dispatch_uid='vote_action_voting_statistics')
+def update_voting_statistics(sender, instance, **kwargs):
+    current = tuple(getattr(instance, field) for field in _COUNTED_FIELDS)
+    previous = getattr(instance, '_previous_counted_fields', None)
+    if previous == current:
+        return
+    counts = {}
+    key, deltas = _voting_statistics_counts(*current)
+    if key:
+        counts[key] = deltas
+    if previous:
+        key, deltas = _voting_statistics_counts(*previous)
+        if key:
+            counts[key] = [x - y for x, y in zip(counts.get(key, [0] * len(deltas)), deltas)]
+    MemberVotingStatistics.objects.add_counts(counts)
+
+@receiver(post_delete, sender=VoteAction, dispatch_uid='vote_action_delete_voting_statistics')
+def remove_from_voting_statistics(sender, instance, **kwargs):
+    key, deltas = _voting_statistics_counts(*(getattr(instance, field) for field in _COUNTED_FIELDS))
+    if key:
+        MemberVotingStatistics.objects.add_counts({key: [-x for x in deltas]})
+
+@receiver(post_save, sender=Member, dispatch_uid='member_vote_matrix')
+def expire_vote_matrix(sender, instance, **kwargs):
+    vote_matrix.expire_vote_matrix()
+
 @receiver(post_save, sender=CandidateList)
 @disable_for_loaddata
 def handle_candiate_list_save(sender, created, instance, **kwargs):
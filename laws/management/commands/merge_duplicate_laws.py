@@ -0,0 +1,37 @@
+from __future__ import print_function
+
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from laws.models import Law, Bill
+from laws.dedupe import plan_law_merges, plan_bill_merges, apply_merges
+
+
+class Command(NoArgsCommand):
+
+    help = "Merge laws with the same canonical title, and bills of the same law with the same canonical title"
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--dry-run', action='store_true', dest='dry_run',
+            help="only list the planned merges"),
+    )
+
+    def handle_noargs(self, **options):
+        law_merges = plan_law_merges()
+        bill_merges = plan_bill_merges(law_merges)
+        self.report(Law, law_merges)
+        self.report(Bill, bill_merges)
+        if options.get('dry_run'):
+            return
+        apply_merges(Law, law_merges)
+        apply_merges(Bill, bill_merges)
+
+    def report(self, model, plan):
+        titles = dict(model.objects.filter(
+            id__in=[object_id for target, duplicates in plan for object_id in [target] + duplicates]
+        ).values_list('id', 'title'))
+        print("{0} groups of duplicate {1}s".format(len(plan), model.__name__.lower()))
+        for target, duplicates in plan:
+            print(u"{0} {1} <- {2}".format(target, titles[target], ', '.join(
+                str(object_id) for object_id in duplicates)).encode('utf8'))
@@ -0,0 +1,40 @@
+from __future__ import print_function
+
+import datetime
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand, CommandError
+from django.db import transaction
+
+from laws.models import Vote
+from laws.vote_properties import update_votes_properties, CHUNK_SIZE
+from mks.affiliations import get_affiliations
+
+
+class Command(NoArgsCommand):
+
+    help = "Recompute the against party/coalition/opposition/own bill properties of votes"
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--since', action='store', dest='since',
+            help="recompute only votes from this date on (YYYY-MM-DD)"),
+    )
+
+    def handle_noargs(self, **options):
+        votes = Vote.objects.order_by('time')
+        since = options.get('since')
+        if since:
+            try:
+                since = datetime.datetime.strptime(since, '%Y-%m-%d')
+            except ValueError:
+                raise CommandError('--since should be in the form YYYY-MM-DD')
+            votes = votes.filter(time__gte=since)
+
+        vote_ids = list(votes.values_list('id', flat=True))
+        print("Recomputing properties of {0} votes".format(len(vote_ids)))
+        affiliations = get_affiliations()
+        for i in range(0, len(vote_ids), CHUNK_SIZE):
+            chunk = list(Vote.objects.filter(id__in=vote_ids[i:i + CHUNK_SIZE]))
+            with transaction.commit_on_success():
+                update_votes_properties(chunk, affiliations)
+            print("{0}/{1}".format(min(i + CHUNK_SIZE, len(vote_ids)), len(vote_ids)))
@@ -0,0 +1,17 @@
+from __future__ import print_function
+
+from django.core.management.base import NoArgsCommand
+from django.db import transaction
+
+from laws.models import MemberVotingStatistics
+
+
+class Command(NoArgsCommand):
+
+    help = "Recompute the voting statistics counters from the vote actions"
+
+    @transaction.commit_on_success
+    def handle_noargs(self, **options):
+        print("Recomputing member voting statistics")
+        MemberVotingStatistics.objects.recompute()
+        print("Done")
@@ -3,6 +3,7 @@ import re, logging, random
 from datetime import date, timedelta
 
 from django.db import models
+from django.db.models import F
 from django.contrib.contenttypes import generic
 from django.contrib.contenttypes.models import ContentType
 from django import forms
@@ -20,11 +21,12 @@ from tagging.utils import get_tag
 from actstream import Action
 from actstream.models import action
 
-from mks.models import Party, Knesset
+from mks.models import Knesset
 from tagvotes.models import TagVote
 from knesset.utils import slugify_name
 from laws.vote_choices import (TYPE_CHOICES, BILL_STAGE_CHOICES,
                                        BILL_AGRR_STAGES)
+from laws.vote_properties import update_votes_properties
 
 logger = logging.getLogger("open-knesset.laws.models")
 VOTE_ACTION_TYPE_CHOICES = (
@@ -47,6 +49,26 @@ class VoteAction(models.Model):
     def __unicode__(self):
         return u"{} {} {}".format(self.member.name, self.type, self.vote.title)
 
+class VoteMatrixVersionManager(models.Manager):
+    def current(self):
+        """The current version, 0 if it was never bumped"""
+        versions = list(self.values_list('version', flat=True)[:1])
+        return versions[0] if versions else 0
+
+    def bump(self):
+        """Marks that existing vote actions changed"""
+        if self.update(version=F('version') + 1) == 0:
+            self.create(version=1)
+
+class VoteMatrixVersion(models.Model):
+    """A single row counting the changes to existing vote actions. New vote
+       actions are noticed by their ids, but updates and deletes in any
+       process bump the version, so the vote matrices of all the processes
+       (see laws.vote_matrix) are rebuilt.
+    """
+    version = models.IntegerField(default=0)
+    objects = VoteMatrixVersionManager()
+
 class VoteManager(models.Manager):
     # TODO: add i18n to the types so we'd have
     #   {'law-approve': _('approve law'), ...
@@ -214,78 +236,7 @@ class Vote(models.Model):
         return tf
 
     def update_vote_properties(self):
-        party_ids = Party.objects.values_list('id', flat=True)
-        d = self.time.date()
-        party_is_coalition = {x.id:x.is_coalition_at(d)
-                                for x in Party.objects.all()}
-
-        for_party_ids = [va.member.party_at(d).id for va in self.for_votes()]
-        party_for_votes = [sum([x==pid for x in for_party_ids]) for pid in party_ids]
-
-        against_party_ids = [va.member.party_at(d).id for va in self.against_votes()]
-        party_against_votes = [sum([x==pid for x in against_party_ids]) for pid in party_ids]
-
-        party_stands_for = [float(fv)>0.66*(fv+av) for (fv,av) in zip(party_for_votes, party_against_votes)]
-        party_stands_against = [float(av)>0.66*(fv+av) for (fv,av) in zip(party_for_votes, party_against_votes)]
-
-        party_stands_for = dict(zip(party_ids, party_stands_for))
-        party_stands_against = dict(zip(party_ids, party_stands_against))
-
-        coalition_for_votes = sum([x for (x,y) in zip(party_for_votes,party_ids) if party_is_coalition[y]])
-        coalition_against_votes = sum([x for (x,y) in zip(party_against_votes,party_ids) if party_is_coalition[y]])
-        opposition_for_votes = sum([x for (x,y) in zip(party_for_votes,party_ids) if not party_is_coalition[y]])
-        opposition_against_votes = sum([x for (x,y) in zip(party_against_votes,party_ids) if not party_is_coalition[y]])
-
-        coalition_stands_for = (float(coalition_for_votes)>0.66*(coalition_for_votes+coalition_against_votes))
-        coalition_stands_against = float(coalition_against_votes)>0.66*(coalition_for_votes+coalition_against_votes)
-        opposition_stands_for = float(opposition_for_votes)>0.66*(opposition_for_votes+opposition_against_votes)
-        opposition_stands_against = float(opposition_against_votes)>0.66*(opposition_for_votes+opposition_against_votes)
-
-        # a set of all MKs that proposed bills this vote is about.
-        proposers = [set(b.proposers.all()) for b in self.bills()]
-        if proposers:
-            proposers = reduce(lambda x,y: set.union(x,y), proposers)
-
-        against_party_count = 0
-        against_coalition_count = 0
-        against_opposition_count = 0
-        against_own_bill_count = 0
-        for va in VoteAction.objects.filter(vote=self):
-            va.against_party = False
-            va.against_coalition = False
-            va.against_opposition = False
-            va.against_own_bill = False
-            if party_stands_for[va.member.party_at(d).id] and va.type=='against':
-                va.against_party = True
-                against_party_count += 1
-            if party_stands_against[va.member.party_at(d).id] and va.type=='for':
-                va.against_party = True
-                against_party_count += 1
-            if va.member.party_at(d).is_coalition_at(self.time.date()):
-                if (coalition_stands_for and va.type=='against') or (coalition_stands_against and va.type=='for'):
-                    va.against_coalition = True
-                    against_coalition_count += 1
-            else:
-                if (opposition_stands_for and va.type=='against') or (opposition_stands_against and va.type=='for'):
-                    va.against_opposition = True
-                    against_opposition_count += 1
-
-            if va.member in proposers and va.type=='against':
-                va.against_own_bill = True
-                against_own_bill_count += 1
-
-            va.save()
-
-        self.against_party = against_party_count
-        self.against_coalition = against_coalition_count
-        self.against_opposition = against_opposition_count
-        self.against_own_bill = against_own_bill_count
-        self.votes_count = VoteAction.objects.filter(vote=self).count()
-        self.for_votes_count = VoteAction.objects.filter(vote=self,type='for').count()
-        self.against_votes_count = VoteAction.objects.filter(vote=self,type='against').count()
-        self.controversy = min(self.for_votes_count or 0,
-                               self.against_votes_count or 0)
-        self.save()
+        update_votes_properties([self])
 
 class TagForm(forms.Form):
     tags = TagField()
@@ -756,34 +707,86 @@ def get_thousands_string(f):
     else:
         return "%d000 NIS" % f
 
+def _discipline(total_votes, votes_against):
+    if total_votes > 0:
+        return round(100.0*(total_votes-votes_against)/total_votes,1)
+    else:
+        return _('N/A')
+
+
+class CandidateListVotingStatisticsManager(models.Manager):
+
+    def refresh(self):
+        """Recomputes the counters of all candidate lists from the member
+        counters of their candidates, with a single grouped query"""
+        from polyorg.models import Candidate
+
+        aggregates = dict(('total_' + field, models.Sum('person__mk__voting_statistics__' + field))
+                          for field in VOTING_STATISTICS_COUNTERS)
+        aggregates['total_members'] = models.Count('person__mk')
+        self.update(members=0, **dict.fromkeys(VOTING_STATISTICS_COUNTERS, 0))
+        for row in Candidate.objects.filter(person__mk__isnull=False).values(
+                'candidates_list').annotate(**aggregates):
+            self.filter(candidates_list__id=row['candidates_list']).update(
+                **dict((field, row['total_' + field] or 0)
+                       for field in VOTING_STATISTICS_COUNTERS + ('members',)))
+
+
 class CandidateListVotingStatistics(models.Model):
     candidates_list = models.OneToOneField('polyorg.CandidateList', related_name='voting_statistics')
+    votes = models.IntegerField(default=0)
+    votes_against_party = models.IntegerField(default=0)
+    votes_against_coalition = models.IntegerField(default=0)
+    votes_against_opposition = models.IntegerField(default=0)
+    members = models.IntegerField(default=0)
+
+    objects = CandidateListVotingStatisticsManager()
 
     def votes_against_party_count(self):
-        return VoteAction.objects.filter(member__id__in=self.candidates_list.member_ids, against_party=True).count()
+        return self.votes_against_party
 
     def votes_count(self):
-        return VoteAction.objects.filter(member__id__in=self.candidates_list.member_ids).exclude(type='no-vote').count()
+        return self.votes
 
     def votes_per_seat(self):
-        return round(float(self.votes_count()) / len(self.candidates_list.member_ids))
+        if not self.members:
+            return 0.0
+        return round(float(self.votes_count()) / self.members)
 
     def discipline(self):
-        total_votes = self.votes_count()
-        if total_votes > 0:
-            votes_against_party = self.votes_against_party_count()
-            return round(100.0*(total_votes-votes_against_party)/total_votes,1)
-        else:
-            return _('N/A')
+        return _discipline(self.votes, self.votes_against_party)
+
+
+class PartyVotingStatisticsManager(models.Manager):
+
+    def refresh(self):
+        """Recomputes the counters of all parties from the member counters of
+        their current members, with a single grouped query"""
+        from mks.models import Member
+
+        aggregates = dict(('total_' + field, models.Sum('voting_statistics__' + field))
+                          for field in VOTING_STATISTICS_COUNTERS)
+        self.update(**dict.fromkeys(VOTING_STATISTICS_COUNTERS, 0))
+        for row in Member.objects.filter(current_party__isnull=False).values(
+                'current_party').annotate(**aggregates):
+            self.filter(party__id=row['current_party']).update(
+                **dict((field, row['total_' + field] or 0) for field in VOTING_STATISTICS_COUNTERS))
+
 
 class PartyVotingStatistics(models.Model):
     party = models.OneToOneField('mks.Party',related_name='voting_statistics')
-    
+    votes = models.IntegerField(default=0)
+    votes_against_party = models.IntegerField(default=0)
+    votes_against_coalition = models.IntegerField(default=0)
+    votes_against_opposition = models.IntegerField(default=0)
+
+    objects = PartyVotingStatisticsManager()
+
     def votes_against_party_count(self):
-        return VoteAction.objects.filter(member__current_party=self.party, against_party=True).count()
+        return self.votes_against_party
 
     def votes_count(self):
-        return VoteAction.objects.filter(member__current_party=self.party).exclude(type='no-vote').count()
+        return self.votes
 
     @property
     def votes_per_seat(self):
@@ -791,47 +794,146 @@ class PartyVotingStatistics(models.Model):
 
     @property        
     def discipline(self):
-        total_votes = self.votes_count()
-        if total_votes > 0:
-            votes_against_party = self.votes_against_party_count()
-            return round(100.0*(total_votes-votes_against_party)/total_votes,1)
-        else:
-            return _('N/A')
+        return _discipline(self.votes, self.votes_against_party)
 
     @property
     def coalition_discipline(self): # if party is in opposition this actually returns opposition_discipline
-        total_votes = self.votes_count()
-        if total_votes > 0:
-            if self.party.is_coalition:
-                votes_against = VoteAction.objects.filter(member__current_party=self.party, against_coalition=True).count()
-            else: 
-                votes_against = VoteAction.objects.filter(member__current_party=self.party, against_opposition=True).count()
-            return round(100.0*(total_votes-votes_against)/total_votes, 1)
-        else:
-            return _('N/A')
+        if self.party.is_coalition:
+            return _discipline(self.votes, self.votes_against_coalition)
+        return _discipline(self.votes, self.votes_against_opposition)
 
     def __unicode__(self):
         return u"{}".format(self.party.name)
 
+
+def refresh_group_voting_statistics():
+    """Brings the party and candidate list counters up to date with the
+    member counters. Run after syncing votes"""
+    PartyVotingStatistics.objects.refresh()
+    CandidateListVotingStatistics.objects.refresh()
+
+
+# counters kept per member, in total and per month. votes counts all vote
+# actions but no-votes, the rest count the vote actions with that flag set
+VOTING_STATISTICS_COUNTERS = ('votes', 'votes_against_party', 'votes_against_coalition',
+                              'votes_against_opposition')
+
+
+def vote_action_counters(vote_type, against_party, against_coalition, against_opposition):
+    """Returns the contribution of a vote action to VOTING_STATISTICS_COUNTERS"""
+    if vote_type == 'no-vote':
+        return [0, 0, 0, 0]
+    return [1, int(against_party), int(against_coalition), int(against_opposition)]
+
+
+def month_of(d):
+    return date(d.year, d.month, 1)
+
+
+class MemberVotingStatisticsManager(models.Manager):
+
+    def add_counts(self, counts):
+        """Adds to the counters of members.
+
+        :param counts: dict of (member id, month) -> list of deltas of
+                       VOTING_STATISTICS_COUNTERS
+        """
+        totals = {}
+        for (member_id, month), deltas in counts.items():
+            if not any(deltas):
+                continue
+            updates = dict((field, F(field) + delta)
+                           for field, delta in zip(VOTING_STATISTICS_COUNTERS, deltas) if delta)
+            updated = MemberMonthlyVotingStatistics.objects.filter(
+                member__id=member_id, month=month).update(**updates)
+            # rows are only missing for vote actions being added, or for
+            # members being deleted
+            if not updated and any(delta > 0 for delta in deltas):
+                MemberMonthlyVotingStatistics.objects.create(
+                    member_id=member_id, month=month, **dict(zip(VOTING_STATISTICS_COUNTERS, deltas)))
+            total = totals.setdefault(member_id, [0] * len(deltas))
+            for i, delta in enumerate(deltas):
+                total[i] += delta
+        for member_id, deltas in totals.items():
+            self.filter(member__id=member_id).update(
+                **dict((field, F(field) + delta)
+                       for field, delta in zip(VOTING_STATISTICS_COUNTERS, deltas) if delta))
+
+    def recompute(self, member_ids=None):
+        """Recomputes the counters from the vote actions, for all members or
+        only the given ones"""
+        actions = VoteAction.objects.exclude(type='no-vote')
+        months = MemberMonthlyVotingStatistics.objects.all()
+        stats = self.all()
+        if member_ids is not None:
+            actions = actions.filter(member__in=member_ids)
+            months = months.filter(member__in=member_ids)
+            stats = stats.filter(member__in=member_ids)
+
+        counts = {}
+        for row in actions.values_list('member_id', 'vote__time', 'type', 'against_party',
+                                       'against_coalition', 'against_opposition').iterator():
+            key = (row[0], month_of(row[1]))
+            deltas = vote_action_counters(*row[2:])
+            total = counts.setdefault(key, [0] * len(deltas))
+            for i, delta in enumerate(deltas):
+                total[i] += delta
+
+        months.delete()
+        MemberMonthlyVotingStatistics.objects.bulk_create(
+            [MemberMonthlyVotingStatistics(member_id=member_id, month=month,
+                                           **dict(zip(VOTING_STATISTICS_COUNTERS, deltas)))
+             for (member_id, month), deltas in counts.items()], batch_size=500)
+
+        totals = {}
+        for (member_id, month), deltas in counts.items():
+            total = totals.setdefault(member_id, [0] * len(deltas))
+            for i, delta in enumerate(deltas):
+                total[i] += delta
+        stats.update(**dict.fromkeys(VOTING_STATISTICS_COUNTERS, 0))
+        for member_id, total in totals.items():
+            self.filter(member__id=member_id).update(**dict(zip(VOTING_STATISTICS_COUNTERS, total)))
+        refresh_group_voting_statistics()
+
+
 class MemberVotingStatistics(models.Model):
     member = models.OneToOneField('mks.Member', related_name='voting_statistics')
+    votes = models.IntegerField(default=0)
+    votes_against_party = models.IntegerField(default=0)
+    votes_against_coalition = models.IntegerField(default=0)
+    votes_against_opposition = models.IntegerField(default=0)
+
+    objects = MemberVotingStatisticsManager()
+
+    def counts_since(self, from_date):
+        """Returns a dict of VOTING_STATISTICS_COUNTERS values counting only
+        votes after from_date. Whole months are read from the monthly
+        counters, the rest of from_date's month from the vote actions"""
+        next_month = month_of(from_date + timedelta(days=32 - from_date.day))
+        counts = self.member.monthly_voting_statistics.filter(month__gte=next_month).aggregate(
+            **dict((field, models.Sum(field)) for field in VOTING_STATISTICS_COUNTERS))
+        counts = dict((field, counts[field] or 0) for field in VOTING_STATISTICS_COUNTERS)
+        for row in VoteAction.objects.filter(member=self.member, vote__time__gt=from_date,
+                                             vote__time__lt=next_month).values_list(
+                'type', 'against_party', 'against_coalition', 'against_opposition'):
+            for field, delta in zip(VOTING_STATISTICS_COUNTERS, vote_action_counters(*row)):
+                counts[field] += delta
+        return counts
+
+    def counts(self, from_date = None):
+        if from_date:
+            return self.counts_since(from_date)
+        return dict((field, getattr(self, field)) for field in VOTING_STATISTICS_COUNTERS)
 
     def votes_against_party_count(self, from_date = None):
         if from_date:
-            return VoteAction.objects.filter(member=self.member, against_party=True, vote__time__gt=from_date).count()
-        else:
-            return VoteAction.objects.filter(member=self.member, against_party=True).count()
+            return self.counts_since(from_date)['votes_against_party']
+        return self.votes_against_party
 
     def votes_count(self, from_date = None):
         if from_date:
-            return VoteAction.objects.filter(member=self.member, vote__time__gt=from_date).exclude(type='no-vote').count()
-        else:
-            cache_name = 'votes_count_{}'.format(self.member.id)
-            vc = cache.get(cache_name)
-            if not vc:
-                vc = VoteAction.objects.filter(member=self.member).exclude(type='no-vote').count()
-                cache.set(cache_name, vc, settings.LONG_CACHE_TIME)
-            return vc
+            return self.counts_since(from_date)['votes']
+        return self.votes
 
     @property
     def average_votes_per_month(self):
@@ -845,28 +947,43 @@ class MemberVotingStatistics(models.Model):
         return self._average_votes_per_month
 
     def discipline(self, from_date = None):
-        total_votes = self.votes_count(from_date)
+        counts = self.counts(from_date)
+        total_votes = counts['votes']
         if total_votes <= 3: # not enough data
             return None
-        votes_against_party = self.votes_against_party_count(from_date)
+        votes_against_party = counts['votes_against_party']
         return round(100.0*(total_votes-votes_against_party)/total_votes,1)
 
     def coalition_discipline(self, from_date = None): # if party is in opposition this actually returns opposition_discipline
-        total_votes = self.votes_count(from_date)
+        counts = self.counts(from_date)
+        total_votes = counts['votes']
         if total_votes <= 3: # not enough data
             return None
         if self.member.current_party.is_coalition:
-            v = VoteAction.objects.filter(member=self.member, against_coalition=True)
+            votes_against_coalition = counts['votes_against_coalition']
         else:
-            v = VoteAction.objects.filter(member=self.member, against_opposition=True)
-        if from_date:
-            v = v.filter(vote__time__gt=from_date)
-        votes_against_coalition = v.count()
+            votes_against_coalition = counts['votes_against_opposition']
         return round(100.0*(total_votes-votes_against_coalition)/total_votes,1)
 
 
     def __unicode__(self):
         return u"{}".format(self.member.name)
 
+
+class MemberMonthlyVotingStatistics(models.Model):
+    """A member's VOTING_STATISTICS_COUNTERS for the votes of one month"""
+    member = models.ForeignKey('mks.Member', related_name='monthly_voting_statistics')
+    month = models.DateField()
+    votes = models.IntegerField(default=0)
+    votes_against_party = models.IntegerField(default=0)
+    votes_against_coalition = models.IntegerField(default=0)
+    votes_against_opposition = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = (('member', 'month'),)
+
+    def __unicode__(self):
+        return u"{} {}".format(self.member.name, self.month)
+
 import listeners
 del listeners
\ No newline at end of file
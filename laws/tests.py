@@ -14,8 +14,13 @@ from actstream.models import Action
 from tagging.models import Tag, TaggedItem
 import unittest
 
-from laws.models import Vote,Law, Bill,KnessetProposal, BillBudgetEstimation
-from mks.models import Member, Party, Membership
+from laws.models import (Vote, VoteAction, Law, Bill,KnessetProposal, BillBudgetEstimation,
+                         MemberVotingStatistics, PartyVotingStatistics,
+                         refresh_group_voting_statistics, VoteMatrixVersion)
+from laws.dedupe import merge_duplicates
+from laws.vote_properties import update_votes_counts
+from laws.vote_matrix import VoteMatrix
+from mks.models import Member, Party, Membership, CoalitionMembership
 from agendas.models import Agenda, AgendaVote
 
 just_id = lambda x: x.id
@@ -515,6 +520,151 @@ class ProposalModelTest(TestCase):
         self.kp_1.delete()
         self.bill.delete()
 
+class VotePropertiesTest(TestCase):
+    def setUp(self):
+        self.coalition = Party.objects.create(name='coalition')
+        self.opposition = Party.objects.create(name='opposition')
+        CoalitionMembership.objects.create(party=self.coalition,
+                                           start_date=date(2010, 1, 1))
+        self.mks = []
+        for i, party in enumerate([self.coalition] * 3 + [self.opposition]):
+            mk = Member.objects.create(name='mk %d' % i, current_party=party)
+            Membership.objects.create(member=mk, party=party,
+                                      start_date=date(2010, 1, 1))
+            self.mks.append(mk)
+        self.vote = Vote.objects.create(title='vote', time=datetime(2012, 1, 1))
+        for mk, vote_type in zip(self.mks, ['for', 'for', 'against', 'against']):
+            VoteAction.objects.create(vote=self.vote, member=mk, type=vote_type)
+        bill = Bill.objects.create(stage='3', title='bill', first_vote=self.vote)
+        bill.proposers.add(self.mks[2])
+
+    def test_update_vote_properties(self):
+        self.vote.update_vote_properties()
+        vote = Vote.objects.get(pk=self.vote.pk)
+        self.assertEqual((vote.against_party, vote.against_coalition,
+                          vote.against_opposition, vote.against_own_bill),
+                         (1, 1, 0, 1))
+        self.assertEqual((vote.votes_count, vote.for_votes_count,
+                          vote.against_votes_count, vote.controversy),
+                         (4, 2, 2, 2))
+        rebel = VoteAction.objects.get(vote=vote, member=self.mks[2])
+        self.assertTrue(rebel.against_party)
+        self.assertTrue(rebel.against_coalition)
+        self.assertTrue(rebel.against_own_bill)
+        self.assertFalse(VoteAction.objects.filter(vote=vote, member=self.mks[3],
+                                                   against_opposition=True).exists())
+
+    def _statistics(self):
+        return [(s.votes, s.votes_against_party, s.votes_against_coalition,
+                 s.votes_against_opposition)
+                for s in MemberVotingStatistics.objects.filter(
+                    member__in=self.mks).order_by('member')]
+
+    def test_voting_statistics_counters(self):
+        self.assertEqual(self._statistics(), [(1, 0, 0, 0)] * 4)
+        self.vote.update_vote_properties()
+        self.assertEqual(self._statistics(),
+                         [(1, 0, 0, 0), (1, 0, 0, 0), (1, 1, 1, 0), (1, 0, 0, 0)])
+
+        # no-votes are not counted, changes and deletes are
+        other_vote = Vote.objects.create(title='other vote', time=datetime(2012, 2, 1))
+        va = VoteAction.objects.create(vote=other_vote, member=self.mks[0], type='no-vote')
+        self.assertEqual(self._statistics()[0], (1, 0, 0, 0))
+        va.type = 'for'
+        va.save()
+        self.assertEqual(self._statistics()[0], (2, 0, 0, 0))
+        stats = MemberVotingStatistics.objects.get(member=self.mks[0])
+        self.assertEqual(stats.votes_count(date(2012, 1, 15)), 1)
+        self.assertEqual(stats.votes_count(date(2011, 12, 15)), 2)
+        va.delete()
+        self.assertEqual(self._statistics()[0], (1, 0, 0, 0))
+
+        incremental = self._statistics()
+        MemberVotingStatistics.objects.recompute()
+        self.assertEqual(self._statistics(), incremental)
+
+    def test_party_voting_statistics(self):
+        self.vote.update_vote_properties()
+        refresh_group_voting_statistics()
+        stats = PartyVotingStatistics.objects.get(party=self.coalition)
+        self.assertEqual((stats.votes, stats.votes_against_party,
+                          stats.votes_against_coalition, stats.votes_against_opposition),
+                         (3, 1, 1, 0))
+        self.assertEqual(stats.discipline, 66.7)
+        stats = PartyVotingStatistics.objects.get(party=self.opposition)
+        self.assertEqual((stats.votes, stats.votes_against_party), (1, 0))
+        self.assertEqual(stats.discipline, 100.0)
+
+    def test_update_votes_counts(self):
+        old_vote = Vote.objects.create(title='old vote', time=datetime(2011, 1, 1))
+        VoteAction.objects.create(vote=old_vote, member=self.mks[0], type='for')
+        VoteAction.objects.create(vote=self.vote, member=Member.objects.create(name='mk 4'),
+                                  type='abstain')
+        self.assertEqual(update_votes_counts(since=datetime(2012, 1, 1)), 1)
+        vote = Vote.objects.get(pk=self.vote.pk)
+        self.assertEqual((vote.votes_count, vote.for_votes_count,
+                          vote.against_votes_count, vote.controversy),
+                         (5, 2, 2, 2))
+        self.assertAlmostEqual(vote.importance, 4 / 120.0)
+        self.assertEqual(Vote.objects.get(pk=old_vote.pk).votes_count, None)
+        update_votes_counts()
+        old_vote = Vote.objects.get(pk=old_vote.pk)
+        self.assertEqual((old_vote.votes_count, old_vote.controversy), (1, 0))
+
+class VoteMatrixTest(TestCase):
+
+    def test_refresh_after_update(self):
+        mk = Member.objects.create(name='mk 1')
+        vote = Vote.objects.create(title='vote', time=datetime(2012, 1, 1))
+        action = VoteAction.objects.create(vote=vote, member=mk, type='for')
+        matrix = VoteMatrix()
+        matrix.refresh(force=True)
+        snapshot = matrix.snapshot()
+        self.assertEqual(matrix.score([mk.id], [(vote.id, 2.0)]), 2.0)
+        # an update made elsewhere, bypassing the listeners, is noticed by the version
+        VoteAction.objects.filter(id=action.id).update(type='against')
+        VoteMatrixVersion.objects.bump()
+        matrix.refresh(force=True)
+        self.assertEqual(matrix.score([mk.id], [(vote.id, 2.0)]), -2.0)
+        self.assertEqual(matrix.group_totals({1: [mk.id], 2: []}, [(vote.id, 2.0)]), {1: -2.0, 2: 0.0})
+        # snapshots taken before stay as they were
+        self.assertEqual(snapshot.matrix[snapshot.member_index[mk.id], snapshot.vote_index[vote.id]], 1)
+
+    def test_resave_does_not_rebuild(self):
+        mk = Member.objects.create(name='mk 1')
+        vote = Vote.objects.create(title='vote', time=datetime(2012, 1, 1))
+        action = VoteAction.objects.create(vote=vote, member=mk, type='for')
+        version = VoteMatrixVersion.objects.current()
+        action.save()
+        self.assertEqual(VoteMatrixVersion.objects.current(), version)
+        action.type = 'against'
+        action.save()
+        self.assertNotEqual(VoteMatrixVersion.objects.current(), version)
+
+class DedupeTest(TestCase):
+
+    def test_merge_duplicates(self):
+        law_1 = Law.objects.create(title=u'חוק החינוך')
+        law_2 = Law.objects.create(title=u'חוק  החינוך.')
+        law_3 = Law.objects.create(title=u'חוק הביטוח')
+        bill_1 = Bill.objects.create(stage='1', title=u'חוק החינוך', law=law_1)
+        bill_2 = Bill.objects.create(stage='1', title=u'חוק החינוך', law=law_2)
+        bill_3 = Bill.objects.create(stage='1', title=u'חוק החינוך', law=law_2)
+        Bill.objects.create(stage='1', title=u'חוק הביטוח', law=law_3)
+
+        law_merges, bill_merges = merge_duplicates(dry_run=True)
+        self.assertEqual(law_merges, [(law_2.id, [law_1.id])])
+        self.assertEqual(len(bill_merges), 1)
+        self.assertEqual(sorted([bill_merges[0][0]] + bill_merges[0][1]),
+                         [bill_1.id, bill_2.id, bill_3.id])
+        self.assertEqual(Bill.objects.count(), 4)
+
+        merge_duplicates()
+        self.assertEqual(Law.objects.get(pk=law_1.id).merged_into_id, law_2.id)
+        self.assertEqual(Bill.objects.filter(law=law_2).count(), 1)
+        self.assertEqual(Bill.objects.count(), 2)
+        self.assertEqual(merge_duplicates(), ([], []))
+
 class APIv2Test(TestCase):
 
     def setUp(self):
@@ -0,0 +1,212 @@
+'''
+In-memory member x vote matrix.
+
+Each cell holds the position a member took on a vote: +1 for, -1 against and
+0 for anything else (abstain, no-vote or not voting at all). The matrix is
+loaded once per process from laws_voteaction and then refreshed incrementally,
+so scoring code (agendas, correlations) can use vectorized numpy operations
+instead of joining over the vote actions on every request.
+
+New vote actions are found by their ids. Changes to existing ones, in any
+process, bump laws.models.VoteMatrixVersion, which makes every process
+rebuild its matrix on its next refresh.
+
+A refresh never modifies the matrix and indexes in place, it replaces them.
+Readers take a snapshot of the three under the lock, and compute only from
+it, so they always see a consistent state.
+'''
+import threading
+import time
+from collections import namedtuple
+
+import numpy
+from django.conf import settings
+
+# seconds between checks of the db for new vote actions
+REFRESH_INTERVAL = getattr(settings, 'VOTE_MATRIX_REFRESH_INTERVAL', 60)
+
+POSITIONS = {'for': 1, 'against': -1}
+
+Snapshot = namedtuple('Snapshot', 'matrix member_index vote_index')
+
+
+class VoteMatrix(object):
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.member_index = {}  # member id -> row
+            self.vote_index = {}    # vote id -> column
+            self.matrix = numpy.zeros((0, 0), dtype=numpy.int8)
+            self.party_members = {}  # party id -> list of member ids
+            self.last_voteaction_id = 0
+            self.voteactions_count = 0
+            self.version = 0
+            self._next_refresh = 0
+            self._needs_rebuild = True
+
+    def expire(self):
+        """Make the next access check the db for new vote actions"""
+        self._next_refresh = 0
+
+    def invalidate(self):
+        """Make the next access rebuild the matrix from scratch"""
+        self._needs_rebuild = True
+        self._next_refresh = 0
+
+    def snapshot(self):
+        """Returns the current (matrix, member_index, vote_index). They are
+        never modified, so they stay consistent while being read"""
+        with self._lock:
+            return Snapshot(self.matrix, self.member_index, self.vote_index)
+
+    def refresh(self, force=False):
+        with self._lock:
+            if not force and time.time() < self._next_refresh:
+                return
+            from django.db.models import Count, Max
+            from laws.models import VoteAction, VoteMatrixVersion
+            from mks.models import Member
+
+            version = VoteMatrixVersion.objects.current()
+            stats = VoteAction.objects.aggregate(Count('id'), Max('id'))
+            max_id = stats['id__max'] or 0
+            if self._needs_rebuild or version != self.version or max_id < self.last_voteaction_id:
+                self.reset()
+                self._needs_rebuild = False
+            new_actions = VoteAction.objects.filter(
+                id__gt=self.last_voteaction_id, id__lte=max_id).values_list(
+                    'member_id', 'vote_id', 'type')
+            self._load(new_actions, max_id)
+            if self.voteactions_count != stats['id__count']:
+                # vote actions were deleted behind our back
+                self.reset()
+                self._needs_rebuild = False
+                self._load(VoteAction.objects.filter(id__lte=max_id).values_list(
+                    'member_id', 'vote_id', 'type'), max_id)
+            self.version = version
+
+            party_members = {}
+            for member_id, party_id in Member.objects.values_list('id', 'current_party_id'):
+                party_members.setdefault(party_id, []).append(member_id)
+            self.party_members = party_members
+            self._next_refresh = time.time() + REFRESH_INTERVAL
+
+    def _load(self, actions, max_id):
+        actions = list(actions)
+        if actions:
+            # copies, so snapshots taken before are left intact
+            member_index = dict(self.member_index)
+            vote_index = dict(self.vote_index)
+            for member_id, vote_id, _ in actions:
+                if member_id not in member_index:
+                    member_index[member_id] = len(member_index)
+                if vote_id not in vote_index:
+                    vote_index[vote_id] = len(vote_index)
+            matrix = self._grown(len(member_index), len(vote_index))
+            rows = [member_index[a[0]] for a in actions]
+            cols = [vote_index[a[1]] for a in actions]
+            matrix[rows, cols] = [POSITIONS.get(a[2], 0) for a in actions]
+            (self.matrix, self.member_index, self.vote_index) = (matrix, member_index, vote_index)
+        self.voteactions_count += len(actions)
+        self.last_voteaction_id = max_id
+
+    def _grown(self, n_members, n_votes):
+        """Returns a copy of the matrix that can hold the given shape.
+        The matrix is always copied, so earlier snapshots stay intact. Its
+        capacity is doubled when it grows, so the copies are of a matrix
+        that usually already has room for the new members and votes"""
+        rows, cols = self.matrix.shape
+        if n_members > rows:
+            rows = max(n_members, 2 * rows)
+        if n_votes > cols:
+            cols = max(n_votes, 2 * cols)
+        matrix = numpy.zeros((rows, cols), dtype=numpy.int8)
+        old_rows, old_cols = self.matrix.shape
+        matrix[:old_rows, :old_cols] = self.matrix
+        return matrix
+
+    @staticmethod
+    def weight_vector(snapshot, weights):
+        """Converts (vote_id, weight) pairs to (columns, weights) arrays of
+        the snapshot, skipping votes no one voted on"""
+        cols = []
+        values = []
+        for vote_id, weight in weights:
+            col = snapshot.vote_index.get(vote_id)
+            if col is not None:
+                cols.append(col)
+                values.append(weight)
+        return (numpy.array(cols, dtype=numpy.intp),
+                numpy.array(values, dtype=numpy.float64))
+
+    def group_totals(self, groups, weights):
+        """Sums of weighted positions of groups of members.
+
+        :param groups: dict of group id -> member ids
+        :param weights: iterable of (vote_id, weight) pairs
+        :returns: dict of group id -> sum
+        """
+        snapshot = self.snapshot()
+        cols, values = self.weight_vector(snapshot, weights)
+        if not len(cols):
+            return dict((group_id, 0.0) for group_id in groups)
+        totals = snapshot.matrix[:, cols].dot(values)
+        result = {}
+        for group_id, member_ids in groups.items():
+            rows = [snapshot.member_index[m] for m in member_ids if m in snapshot.member_index]
+            result[group_id] = float(totals[rows].sum()) if rows else 0.0
+        return result
+
+    def score(self, member_ids, weights):
+        """Sum of weighted positions of the given members.
+
+        :param member_ids: iterable of member ids
+        :param weights: iterable of (vote_id, weight) pairs
+        """
+        snapshot = self.snapshot()
+        rows = [snapshot.member_index[m] for m in member_ids if m in snapshot.member_index]
+        cols, values = self.weight_vector(snapshot, weights)
+        if not rows or not len(cols):
+            return 0.0
+        return float(snapshot.matrix[numpy.ix_(rows, cols)].dot(values).sum())
+
+
+_vote_matrix = VoteMatrix()
+
+
+def get_vote_matrix():
+    """Returns the process wide vote matrix, refreshed if needed"""
+    _vote_matrix.refresh()
+    return _vote_matrix
+
+
+def vote_action_saved(vote_action, created, previous=None):
+    """
+    :param previous: (member_id, vote_id, type) of the vote action before it
+                     was saved, ``None`` if it is new
+    """
+    current = (vote_action.member_id, vote_action.vote_id, vote_action.type)
+    if created and vote_action.id > _vote_matrix.last_voteaction_id:
+        _vote_matrix.expire()
+    elif not created and previous == current:
+        # saved again without a change to its position
+        _vote_matrix.expire()
+    else:
+        # an existing vote action changed, or ids were reused after a rollback
+        invalidate_vote_matrix()
+
+
+def expire_vote_matrix():
+    _vote_matrix.expire()
+
+
+def invalidate_vote_matrix():
+    """Rebuilds the matrix of this process, and of the others, which notice
+    the bumped version"""
+    from laws.models import VoteMatrixVersion
+    VoteMatrixVersion.objects.bump()
+    _vote_matrix.invalidate()
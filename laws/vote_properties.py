@@ -0,0 +1,218 @@
+'''
+Batch computation of the vote properties: whether each vote action went
+against the member's party, the coalition, the opposition or the member's own
+bill, and the per-vote counters derived from them.
+
+All the data for a chunk of votes is read with a handful of queries and the
+results are written back with bulk updates, instead of the per vote action
+queries and saves of computing one vote at a time. Since the bulk updates
+don't send signals, the members' voting statistics counters are adjusted
+here as well.
+
+update_votes_counts recomputes just the counters, importance and controversy
+of all (or recent) votes with a couple of UPDATE statements, without loading
+any vote.
+'''
+from collections import defaultdict
+
+from django.db import connection
+from django.db.models import Q
+
+from mks.affiliations import get_affiliations
+
+CHUNK_SIZE = 200
+
+# a group (party, coalition, opposition) stands for or against a vote if
+# more than this fraction of its for/against votes went that way
+STAND_THRESHOLD = 0.66
+
+# importance is the fraction of the knesset members who voted for or against
+KNESSET_SIZE = 120
+
+VOTE_COUNTS_QUERY = """
+UPDATE laws_vote SET
+    votes_count = (SELECT COUNT(*) FROM laws_voteaction a
+                   WHERE a.vote_id = laws_vote.id),
+    for_votes_count = (SELECT COUNT(*) FROM laws_voteaction a
+                       WHERE a.vote_id = laws_vote.id AND a.type = 'for'),
+    against_votes_count = (SELECT COUNT(*) FROM laws_voteaction a
+                           WHERE a.vote_id = laws_vote.id AND a.type = 'against')
+%(where)s"""
+
+VOTE_IMPORTANCE_QUERY = """
+UPDATE laws_vote SET
+    importance = (for_votes_count + against_votes_count) / %(knesset_size)s,
+    controversy = CASE WHEN for_votes_count < against_votes_count
+                       THEN for_votes_count ELSE against_votes_count END
+%(where)s"""
+
+FLAGS = ('against_party', 'against_coalition', 'against_opposition', 'against_own_bill')
+
+
+def _stands(for_votes, against_votes):
+    """Returns (stands for, stands against) of a group"""
+    total = for_votes + against_votes
+    return (float(for_votes) > STAND_THRESHOLD * total,
+            float(against_votes) > STAND_THRESHOLD * total)
+
+
+def _goes_against(stands, vote_type):
+    stands_for, stands_against = stands
+    return (stands_for and vote_type == 'against') or (stands_against and vote_type == 'for')
+
+
+def _vote_proposers(vote_ids):
+    """Returns a dict of vote id -> set of ids of the members who proposed
+    the bills the vote is about"""
+    from laws.models import Bill
+
+    bill_votes = defaultdict(set)  # bill id -> vote ids
+    for bill_id, vote_id in Bill.pre_votes.through.objects.filter(
+            vote__in=vote_ids).values_list('bill_id', 'vote_id'):
+        bill_votes[bill_id].add(vote_id)
+    for bill_id, first_vote_id, approval_vote_id in Bill.objects.filter(
+            Q(first_vote__in=vote_ids) | Q(approval_vote__in=vote_ids)).values_list(
+                'id', 'first_vote_id', 'approval_vote_id'):
+        bill_votes[bill_id].update(v for v in (first_vote_id, approval_vote_id) if v in vote_ids)
+
+    proposers = defaultdict(set)
+    if bill_votes:
+        for bill_id, member_id in Bill.proposers.through.objects.filter(
+                bill__in=bill_votes.keys()).values_list('bill_id', 'member_id'):
+            for vote_id in bill_votes[bill_id]:
+                proposers[vote_id].add(member_id)
+    return proposers
+
+
+def vote_properties(vote, actions, affiliations, proposers):
+    """Computes the properties of a single vote.
+
+    :param vote: the Vote
+    :param actions: list of (vote action id, member id, type) of the vote
+    :param affiliations: an AffiliationIndex
+    :param proposers: set of ids of the members who proposed the vote's bills
+    :returns: (dict of Vote field -> value, dict of vote action id -> tuple
+              of the FLAGS values)
+    """
+    d = vote.time.date()
+    parties = affiliations.parties_at([member_id for _, member_id, _ in actions], d)
+
+    party_votes = defaultdict(lambda: [0, 0])  # party id -> [for, against]
+    for _, member_id, vote_type in actions:
+        party_id = parties[member_id]
+        if party_id is not None and vote_type in ('for', 'against'):
+            party_votes[party_id][vote_type == 'against'] += 1
+    party_is_coalition = affiliations.coalition_at(
+        set(party_id for party_id in parties.values() if party_id is not None), d)
+
+    coalition_votes = [0, 0]
+    opposition_votes = [0, 0]
+    for party_id, (for_votes, against_votes) in party_votes.items():
+        group = coalition_votes if party_is_coalition[party_id] else opposition_votes
+        group[0] += for_votes
+        group[1] += against_votes
+    party_stands = dict((party_id, _stands(*votes)) for party_id, votes in party_votes.items())
+    coalition_stands = _stands(*coalition_votes)
+    opposition_stands = _stands(*opposition_votes)
+
+    flags = {}
+    counts = dict.fromkeys(FLAGS, 0)
+    type_counts = defaultdict(int)
+    for action_id, member_id, vote_type in actions:
+        type_counts[vote_type] += 1
+        party_id = parties[member_id]
+        against_party = against_coalition = against_opposition = False
+        if party_id is not None:
+            against_party = _goes_against(party_stands.get(party_id, (False, False)), vote_type)
+            if party_is_coalition[party_id]:
+                against_coalition = _goes_against(coalition_stands, vote_type)
+            else:
+                against_opposition = _goes_against(opposition_stands, vote_type)
+        against_own_bill = member_id in proposers and vote_type == 'against'
+        flags[action_id] = (against_party, against_coalition, against_opposition, against_own_bill)
+        for flag, value in zip(FLAGS, flags[action_id]):
+            counts[flag] += value
+
+    fields = counts
+    fields['votes_count'] = len(actions)
+    fields['for_votes_count'] = type_counts['for']
+    fields['against_votes_count'] = type_counts['against']
+    fields['controversy'] = min(type_counts['for'], type_counts['against'])
+    return fields, flags
+
+
+def update_votes_properties(votes, affiliations=None):
+    """Computes and saves the properties of the given votes and their vote
+    actions. The fields of the given Vote instances are updated as well.
+
+    :param votes: list of Vote instances
+    :param affiliations: an AffiliationIndex, defaults to the process wide
+                         one
+    """
+    from laws.models import (Vote, VoteAction, MemberVotingStatistics, vote_action_counters,
+                             month_of)
+
+    if affiliations is None:
+        affiliations = get_affiliations()
+    for i in range(0, len(votes), CHUNK_SIZE):
+        chunk = votes[i:i + CHUNK_SIZE]
+        vote_ids = set(vote.id for vote in chunk)
+        actions = defaultdict(list)
+        previous_flags = {}
+        for row in VoteAction.objects.filter(vote__in=vote_ids).values_list(
+                'id', 'vote_id', 'member_id', 'type', *FLAGS):
+            action_id, vote_id, member_id, vote_type = row[:4]
+            actions[vote_id].append((action_id, member_id, vote_type))
+            previous_flags[action_id] = row[4:]
+        proposers = _vote_proposers(vote_ids)
+
+        flag_groups = defaultdict(list)  # flag values -> vote action ids
+        counts = {}  # (member id, month) -> deltas of the voting statistics
+        for vote in chunk:
+            fields, flags = vote_properties(vote, actions[vote.id], affiliations,
+                                            proposers.get(vote.id, set()))
+            for action_id, values in flags.items():
+                flag_groups[values].append(action_id)
+            for action_id, member_id, vote_type in actions[vote.id]:
+                previous = previous_flags[action_id]
+                if tuple(previous) == flags[action_id]:
+                    continue
+                key = (member_id, month_of(vote.time))
+                deltas = [x - y for x, y in
+                          zip(vote_action_counters(vote_type, *flags[action_id][:3]),
+                              vote_action_counters(vote_type, *previous[:3]))]
+                total = counts.setdefault(key, [0] * len(deltas))
+                for i, delta in enumerate(deltas):
+                    total[i] += delta
+            for field, value in fields.items():
+                setattr(vote, field, value)
+            Vote.objects.filter(pk=vote.pk).update(**fields)
+
+        for values, action_ids in flag_groups.items():
+            for j in range(0, len(action_ids), CHUNK_SIZE * 10):
+                VoteAction.objects.filter(id__in=action_ids[j:j + CHUNK_SIZE * 10]).update(
+                    **dict(zip(FLAGS, values)))
+        MemberVotingStatistics.objects.add_counts(counts)
+
+
+def update_votes_counts(since=None, vote_ids=None):
+    """Recomputes votes_count, for_votes_count, against_votes_count,
+    importance and controversy of all the votes, or only of the votes from
+    since on and/or of the given ids. Returns the number of votes updated"""
+    conditions = []
+    params = []
+    if since is not None:
+        conditions.append('time >= %s')
+        params.append(since)
+    if vote_ids is not None:
+        vote_ids = [int(vote_id) for vote_id in vote_ids]
+        if not vote_ids:
+            return 0
+        conditions.append('id IN (%s)' % ','.join(map(str, vote_ids)))
+    where = 'WHERE ' + ' AND '.join(conditions) if conditions else ''
+
+    cursor = connection.cursor()
+    cursor.execute(VOTE_COUNTS_QUERY % {'where': where}, params)
+    cursor.execute(VOTE_IMPORTANCE_QUERY % {'where': where, 'knesset_size': '%.1f' % KNESSET_SIZE},
+                   params)
+    return cursor.rowcount
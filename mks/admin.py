@@ -3,7 +3,8 @@ from django.contrib.contenttypes import generic
 from django.db.models import Q
 
 from models import Member, Membership, MemberAltname
-from models import CoalitionMembership, Correlation, Party
+from models import CoalitionMembership, Correlation, Party, Knesset
+from mks.correlations import correlation_window
 from links.models import Link
 from video.models import Video
 
@@ -65,7 +66,9 @@ class MemberAdmin(admin.ModelAdmin):
 
     def change_view(self, request, object_id, extra_context=None):
         m = Member.objects.get(id=object_id)
-        corrs = Correlation.objects.filter(m1=m.id).order_by('normalized_score')
+        # the correlations syncdata computes, of the current knesset
+        window = correlation_window(Knesset.objects.current_knesset())
+        corrs = Correlation.objects.filter(m1=m.id, window=window).order_by('normalized_score')
         
         my_context = {
             'extra': {
@@ -83,6 +86,7 @@ admin.site.register(Member, MemberAdmin)
 
 class CorrelationAdmin(admin.ModelAdmin):
     ordering = ('-normalized_score',)
+    list_filter = ('window',)
 admin.site.register(Correlation, CorrelationAdmin)
 
 class MembershipAdmin(admin.ModelAdmin):
@@ -0,0 +1,108 @@
+'''
+Process-local interval index of party memberships and coalition periods.
+
+Answers "which party was this member in" and "was this party in the
+coalition" for any date without touching the db. The index is loaded once
+per process and rebuilt when it goes stale: saving or deleting a Membership
+or CoalitionMembership drops it in the current process and bumps
+mks.models.AffiliationsVersion, which other processes check (together with a
+count/max id fingerprint of the tables, for rows created in bulk) every
+REFRESH_INTERVAL seconds.
+'''
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+
+# seconds between checks for changes made by other processes
+REFRESH_INTERVAL = getattr(settings, 'AFFILIATIONS_REFRESH_INTERVAL', 60)
+
+
+def _contains(start, end, date):
+    return (not start or start <= date) and (not end or end >= date)
+
+
+def _fingerprint():
+    from django.db.models import Count, Max
+    from mks.models import Membership, CoalitionMembership
+
+    return tuple(sorted(model.objects.aggregate(Count('id'), Max('id')).items())
+                 for model in (Membership, CoalitionMembership))
+
+
+class AffiliationIndex(object):
+
+    def __init__(self, version=None):
+        from mks.models import Membership, CoalitionMembership
+
+        self.version = version
+        # member id -> [(start, end, party id)], in Membership id order so
+        # overlapping memberships resolve like they always did
+        self.memberships = defaultdict(list)
+        for member_id, party_id, start, end in Membership.objects.order_by('id').values_list(
+                'member_id', 'party_id', 'start_date', 'end_date'):
+            self.memberships[member_id].append((start, end, party_id))
+
+        # party id -> [(start, end)]
+        self.coalition_periods = defaultdict(list)
+        for party_id, start, end in CoalitionMembership.objects.values_list(
+                'party_id', 'start_date', 'end_date'):
+            self.coalition_periods[party_id].append((start, end))
+
+    def party_at(self, member_id, date):
+        """Returns the id of the party the member was in at the given date,
+        or None"""
+        for start, end, party_id in self.memberships.get(member_id, ()):
+            if _contains(start, end, date):
+                return party_id
+        return None
+
+    def parties_at(self, member_ids, date):
+        """Returns a dict of member id -> id of the party the member was in
+        at the given date, or None"""
+        return dict((member_id, self.party_at(member_id, date)) for member_id in member_ids)
+
+    def is_coalition_at(self, party_id, date):
+        return any(_contains(start, end, date)
+                   for start, end in self.coalition_periods.get(party_id, ()))
+
+    def coalition_at(self, party_ids, date):
+        """Returns a dict of party id -> whether the party was in the
+        coalition at the given date"""
+        return dict((party_id, self.is_coalition_at(party_id, date)) for party_id in party_ids)
+
+
+_lock = threading.RLock()
+_index = None
+_next_check = 0
+
+
+def get_affiliations():
+    """Returns the process wide affiliation index, rebuilt if stale"""
+    global _index, _next_check
+    with _lock:
+        now = time.time()
+        if _index is not None and now < _next_check:
+            return _index
+        from mks.models import AffiliationsVersion
+        version = (AffiliationsVersion.objects.current(), _fingerprint())
+        if _index is None or _index.version != version:
+            _index = AffiliationIndex(version)
+        _next_check = now + REFRESH_INTERVAL
+        return _index
+
+
+def expire_affiliations():
+    """Make the next access check whether the index is stale"""
+    global _next_check
+    _next_check = 0
+
+
+def invalidate_affiliations():
+    """Drop the index in this process and make other processes drop theirs"""
+    global _index
+    from mks.models import AffiliationsVersion
+    AffiliationsVersion.objects.bump()
+    with _lock:
+        _index = None
@@ -0,0 +1,97 @@
+'''
+Pairwise voting agreement between members.
+
+All the pairs are computed at once with matrix products over the member x vote
+matrix (see laws.vote_matrix): for positions of +1/-1, P.P^T counts for every
+pair the votes they agreed on minus the votes they disagreed on, and V.V^T
+(where V marks who voted for or against) counts the votes both took part in.
+'''
+import datetime
+
+import numpy
+from django.db import transaction
+
+from laws.models import Vote
+from laws.vote_matrix import get_vote_matrix
+from mks.models import Member, Correlation
+
+# pairs who voted together on fewer votes than this are not stored
+MIN_CO_VOTES = 1
+
+
+def correlation_window(knesset=None, since=None, until=None):
+    """The window key of the correlations computed from the votes of the
+    given knesset and/or dates, '' for all the votes"""
+    parts = []
+    if knesset is not None:
+        parts.append('knesset %d' % knesset.number)
+    if since:
+        parts.append('since %s' % since.strftime('%Y-%m-%d'))
+    if until:
+        parts.append('until %s' % until.strftime('%Y-%m-%d'))
+    return ', '.join(parts)
+
+
+def window_votes(knesset=None, since=None, until=None):
+    """Ids of the votes held in the given knesset and/or between since
+    (inclusive) and until (exclusive)"""
+    votes = Vote.objects.all()
+    if knesset is not None:
+        if knesset.start_date:
+            votes = votes.filter(time__gte=knesset.start_date)
+        if knesset.end_date:
+            votes = votes.filter(time__lt=knesset.end_date + datetime.timedelta(days=1))
+    if since:
+        votes = votes.filter(time__gte=since)
+    if until:
+        votes = votes.filter(time__lt=until)
+    return votes.values_list('id', flat=True)
+
+
+def correlation_matrices(vote_ids):
+    """Returns (member_ids, scores, co_votes) for all the members who voted
+    for or against any of the given votes. scores[i, j] is the number of
+    votes members i and j agreed on minus the number they disagreed on, and
+    co_votes[i, j] is the number of votes both of them voted on"""
+    matrix = get_vote_matrix().snapshot()
+    cols = [matrix.vote_index[v] for v in vote_ids if v in matrix.vote_index]
+    member_ids = sorted(matrix.member_index)
+    rows = [matrix.member_index[m] for m in member_ids]
+    if not cols or not rows:
+        return [], numpy.zeros((0, 0)), numpy.zeros((0, 0))
+
+    positions = matrix.matrix[numpy.ix_(rows, cols)].astype(numpy.int32)
+    voted = (positions != 0).astype(numpy.int32)
+    active = voted.any(axis=1)
+    positions = positions[active]
+    voted = voted[active]
+    member_ids = [m for m, a in zip(member_ids, active) if a]
+    return member_ids, positions.dot(positions.T), voted.dot(voted.T)
+
+
+def update_correlations(knesset=None, since=None, until=None, min_co_votes=MIN_CO_VOTES):
+    """Recomputes the correlations between all the members who voted in the
+    given window, replacing the Correlation rows of the window (see
+    correlation_window). Both (m1, m2) and (m2, m1) are stored. Returns the
+    number of rows written"""
+    window = correlation_window(knesset, since, until)
+    member_ids, scores, co_votes = correlation_matrices(
+        window_votes(knesset, since, until))
+    parties = dict(Member.objects.filter(id__in=member_ids).values_list(
+        'id', 'current_party_id'))
+
+    correlations = []
+    for i, j in zip(*numpy.nonzero(co_votes >= max(min_co_votes, 1))):
+        if i == j:
+            continue
+        m1, m2 = member_ids[i], member_ids[j]
+        p1, p2 = parties.get(m1), parties.get(m2)
+        correlations.append(Correlation(
+            m1_id=m1, m2_id=m2, window=window, score=int(scores[i, j]),
+            normalized_score=float(scores[i, j]) / float(co_votes[i, j]),
+            not_same_party=None if p1 is None or p2 is None else p1 != p2))
+
+    with transaction.commit_on_success():
+        Correlation.objects.filter(window=window).delete()
+        Correlation.objects.bulk_create(correlations, batch_size=1000)
+    return len(correlations)
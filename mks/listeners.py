@@ -4,7 +4,8 @@ from planet.models import Feed, Post
 from actstream import action
 from knesset.utils import cannonize, disable_for_loaddata
 from links.models import Link, LinkType
-from models import Member, Knesset
+from models import Member, Knesset, Membership, CoalitionMembership
+from affiliations import invalidate_affiliations, expire_affiliations
 from django.dispatch import receiver
 
 import logging
@@ -41,3 +42,15 @@ def record_post_action(sender, created, instance, **kwargs):
 def reset_current_knesset(sender, instance, **kwargs):
     """Make sure current knesset is cleared upon changes to Knesset"""
     Knesset.objects._current_knesset = None
+
+@receiver([post_save, post_delete], sender=Membership)
+@receiver([post_save, post_delete], sender=CoalitionMembership)
+def reset_affiliations(sender, instance, **kwargs):
+    """Make sure party and coalition lookups see changes to memberships"""
+    invalidate_affiliations()
+
+@receiver(post_save, sender=Member)
+def expire_member_affiliations(sender, instance, created, **kwargs):
+    # memberships of a new member id might have been rolled back with it
+    if created:
+        expire_affiliations()
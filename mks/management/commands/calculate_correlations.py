@@ -0,0 +1,44 @@
+from __future__ import print_function
+
+import datetime
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand, CommandError
+
+from mks.models import Knesset
+from mks.correlations import update_correlations, MIN_CO_VOTES
+
+
+class Command(NoArgsCommand):
+
+    help = "Compute the voting correlations between all pairs of members"
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--knesset', action='store', dest='knesset', type='int',
+            help="use only the votes of the knesset with this number"),
+        make_option('--since', action='store', dest='since',
+            help="use only votes from this date on (YYYY-MM-DD)"),
+        make_option('--until', action='store', dest='until',
+            help="use only votes before this date (YYYY-MM-DD)"),
+        make_option('--min-votes', action='store', dest='min_votes', type='int',
+            default=MIN_CO_VOTES,
+            help="skip pairs who voted together on fewer votes than this"),
+    )
+
+    def handle_noargs(self, **options):
+        knesset = options.get('knesset')
+        if knesset is not None:
+            try:
+                knesset = Knesset.objects.get(number=knesset)
+            except Knesset.DoesNotExist:
+                raise CommandError('Knesset %d does not exist' % knesset)
+        dates = {}
+        for name in ('since', 'until'):
+            if options.get(name):
+                try:
+                    dates[name] = datetime.datetime.strptime(options[name], '%Y-%m-%d')
+                except ValueError:
+                    raise CommandError('--%s should be in the form YYYY-MM-DD' % name)
+
+        count = update_correlations(knesset, min_co_votes=options['min_votes'], **dates)
+        print("Stored {0} correlations".format(count))
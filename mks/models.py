@@ -2,11 +2,13 @@
 from datetime import date
 from dateutil.relativedelta import relativedelta
 from django.db import models
+from django.db.models import F
 from django.core.urlresolvers import reverse
 from django.utils.translation import ugettext_lazy as _, ugettext
 from mks.managers import (
     BetterManager, KnessetManager, CurrentKnessetMembersManager,
     CurrentKnessetPartyManager)
+from mks.affiliations import get_affiliations
 
 import logging
 logger = logging.getLogger("open-knesset.mks.models")
@@ -17,6 +19,8 @@ class Correlation(models.Model):
     score = models.IntegerField(default=0)
     normalized_score = models.FloatField(null=True)
     not_same_party = models.NullBooleanField()
+    # the votes the correlation was computed from, see mks.correlations
+    window = models.CharField(max_length=64, blank=True, default='', db_index=True)
 
     def __unicode__(self):
         return u"{} - {} - {0:.0f}".format(self.m1.name, self.m2.name, self.normalized_score)
@@ -37,6 +41,28 @@ class CoalitionMembership(models.Model):
                               self.end_date or "")
 
 
+class AffiliationsVersionManager(models.Manager):
+    def current(self):
+        """The current version, 0 if it was never bumped"""
+        versions = list(self.values_list('version', flat=True)[:1])
+        return versions[0] if versions else 0
+
+    def bump(self):
+        """Marks that memberships or coalition memberships changed"""
+        if self.update(version=F('version') + 1) == 0:
+            self.create(version=1)
+
+
+class AffiliationsVersion(models.Model):
+    """A single row counting the changes to memberships and coalition
+       memberships. Saves and deletes in any process bump the version, so the
+       affiliation indexes of all the processes (see mks.affiliations) are
+       rebuilt.
+    """
+    version = models.IntegerField(default=0)
+    objects = AffiliationsVersionManager()
+
+
 class Knesset(models.Model):
 
     number = models.IntegerField(_('Knesset number'), primary_key=True)
@@ -119,9 +145,7 @@ class Party(models.Model):
     def is_coalition_at(self, date):
         """Returns true is this party was a part of the coalition at the given
         date"""
-        return not all( membership.start_date and membership.start_date > date or
-                        membership.end_date and membership.end_date < date
-                        for membership in CoalitionMembership.objects.filter(party=self))        
+        return get_affiliations().is_coalition_at(self.id, date)
 
     @models.permalink
     def get_absolute_url(self):
@@ -211,12 +235,10 @@ class Member(AbstractPerson):
     def party_at(self, date):
         """Returns the party this memeber was at given date
         """
-        memberships = Membership.objects.filter(member=self)
-        for membership in memberships:
-            if (not membership.start_date or membership.start_date <= date) and\
-               (not membership.end_date or membership.end_date >= date):
-                return membership.party
-        return None
+        party_id = get_affiliations().party_at(self.id, date)
+        if party_id is None:
+            return None
+        return Party.objects.get(pk=party_id)
 
     def for_votes(self):
         return self.votes.filter(voteaction__type='for')
@@ -0,0 +1,89 @@
+'''
+Finding members' names in protocols.
+
+A MemberNameMatcher compiles the names of the members, and the names and
+aliases of their persons, into a single automaton (see knesset.matcher), so
+all the members mentioned in a text are found in one pass over it. Names and
+texts are normalized first: niqqud is dropped, and the different forms of
+quotes, gershayim, dashes and spaces are unified.
+'''
+import re
+
+from knesset.matcher import MultiMatcher
+from mks.affiliations import get_affiliations
+
+# niqqud and cantillation marks
+HEBREW_POINTS = re.compile(u'[\u0591-\u05bd\u05bf-\u05c7]')
+WHITESPACE = re.compile(u'\s+', re.UNICODE)
+CHARACTERS = {
+    u'\u05be': u'-',   # maqaf
+    u'\u2010': u'-',
+    u'\u2013': u'-',
+    u'\u2014': u'-',
+    u'\u05f3': u"'",   # geresh
+    u'\u2018': u"'",
+    u'\u2019': u"'",
+    u'`': u"'",
+    u'\u05f4': u'"',   # gershayim
+    u'\u201c': u'"',
+    u'\u201d': u'"',
+    u'\xa0': u' ',
+}
+TRANSLATION = dict((ord(k), v) for k, v in CHARACTERS.items())
+
+
+def normalize_name(text):
+    """Normalizes a name, or a text to find names in"""
+    if isinstance(text, str):
+        text = text.decode('utf8')
+    text = HEBREW_POINTS.sub(u'', text.translate(TRANSLATION))
+    return WHITESPACE.sub(u' ', text)
+
+
+class MemberNameMatcher(object):
+
+    def __init__(self, names):
+        """
+        :param names: iterable of (member id, name) pairs
+        """
+        self._matcher = MultiMatcher((member_id, normalize_name(name).strip())
+                                     for member_id, name in names)
+
+    def find(self, text):
+        """Returns the set of ids of the members whose names appear in text"""
+        return self._matcher.find(normalize_name(text))
+
+    def find_at(self, text, date, affiliations=None):
+        """Returns the set of ids of the members whose names appear in text,
+        and who were members of a party at the given date"""
+        if affiliations is None:
+            affiliations = get_affiliations()
+        member_ids = self.find(text)
+        parties = affiliations.parties_at(member_ids, date)
+        return set(member_id for member_id in member_ids if parties[member_id] is not None)
+
+
+def member_names(member_ids=None):
+    """Returns a list of (member id, name) of the names of the members, and
+    the names and aliases of their persons. Optionally only of the given
+    members"""
+    from mks.models import Member
+    from persons.models import Person, PersonAlias
+
+    members = Member.objects.all()
+    persons = Person.objects.filter(mk__isnull=False)
+    aliases = PersonAlias.objects.filter(person__mk__isnull=False)
+    if member_ids is not None:
+        members = members.filter(id__in=member_ids)
+        persons = persons.filter(mk__in=member_ids)
+        aliases = aliases.filter(person__mk__in=member_ids)
+    names = list(members.values_list('id', 'name'))
+    names.extend(persons.values_list('mk', 'name'))
+    names.extend(aliases.values_list('person__mk', 'name'))
+    return names
+
+
+def get_member_name_matcher(member_ids=None):
+    """Returns a matcher of the names of all the members, or of the given
+    ones"""
+    return MemberNameMatcher(member_names(member_ids))
@@ -6,7 +6,12 @@ from django.core.urlresolvers import reverse
 from django.contrib.auth.models import User
 from django.contrib.sites.models import Site
 from actstream import follow
-from mks.models import Member, Party, MemberAltname, Knesset
+from mks.models import (Member, Party, MemberAltname, Knesset, Membership,
+                        CoalitionMembership, Correlation, AffiliationsVersion)
+from mks.affiliations import get_affiliations, expire_affiliations
+from mks.correlations import update_correlations
+from mks.name_matcher import get_member_name_matcher
+from persons.models import Person, PersonAlias
 from laws.models import Law,Bill,PrivateProposal,Vote,VoteAction
 from committees.models import Committee
 import datetime
@@ -465,6 +470,80 @@ class MemberModelsTests(TestCase):
         MemberAltname(member=m,name='test2').save()
         self.assertEqual(m.names, ['test member','test2'])
 
+    def testPartyAt(self):
+        party_1 = Party.objects.create(name='party 1')
+        party_2 = Party.objects.create(name='party 2')
+        m = Member.objects.create(name='test member')
+        membership = Membership.objects.create(member=m, party=party_1,
+                                               start_date=datetime.date(2010,1,1),
+                                               end_date=datetime.date(2011,12,31))
+        Membership.objects.create(member=m, party=party_2,
+                                  start_date=datetime.date(2012,1,1))
+        self.assertEqual(m.party_at(datetime.date(2011,1,1)), party_1)
+        self.assertEqual(m.party_at(datetime.date(2013,1,1)), party_2)
+        self.assertEqual(m.party_at(datetime.date(2009,1,1)), None)
+
+        # changes are seen right away
+        membership.end_date = datetime.date(2010,12,31)
+        membership.save()
+        self.assertEqual(m.party_at(datetime.date(2011,1,1)), None)
+        # and so are changes made by other processes, which bump the version
+        Membership.objects.filter(pk=membership.pk).update(end_date=datetime.date(2011,12,31))
+        AffiliationsVersion.objects.bump()
+        expire_affiliations()
+        self.assertEqual(m.party_at(datetime.date(2011,1,1)), party_1)
+
+        CoalitionMembership.objects.create(party=party_2, start_date=datetime.date(2012,1,1))
+        self.assertTrue(party_2.is_coalition_at(datetime.date(2013,1,1)))
+        self.assertFalse(party_1.is_coalition_at(datetime.date(2013,1,1)))
+        self.assertEqual(get_affiliations().coalition_at([party_1.id, party_2.id],
+                                                         datetime.date(2011,1,1)),
+                         {party_1.id: False, party_2.id: False})
+
+    def testCorrelations(self):
+        party_1 = Party.objects.create(name='party 1')
+        party_2 = Party.objects.create(name='party 2')
+        mks = [Member.objects.create(name='mk %d' % i, current_party=party)
+               for i, party in enumerate([party_1, party_1, party_2])]
+        positions = [('for', 'for', 'against'),
+                     ('for', 'against', 'against'),
+                     ('against', 'for', 'abstain')]
+        for i, vote_positions in enumerate(positions):
+            vote = Vote.objects.create(title='vote %d' % i,
+                                       time=datetime.datetime(2012, 1, i + 1))
+            for mk, position in zip(mks, vote_positions):
+                VoteAction.objects.create(vote=vote, member=mk, type=position)
+
+        self.assertEqual(update_correlations(), 6)
+        c = Correlation.objects.get(m1=mks[0], m2=mks[1])
+        self.assertEqual((c.score, c.normalized_score, c.not_same_party),
+                         (-1, -1.0 / 3, False))
+        c = Correlation.objects.get(m1=mks[2], m2=mks[0])
+        self.assertEqual((c.score, c.normalized_score, c.not_same_party),
+                         (-2, -1.0, True))
+
+        # a window's correlations are kept apart from the others
+        self.assertEqual(update_correlations(until=datetime.datetime(2012, 1, 2)), 6)
+        c = Correlation.objects.get(m1=mks[0], m2=mks[1], window='until 2012-01-02')
+        self.assertEqual((c.score, c.normalized_score), (1, 1.0))
+        c = Correlation.objects.get(m1=mks[0], m2=mks[1], window='')
+        self.assertEqual((c.score, c.normalized_score), (-1, -1.0 / 3))
+        self.assertEqual(Correlation.objects.count(), 12)
+
+    def testNameMatcher(self):
+        party = Party.objects.create(name='party')
+        mk_1 = Member.objects.create(name=u'\u05d0\u05d1\u05d2 \u05d3\u05d4')
+        mk_2 = Member.objects.create(name='mk two')
+        Membership.objects.create(member=mk_1, party=party, start_date=datetime.date(2010,1,1))
+        Membership.objects.create(member=mk_2, party=party, start_date=datetime.date(2012,1,1))
+        PersonAlias.objects.create(person=Person.objects.get(mk=mk_2), name='m. two')
+        matcher = get_member_name_matcher()
+        # niqqud and extra spaces are ignored
+        text = u'\u05d0\u05b8\u05d1\u05d2  \u05d3\u05d4,\nm. two'
+        self.assertEqual(matcher.find(text), set([mk_1.id, mk_2.id]))
+        self.assertEqual(matcher.find_at(text, datetime.date(2011,1,1)), set([mk_1.id]))
+        self.assertEqual(matcher.find('mk three'), set())
+
 from agendas.models import Agenda, AgendaVote
 
 class MKAgendasTest(TestCase):
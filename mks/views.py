@@ -19,7 +19,7 @@ from actstream.models import Follow
 from hashnav.detail import DetailView
 from models import Member, Party, Knesset
 from utils import percentile
-from laws.models import MemberVotingStatistics, Bill, VoteAction
+from laws.models import MemberVotingStatistics, PartyVotingStatistics, Bill, VoteAction
 from agendas.models import Agenda
 from auxiliary.views import CsvView
 
@@ -71,7 +71,7 @@ class MemberListView(ListView):
                     y.sort(key=lambda x: x.extra, reverse=True)
                     return y
                 return select
-            return (get_select(lambda x : x.voting_statistics),
+            return (get_select(lambda x : vs[x.id]),
                      get_select(lambda x : vs[x.id]))
         if info.startswith('bills'):
             t = context['bill_stage'] = info.split('_')[1]
@@ -365,8 +365,12 @@ class PartyListView(ListView):
                 yield len(rc) and round(float(sum(rc)) / len(rc), 1)
         def callback2(qs):
             qs = list(qs)
+            stats = dict((s.party_id, s) for s in PartyVotingStatistics.objects.filter(
+                party__in=[p.id for p in qs]))
             for p in qs:
-                yield getattr(p.voting_statistics, attr)
+                s = stats.get(p.id) or PartyVotingStatistics(party=p)
+                s.party = p
+                yield getattr(s, attr)
         
         statistics = {# norm,                     baseline,      choose, call |     group_by_all
         'votes':      ((lambda m : m/20,          lambda m : 0,   max,   callback2), True),
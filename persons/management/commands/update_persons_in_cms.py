@@ -4,6 +4,7 @@ from django.core.management.base import NoArgsCommand
 from django.db.models import Q
 from committees.models import CommitteeMeeting,ProtocolPart
 from mks.models import Member
+from mks.name_matcher import get_member_name_matcher
 from persons.models import Person,PersonAlias
 
 logger = logging.getLogger("open-knesset.persons.create_persons")
@@ -23,25 +24,19 @@ class Command(NoArgsCommand):
                 if pp_header.find(name)>=0:
                     parts_updated = ProtocolPart.objects.filter(header=pp_header).update(speaker=person)                    
                     print "updated speaker for %d parts to %s" % (parts_updated,person.name)
+                    cm_ids = set(ProtocolPart.objects.filter(header=pp_header).values_list('meeting__id',flat=True))
+                    # the colors of the speakers depend on their members, so the summaries are computed again
+                    CommitteeMeeting.objects.filter(id__in=cm_ids).update(parts_summary='')
                     if person.mk:
-                        cm_ids = set(ProtocolPart.objects.filter(header=pp_header).values_list('meeting__id',flat=True))
                         for cm in CommitteeMeeting.objects.filter(id__in=cm_ids):
                             cm.mks_attended.add(person.mk)
                     break
         
         # find mks in the presence protocol part. this is needed for MKs that don't talk.
-        mk_names = []
-        mks = []
-        mk_persons = Person.objects.filter(mk__isnull=False)
-        mks.extend([person.mk for person in mk_persons])
-        mk_aliases = PersonAlias.objects.filter(person__in=mk_persons)
-        mk_names.extend(mk_persons.values_list('name',flat=True))
-        mk_names.extend(mk_aliases.values_list('name',flat=True))
-        mks.extend([alias.person.mk for alias in mk_aliases])
+        name_matcher = get_member_name_matcher()
 
         title = 'חברי הוועדה'.decode('utf-8')
-        for part in ProtocolPart.objects.filter(header=title):
-            for (i,name) in enumerate(mk_names):
-                for line in part.body.split('\n'):
-                    if line.find(name)>=0:
-                        part.meeting.mks_attended.add(mks[i])
+        for part in ProtocolPart.objects.filter(header=title).select_related('meeting'):
+            member_ids = name_matcher.find(part.body)
+            if member_ids:
+                part.meeting.mks_attended.add(*member_ids)
@@ -1,5 +1,7 @@
 from django.core.urlresolvers import reverse
 from django.db import models
+from django.db.models.signals import pre_save, post_save
+from django.dispatch import receiver
 from django.utils.translation import ugettext_lazy as _
 from django.core.exceptions import ValidationError
 from django.contrib.auth.models import User
@@ -104,13 +106,37 @@ class Person(AbstractPerson):
         (pa,created) = PersonAlias.objects.get_or_create(name=other.name,person=self)
         if created:
             pa.save()
+        meeting_ids = set(other.protocol_parts.values_list('meeting', flat=True))
         for part in other.protocol_parts.all():
             part.speaker = self
             part.save()
+        reset_parts_summaries(meeting_ids)
         other.delete()
         self.save()
 
 
+def reset_parts_summaries(meeting_ids):
+    """The speaker colors in the parts summaries of committee meetings depend
+    on whether the speakers are MKs, so the summaries of the given meetings
+    are computed again"""
+    from committees.models import CommitteeMeeting
+    CommitteeMeeting.objects.filter(id__in=meeting_ids).update(parts_summary='')
+
+
+@receiver(pre_save, sender=Person, dispatch_uid='person_previous_mk')
+def remember_person_mk(sender, instance, **kwargs):
+    previous = None
+    if instance.pk:
+        previous = list(Person.objects.filter(pk=instance.pk).values_list('mk', flat=True))
+    instance._previous_mk_id = previous[0] if previous else None
+
+
+@receiver(post_save, sender=Person, dispatch_uid='person_parts_summaries')
+def reset_person_parts_summaries(sender, instance, created, **kwargs):
+    if not created and instance.mk_id != getattr(instance, '_previous_mk_id', None):
+        reset_parts_summaries(instance.protocol_parts.values('meeting'))
+
+
 class Role(models.Model):
     text = models.CharField(blank=True,null=True, max_length=1024)
     person = models.ForeignKey(Person, related_name='roles')
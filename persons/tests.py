@@ -5,6 +5,7 @@ from unittest import skip
 
 from .models import Person
 from mks.models import Member
+from committees.models import Committee, CommitteeMeeting
 
 
 class PersonTests(TestCase):
@@ -34,3 +35,26 @@ class PersonTests(TestCase):
             self.assertEqual(getattr(mk, field), getattr(person, field))
 
         mk.delete()
+
+    def test_parts_summaries_follow_speakers(self):
+        committee = Committee.objects.create(name='c1')
+        meeting = committee.meetings.create(date=datetime.now(),
+                                            protocol_text='jacob:\nhello\nadrian:\nhi')
+        meeting.create_protocol_parts()
+        person = Person.objects.create(name='jacob')
+        meeting.parts.update(speaker=person)
+        summary = lambda: CommitteeMeeting.objects.get(pk=meeting.pk).parts_summary
+
+        # the speakers become members
+        CommitteeMeeting.objects.get(pk=meeting.pk).get_parts_summary()
+        person.mk = Member.objects.create(name='jacob mk')
+        person.save()
+        self.assertEqual(summary(), '')
+
+        # the speakers are merged into other persons
+        other = Person.objects.create(name='adrian')
+        meeting.parts.update(speaker=other)
+        CommitteeMeeting.objects.get(pk=meeting.pk).get_parts_summary()
+        self.assertNotEqual(summary(), '')
+        person.merge(other)
+        self.assertEqual(summary(), '')
@@ -3,32 +3,11 @@
 import re,logging
 from xml.etree import ElementTree
 import committees.models
-from mks.models import Member
-from persons.models import Person, PersonAlias
+from mks.name_matcher import get_member_name_matcher
 
 logger = logging.getLogger("open-knesset.plenum.create_protocol_parts")
 speaker_text_threshold=40
 
-_parts=None
-_mks_attended=set()
-_mks=None
-_mk_names=None
-
-def get_all_mk_names():
-    mks=[]
-    mk_names=[]
-    current_mks=Member.current_knesset.filter(is_current=True)
-    mks.extend(current_mks)
-    mk_names.extend(current_mks.values_list('name',flat=True))
-    current_mk_ids=[m.id for m in current_mks]
-    mk_persons = Person.objects.filter(mk__isnull=False,mk__id__in=current_mk_ids)
-    mk_aliases = PersonAlias.objects.filter(person__in=mk_persons)
-    mks.extend([person.mk for person in mk_persons])
-    mk_names.extend(mk_persons.values_list('name',flat=True))
-    mks.extend([alias.person.mk for alias in mk_aliases])
-    mk_names.extend(mk_aliases.values_list('name',flat=True))
-    return (mks,mk_names)
-    
 def _plenum_parseParaElement(para):
     isBold=False
     if para.find('emphasis') is not None:
@@ -75,70 +54,93 @@ def _plenum_parsePara(txt,t,titles):
             children.append({u't':txt,u's':0})
     return titles
 
-def _savePart(meeting,header,body,type):
-    global _partsCounter
-    global _parts
-    _parts.append(
-        committees.models.ProtocolPart(meeting=meeting, order=len(_parts), header=header.strip(), body=body.strip(), type=type)
-    )
-    if type=='speaker' and len(body.strip())>speaker_text_threshold:
-        for (i,name) in enumerate(_mk_names):
-            if header.find(name)>-1:
-                _mks_attended.add(_mks[i])
+class PlenumProtocolParser(object):
+    """Breaks a plenum protocol (the xml made by antiword) to its parts.
+       Each parser holds the state of parsing a single protocol, and only
+       returns data, so protocols can be parsed concurrently.
+    """
+
+    def __init__(self,date,name_matcher,affiliations=None):
+        """
+        :param date: the date of the meeting
+        :param name_matcher: the MemberNameMatcher speakers are found with
+        :param affiliations: the AffiliationIndex used to check which
+                             speakers were members at date
+        """
+        self.date=date
+        self.name_matcher=name_matcher
+        self.affiliations=affiliations
+        self.parts=[]
+        self.mks_attended=set()
+
+    def _savePart(self,header,body,type):
+        self.parts.append((len(self.parts),header.strip(),body.strip(),type))
+        if type=='speaker' and len(body.strip())>speaker_text_threshold:
+            # speakers who were members at the time of the meeting attended it
+            self.mks_attended.update(self.name_matcher.find_at(header,self.date,self.affiliations))
 
-def create_plenum_protocol_parts(meeting,mks=None,mk_names=None):
-    global _mks
-    global _mk_names
-    if mks is None or mk_names is None:
-        (mks,mk_names)=get_all_mk_names()
-    (_mks,_mk_names)=(mks,mk_names)
-    global _parts
-    _parts=[]
-    txt=meeting.protocol_text.encode('utf-8')
-    tree=ElementTree.fromstring(txt)
-    titles=None
-    for para in tree.iter('para'):
-        (isBold,txt)=_plenum_parseParaElement(para)
-        t=_plenum_parseParaText(txt,isBold)
-        titles=_plenum_parsePara(txt,t,titles)
-    for title in titles:
-        titleHeader=title['t'].strip()
-        titleBody=[]
-        #_savePart(meeting,'',t,'title')
-        for child in title['c']:
-            if child['s']==1:
-                # it's a speaker, save the aggregated title texts
-                if len(titleHeader)>0 or len(titleBody)>0:
-                    _savePart(meeting,titleHeader,'\n\n'.join(titleBody),'title')
-                    titleHeader=''
-                    titleBody=[]
-                speakerHeader=child['t'].strip()
-                speakerText=[]
-                for schild in child['c']:
-                    t=schild['t'].strip()
+    def parse(self,protocol_text):
+        """Returns (parts, mks_attended): a list of (order, header, body,
+           type) of the protocol parts, and the set of ids of the members who
+           attended the meeting
+        """
+        txt=protocol_text.encode('utf-8')
+        tree=ElementTree.fromstring(txt)
+        titles=None
+        for para in tree.iter('para'):
+            (isBold,txt)=_plenum_parseParaElement(para)
+            t=_plenum_parseParaText(txt,isBold)
+            titles=_plenum_parsePara(txt,t,titles)
+        for title in titles or []:
+            titleHeader=title['t'].strip()
+            titleBody=[]
+            for child in title['c']:
+                if child['s']==1:
+                    # it's a speaker, save the aggregated title texts
+                    if len(titleHeader)>0 or len(titleBody)>0:
+                        self._savePart(titleHeader,'\n\n'.join(titleBody),'title')
+                        titleHeader=''
+                        titleBody=[]
+                    speakerHeader=child['t'].strip()
+                    speakerText=[]
+                    for schild in child['c']:
+                        t=schild['t'].strip()
+                        if len(t)>0:
+                            speakerText.append(t)
+                    self._savePart(speakerHeader,'\n\n'.join(speakerText),'speaker')
+                else:
+                    t=child['t'].strip()
                     if len(t)>0:
-                        speakerText.append(t)
-                _savePart(meeting,speakerHeader,'\n\n'.join(speakerText),'speaker')
-            else:
-                t=child['t'].strip()
-                if len(t)>0:
-                    titleBody.append(t)
-        if len(titleHeader)>0 or len(titleBody)>0:
-            _savePart(meeting,titleHeader,'\n\n'.join(titleBody),'title')
-    if len(_parts)>0:
-        # find duplicates
-        gotDuplicate=False
-        otherMeetings=committees.models.CommitteeMeeting.objects.filter(date_string=meeting.date_string).exclude(id=meeting.id)
-        if len(otherMeetings)>0:
-            for otherMeeting in otherMeetings:
-                if otherMeeting.parts.count()==len(_parts):
-                    meeting.delete()
-                    gotDuplicate=True
-        if gotDuplicate:
-            logger.debug('got a duplicate meeting - deleting my meeting')
-        else:
-            committees.models.ProtocolPart.objects.bulk_create(_parts)
-            logger.debug('wrote '+str(len(_parts))+' protocol parts')
-            for mk in _mks_attended:
-                meeting.mks_attended.add(mk)
+                        titleBody.append(t)
+            if len(titleHeader)>0 or len(titleBody)>0:
+                self._savePart(titleHeader,'\n\n'.join(titleBody),'title')
+        return (self.parts,self.mks_attended)
+
+def save_plenum_protocol_parts(meeting,parts,mks_attended,parts_hash=None):
+    """Writes the parts and attending members returned by
+       PlenumProtocolParser.parse for the meeting. parts_hash is the
+       protocol_hash of the parsed text, computed here if not given. If an earlier meeting of
+       the committee has the same protocol fingerprint, this meeting is a
+       duplicate and is deleted instead. Returns whether the parts were written.
+    """
+    if len(parts)==0:
+        return False
+    if meeting.protocol_fingerprint and committees.models.CommitteeMeeting.objects.filter(
+            committee=meeting.committee_id,protocol_fingerprint=meeting.protocol_fingerprint,id__lt=meeting.id).exists():
+        logger.debug('got a duplicate meeting - deleting my meeting')
+        meeting.delete()
+        return False
+    meeting.parts_summary=committees.models.ProtocolPart.objects.create_for_meeting(meeting.id,
+        [(order,header,body) for (order,header,body,type) in parts],[type for (order,header,body,type) in parts])
+    logger.debug('wrote '+str(len(parts))+' protocol parts')
+    committees.models.CommitteeMeeting.objects.filter(id=meeting.id).update(
+        protocol_parts_hash=parts_hash or committees.models.protocol_hash(meeting.protocol_text))
+    if mks_attended:
+        meeting.mks_attended.add(*mks_attended)
+    return True
 
+def create_plenum_protocol_parts(meeting,name_matcher=None):
+    if name_matcher is None:
+        name_matcher=get_member_name_matcher()
+    (parts,mks_attended)=PlenumProtocolParser(meeting.date,name_matcher).parse(meeting.protocol_text)
+    save_plenum_protocol_parts(meeting,parts,mks_attended)
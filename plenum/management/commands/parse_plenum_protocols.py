@@ -16,6 +16,8 @@ class Command(NoArgsCommand):
             help="like the download stage but download all the files again"),
         make_option('--reparse',action='store_true',dest='reparse',
             help="like the parse stage but parses all the existing data again"),
+        make_option('--workers',action='store',dest='workers',type='int',
+            help="number of processes parsing the protocols (default: one per core)"),
     )
 
     def handle_noargs(self, **options):
@@ -24,7 +26,7 @@ class Command(NoArgsCommand):
             Download(options.get('verbosity',1),options.get('redownload',False))
             didSomething=True
         if options.get('parse',False) or options.get('reparse',False):
-            Parse(options.get('verbosity',1),options.get('reparse',False))
+            Parse(options.get('verbosity',1),options.get('reparse',False),options.get('workers'))
             didSomething=True
         if not didSomething==True:
             print 'invalid options, try --help for help'
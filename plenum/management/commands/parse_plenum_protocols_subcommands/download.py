@@ -1,9 +1,13 @@
 # encoding: utf-8
 
-import urllib,urllib2,re,datetime,traceback,sys,os,subprocess
+import urllib,urllib2,re,datetime,traceback,sys,os,subprocess,hashlib,tempfile
+from multiprocessing.pool import ThreadPool
 from BeautifulSoup import BeautifulSoup
 from django.conf import settings
-from committees.models import Committee, CommitteeMeeting
+from committees.models import Committee, CommitteeMeeting, ProtocolPart
+from committees.models import protocol_fingerprint, protocol_signature, signature_similarity, NEAR_DUPLICATE_SIMILARITY
+from committees.models import _protocol_words
+from knesset.fetcher import fetch, get_fetcher, document_max_age
 
 URL="http://www.knesset.gov.il/plenum/heb/plenum_queue.aspx"
 ROBOTS_URL="http://www.knesset.gov.il/robots.txt"
@@ -13,6 +17,9 @@ WORDS_OF_THE_KNESSET=u"דברי הכנסת"
 WORDS_OF_THE_KNESSET_FULL=u"כל הפרוטוקול"
 DISCUSSIONS_ON_DATE=u"הדיונים בתאריך"
 
+# number of antiword processes run at once
+ANTIWORD_WORKERS=getattr(settings,'ANTIWORD_WORKERS',4)
+
 verbosity=1
 
 def _debug(str):
@@ -28,31 +35,54 @@ def _get_committees_index_page(full):
         encoding='utf8'
     _debug('getting the html from '+url)
     try:
-        return unicode(urllib2.urlopen(url).read(),encoding)
+        return unicode(fetch(url),encoding)
     except Exception, e:
         print 'could not fetch committees_index_page, exception: '+str(e)
         traceback.print_exc(file=sys.stdout)
 
-def _copy(url,to):
-    #_debug("copying from "+url+" to "+to)
-    d=os.path.dirname(to)
+def _write(filename,data):
+    # write to a temporary file and rename it, so readers never see partial files
+    d=os.path.dirname(filename)
     if not os.path.exists(d):
         os.makedirs(d)
-    if not os.path.exists(to):
-        urllib.urlretrieve(url,to+".tmp")
-        os.rename(to+'.tmp',to)
+    (fd,tmp)=tempfile.mkstemp(dir=d)
+    with os.fdopen(fd,'wb') as f:
+        f.write(data)
+    os.rename(tmp,filename)
+
+def _copy(url,to,redownload=False):
+    #_debug("copying from "+url+" to "+to)
+    if redownload or not os.path.exists(to):
+        # a redownload revalidates the documents instead of trusting the cache
+        _write(to,fetch(url,max_age=0 if redownload else document_max_age()))
     else:
         _debug('already downloaded')
 
 def _antiword(filename):
-    cmd='antiword -x db '+filename+' > '+filename+'.awdb.xml'
-    _debug(cmd)
-    _debug(subprocess.check_output(cmd,stderr=subprocess.STDOUT,shell=True))
-    xmldata=''
-    with open(filename+'.awdb.xml','r') as f:
-        xmldata=f.read()
+    # antiword's output is read from its stdout, no shell or temporary files involved
+    _debug('antiword -x db '+filename)
+    p=subprocess.Popen(['antiword','-x','db',filename],stdout=subprocess.PIPE,stderr=subprocess.PIPE)
+    (xmldata,err)=p.communicate()
+    if p.returncode!=0:
+        raise subprocess.CalledProcessError(p.returncode,'antiword -x db '+filename,err)
     _debug('len(xmldata) = '+str(len(xmldata)))
-    os.remove(filename+'.awdb.xml')
+    return xmldata
+
+def _xmlCacheFilename(filename):
+    # converted documents are kept by the sha1 of the .doc file
+    with open(filename,'rb') as f:
+        digest=hashlib.sha1(f.read()).hexdigest()
+    return os.path.join(getattr(settings,'DATA_ROOT'),'plenum_protocols','xml',digest[:2],digest+'.xml')
+
+def _convert(filename):
+    # returns the xml of a .doc file, running antiword only if it was not converted before
+    xmlFilename=_xmlCacheFilename(filename)
+    if os.path.exists(xmlFilename):
+        _debug('already converted '+filename)
+        with open(xmlFilename,'rb') as f:
+            return f.read()
+    xmldata=_antiword(filename)
+    _write(xmlFilename,xmldata)
     return xmldata
 
 def _urlAlreadyDownloaded(url):
@@ -62,15 +92,58 @@ def _urlAlreadyDownloaded(url):
     else:
         return False
 
+def _findDuplicate(plenum,protocol_text,date):
+    # returns (meeting,exact) of the meeting with the same protocol, or of a near duplicate one
+    # on the same date, or (None,False)
+    meetings=CommitteeMeeting.objects.filter(committee=plenum).order_by('id')
+    fingerprint=protocol_fingerprint(protocol_text)
+    if not fingerprint:
+        return (None,False)
+    ids=list(meetings.filter(protocol_fingerprint=fingerprint).values_list('id',flat=True)[:1])
+    if ids:
+        return (meetings.get(id=ids[0]),True)
+    signature=protocol_signature(protocol_text)
+    ids=[meeting_id for (meeting_id,other) in meetings.filter(date=date).values_list('id','protocol_signature')
+         if signature_similarity(signature,other)>=NEAR_DUPLICATE_SIMILARITY][:1]
+    return (meetings.get(id=ids[0]),False) if ids else (None,False)
+
+def _preferred(protocol_text,url,meeting):
+    # whether a protocol is kept rather than its near duplicate meeting: the one with more words wins,
+    # then the smaller url. markup is not counted
+    return ((-len(_protocol_words(protocol_text)),url)<
+            (-len(_protocol_words(meeting.protocol_text)),meeting.src_url or ''))
+
 def _updateDb(xmlData,url,year,mon,day):
     plenum=Committee.objects.filter(type='plenum')[0]
     cms=CommitteeMeeting.objects.filter(committee=plenum,src_url=url)
-    if cms.count()>0:
+    date=datetime.datetime(int(year),int(mon),int(day))
+    (duplicate,exact)=(None,False) if cms.count()>0 else _findDuplicate(plenum,xmlData.decode('utf8'),date)
+    if duplicate is not None and (exact or not _preferred(xmlData.decode('utf8'),url,duplicate)):
+        # the same meeting was already downloaded from another document, and is kept as it is
+        _debug('duplicate of meeting '+str(duplicate.id))
+        return
+    if duplicate is not None:
+        # a more complete version of the meeting, which replaces the existing one
+        _debug('replacing duplicate meeting '+str(duplicate.id))
+        ProtocolPart.objects.delete_for_meetings([duplicate.id])
+        meeting=duplicate
+        meeting.parts_summary=''
+        meeting.src_url=url
+        meeting.date=date
+        meeting.topics=u'ישיבת מליאה מתאריך '+day+'/'+mon+'/'+year
+        meeting.date_string=''+day+'/'+mon+'/'+year
+    elif cms.count()>0:
         meeting=cms[0]
+        if meeting.protocol_text==xmlData.decode('utf8'):
+            _debug('protocol unchanged')
+            return
+        # the protocol changed, so its parts are created again by the parse stage
+        ProtocolPart.objects.delete_for_meetings([meeting.id])
+        meeting.parts_summary=''
     else:
         meeting=CommitteeMeeting(
             committee=plenum,
-            date=datetime.datetime(int(year),int(mon),int(day)),
+            date=date,
             src_url=url,
             topics=u'ישיבת מליאה מתאריך '+day+'/'+mon+'/'+year,
             date_string=''+day+'/'+mon+'/'+year
@@ -86,6 +159,7 @@ def _downloadLatest(full,redownload):
     else:
         words_of_the_knesset=WORDS_OF_THE_KNESSET
     aelts=soup('a',text=words_of_the_knesset)
+    downloads=[] # of (url,filename,year,mon,day)
     for aelt in aelts:
         selt=aelt.findPrevious('span',text=re.compile(DISCUSSIONS_ON_DATE))
         url=FILE_BASE_URL+aelt.parent.get('href')
@@ -105,11 +179,20 @@ def _downloadLatest(full,redownload):
                 _debug('url already downloaded')
             else:
                 DATA_ROOT = getattr(settings, 'DATA_ROOT')
-                _copy(url.replace('/heb/..',''),DATA_ROOT+'plenum_protocols/'+year+'_'+mon+'_'+day+'_'+filename)
-                xmlData=_antiword(DATA_ROOT+'plenum_protocols/'+year+'_'+mon+'_'+day+'_'+filename)
-                os.remove(DATA_ROOT+'plenum_protocols/'+year+'_'+mon+'_'+day+'_'+filename)
-                _updateDb(xmlData,url,year,mon,day)
-                
+                downloads.append((url,DATA_ROOT+'plenum_protocols/'+year+'_'+mon+'_'+day+'_'+filename,year,mon,day))
+    # the original .doc files are kept, so unchanged documents are never converted again
+    get_fetcher().prefetch([url.replace('/heb/..','') for (url,filename,year,mon,day) in downloads
+                            if redownload or not os.path.exists(filename)],
+                           max_age=0 if redownload else document_max_age())
+    for (url,filename,year,mon,day) in downloads:
+        _copy(url.replace('/heb/..',''),filename,redownload)
+    pool=ThreadPool(ANTIWORD_WORKERS)
+    try:
+        for ((url,filename,year,mon,day),xmlData) in zip(downloads,pool.imap(_convert,[d[1] for d in downloads])):
+            _updateDb(xmlData,url,year,mon,day)
+    finally:
+        pool.close()
+        pool.join()
 
 def Download(verbosity_level,redownload):
     global verbosity
@@ -2,25 +2,74 @@
 
 import datetime,traceback,sys,os,re,subprocess,json,io,logging
 import xml.etree.ElementTree as ET
+from multiprocessing import Pool
 from django.conf import settings
+from django.db import transaction
 from django.db.models import Count
-from committees.models import Committee, CommitteeMeeting
-from plenum import create_protocol_parts
+from committees.models import Committee, CommitteeMeeting, ProtocolPart, ProtocolText, protocol_hash
+from mks.affiliations import get_affiliations
+from mks.name_matcher import get_member_name_matcher
+from plenum.create_protocol_parts import PlenumProtocolParser, save_plenum_protocol_parts
+
+logger = logging.getLogger("open-knesset.plenum.parse")
 
 verbosity=1
 
-def Parse(verbosity_level,reparse):
+# number of meetings whose protocols are read from the db at once
+CHUNK_SIZE=50
+
+# the name matcher and affiliations of the worker processes, set by _initWorker
+_name_matcher=None
+_affiliations=None
+
+def _initWorker(name_matcher,affiliations):
+    global _name_matcher,_affiliations
+    (_name_matcher,_affiliations)=(name_matcher,affiliations)
+
+def _parseMeeting(args):
+    (meeting_id,date,protocol_text)=args
+    try:
+        (parts,mks_attended)=PlenumProtocolParser(date,_name_matcher,_affiliations).parse(protocol_text)
+    except Exception:
+        logger.error('failed to parse meeting %d\n%s' % (meeting_id,traceback.format_exc()))
+        return (meeting_id,None,None,None)
+    return (meeting_id,parts,mks_attended,protocol_hash(protocol_text))
+
+def Parse(verbosity_level,reparse,workers=None):
     global verbosity
     verbosity=int(verbosity_level)
     #DATA_ROOT = getattr(settings, 'DATA_ROOT')
     plenum=Committee.objects.filter(type='plenum')[0]
-    meetings=CommitteeMeeting.objects.filter(committee=plenum).exclude(protocol_text='')
+    meetings=CommitteeMeeting.objects.filter(committee=plenum).exclude(protocol_fingerprint='')
     if not reparse:
         meetings=meetings.annotate(Count('parts')).filter(parts__count=0)
     if verbosity>1:
         console = logging.StreamHandler()
         console.setLevel(logging.DEBUG)
         logging.getLogger('').addHandler(console)
-    (mks,mk_names)=create_protocol_parts.get_all_mk_names()
-    for meeting in meetings:
-        meeting.create_protocol_parts(delete_existing=reparse,mks=mks,mk_names=mk_names)
+    meeting_ids=list(meetings.order_by('id').values_list('id',flat=True))
+    initargs=(get_member_name_matcher(),get_affiliations())
+    # the protocols are parsed in worker processes, and their parts written here in bulk
+    if workers==1:
+        _initWorker(*initargs)
+        pool=None
+    else:
+        pool=Pool(workers,_initWorker,initargs)
+    try:
+        for i in range(0,len(meeting_ids),CHUNK_SIZE):
+            chunk=CommitteeMeeting.objects.in_bulk(meeting_ids[i:i+CHUNK_SIZE])
+            tasks=[(meeting_id,chunk[meeting_id].date,protocol_text) for (meeting_id,protocol_text)
+                   in ProtocolText.objects.iter_texts(meeting_ids[i:i+CHUNK_SIZE],CHUNK_SIZE)]
+            results=pool.imap_unordered(_parseMeeting,tasks) if pool else map(_parseMeeting,tasks)
+            for (meeting_id,parts,mks_attended,parts_hash) in results:
+                if parts is None:
+                    continue
+                with transaction.commit_on_success():
+                    if reparse:
+                        ProtocolPart.objects.delete_for_meetings([meeting_id])
+                    save_plenum_protocol_parts(chunk[meeting_id],parts,mks_attended,parts_hash)
+            logger.debug('parsed %d/%d meetings' % (min(i+CHUNK_SIZE,len(meeting_ids)),len(meeting_ids)))
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
@@ -18,6 +18,7 @@ install_requires = [
     'mimms',
     'django-social-auth',
     'nose',
+    'numpy',
     'oauth',
     'pil',
     'pyth',
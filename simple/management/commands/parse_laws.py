@@ -12,6 +12,7 @@ from HTMLParser import HTMLParseError
 from django.core.files.base import ContentFile
 from django.contrib.contenttypes.models import ContentType
 
+from knesset.fetcher import fetch, document_max_age, FetchError
 from links.models import Link, LinkedFile
 import parse_knesset_bill_pdf
 from parse_government_bill_pdf import GovProposalParser
@@ -33,8 +34,8 @@ class ParseLaws(object):
         logger.debug('get_page_with_param: self.url=%s, params=%s' % (self.url, params))
         if params == None:
             try:
-                html_page = urllib2.urlopen(self.url).read().decode('windows-1255').encode('utf-8')
-            except urllib2.URLError:
+                html_page = fetch(self.url).decode('windows-1255').encode('utf-8')
+            except FetchError:
                 logger.error("can't open URL: %s" % self.url)
                 return None
             try:
@@ -53,11 +54,10 @@ class ParseLaws(object):
         else:
             data = urllib.urlencode(params)
             try:
-                url_data = urllib2.urlopen(self.url,data)
-            except urllib2.URLError:
+                html_page = fetch(self.url,data).decode('windows-1255').encode('utf-8')
+            except FetchError:
                 logger.error("can't open URL: %s" % self.url)
                 return None
-            html_page = url_data.read().decode('windows-1255').encode('utf-8')
             try:
                 soup = BeautifulSoup(html_page)
             except HTMLParseError, e:
@@ -256,7 +256,7 @@ class ParseGovLaws(ParseKnessetLaws):
                 logger.debug('reusing %s from %s' % (pdf_url, filename))
         if not filename:
             logger.debug('getting %s' % pdf_url)
-            contents = urllib2.urlopen(pdf_url).read()
+            contents = fetch(pdf_url, max_age=document_max_age())
             link_file = LinkedFile()
             saved_filename = os.path.basename(urlparse(pdf_url).path)
             link_file.link_file.save(saved_filename, ContentFile(contents))
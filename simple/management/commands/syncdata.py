@@ -1,22 +1,32 @@
 # -*- coding: utf-8 -*-
-import urllib2, urllib, cookielib, re, gzip, datetime, time, logging, os, sys,traceback, difflib
+import urllib2, urllib, cookielib, re, gzip, datetime, time, logging, os, sys,traceback, difflib, itertools
 
-from cStringIO import StringIO
-from pyth.plugins.rtf15.reader import Rtf15Reader
 from optparse import make_option
 
-from django.core.management.base import NoArgsCommand
+from django.core.management.base import NoArgsCommand, CommandError
 from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
+from django.db import connection, transaction
 from django.db.models import Max,Count
 
-from mks.models import Member,Party,Membership,WeeklyPresence
-from persons.models import Person,PersonAlias
+from mks.models import Member,Party,Membership,WeeklyPresence,Knesset
+from mks.correlations import update_correlations
+from mks.name_matcher import get_member_name_matcher
 from laws.models import (Vote, VoteAction, Bill, Law, PrivateProposal,
-     KnessetProposal, GovProposal, GovLegislationCommitteeDecision)
+     KnessetProposal, GovProposal, GovLegislationCommitteeDecision,
+     MemberVotingStatistics, refresh_group_voting_statistics, vote_action_counters, month_of)
+from laws.vote_matrix import expire_vote_matrix
+from laws.vote_properties import update_votes_counts
+from laws.dedupe import merge_duplicates
+from agendas.models import AgendaVote, AgendaMemberScore
+from actstream.models import Action
 from links.models import Link
-from committees.models import Committee,CommitteeMeeting
+from committees.models import Committee,CommitteeMeeting,ProtocolText
+from simple.models import SyncState
 from knesset.utils import cannonize
+from knesset.matcher import MultiMatcher
+from knesset.fetcher import get_fetcher, fetch, document_max_age, FetchError
+from simple.rtf import get_converter
 
 import mk_info_html_parser as mk_parser
 import parse_presence, parse_laws, mk_roles_parser, parse_remote
@@ -30,6 +40,20 @@ ENCODING = 'utf8'
 DATA_ROOT = getattr(settings, 'DATA_ROOT',
                     os.path.join(settings.PROJECT_ROOT, os.path.pardir, os.path.pardir, 'data'))
 
+# proposal models by the kind used in the proposals matchers keys
+PROPOSAL_MODELS = {'gov': GovProposal, 'knesset': KnessetProposal, 'private': PrivateProposal}
+
+VOTE_PAGE_URL = "http://www.knesset.gov.il/vote/heb/Vote_Res_Map.asp?vote_id_t=%d"
+# number of vote pages fetched ahead of the one being parsed
+VOTE_PAGES_PREFETCH = 8
+
+# number of lines of the data files loaded in each transaction
+BATCH_SIZE = getattr(settings, 'SYNCDATA_BATCH_SIZE', 1000)
+
+# downloaded data is appended to the last segment of a tsv archive until it
+# reaches this size (in bytes, compressed), and then to a new segment
+SEGMENT_SIZE = getattr(settings, 'SYNCDATA_SEGMENT_SIZE', 16 * 1024 * 1024)
+
 logger = logging.getLogger("open-knesset.syncdata")
 
 try:
@@ -39,6 +63,99 @@ except:
     logger.warn("can't find special committees")
     SPECIAL_COMMITTEES = {}
 
+def iter_tsv(filename, min_length=2):
+    """
+    Yields the fields of each line of a gzipped tsv file from DATA_ROOT,
+    reading it line by line. Lines shorter than min_length are skipped.
+    """
+    f = gzip.open(os.path.join(DATA_ROOT, filename))
+    try:
+        for line in f:
+            line = line.rstrip('\n')
+            if len(line) >= min_length:
+                yield line.split('\t')
+    finally:
+        f.close()
+
+def segment_path(name, segment):
+    """
+    The path of a segment of the tsv archive name. Segment 0 is name.tsv.gz,
+    so archives from before the rotation are read as their first segment.
+    """
+    if segment == 0:
+        return os.path.join(DATA_ROOT, '%s.tsv.gz' % name)
+    return os.path.join(DATA_ROOT, '%s.%d.tsv.gz' % (name, segment))
+
+def last_segment(name):
+    """
+    The number of the last segment of the tsv archive name, or -1 if it has none.
+    """
+    segment = -1
+    while os.path.exists(segment_path(name, segment + 1)):
+        segment += 1
+    return segment
+
+def open_segment(name):
+    """
+    Opens the segment of the tsv archive name new lines should be appended to,
+    rotating to a new segment once the last one reaches SEGMENT_SIZE.
+    """
+    segment = max(last_segment(name), 0)
+    path = segment_path(name, segment)
+    if os.path.exists(path) and os.path.getsize(path) >= SEGMENT_SIZE:
+        path = segment_path(name, segment + 1)
+    return gzip.open(path, 'ab')
+
+def iter_archive(name, segment=0, offset=0, min_length=2):
+    """
+    Yields (segment, line number, fields) of the lines of the tsv archive name,
+    starting after line offset of the given segment. The line number is of the
+    line in its segment, counting from 1, so (segment, line number) can be
+    stored as the position to continue from.
+    """
+    while os.path.exists(segment_path(name, segment)):
+        f = gzip.open(segment_path(name, segment))
+        try:
+            for line_number, line in enumerate(itertools.islice(f, offset, None), offset + 1):
+                line = line.rstrip('\n')
+                if len(line) >= min_length:
+                    yield segment, line_number, line.split('\t')
+        finally:
+            f.close()
+        segment += 1
+        offset = 0
+
+def iter_chunks(iterable, size):
+    """
+    Yields lists of up to size items of iterable.
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+def add_missing_links(model, field_name, links, batch_size=BATCH_SIZE):
+    """
+    Adds the (object id, related object id) links missing from the many to many field field_name
+    of model. The links are diffed against the existing rows of the through table in one query,
+    and the missing ones are inserted in bulk. Returns the list of the links added.
+    """
+    links = set(links)
+    if not links:
+        return []
+    field = model._meta.get_field(field_name)
+    through = field.rel.through
+    source, target = field.m2m_field_name(), field.m2m_reverse_field_name()
+    existing = set(through.objects.filter(**{
+        '%s__in' % source: set(l[0] for l in links),
+        '%s__in' % target: set(l[1] for l in links)}).values_list(source, target))
+    new_links = sorted(links - existing)
+    through.objects.bulk_create([through(**{'%s_id' % source: a, '%s_id' % target: b}) for a, b in new_links],
+                                batch_size=batch_size)
+    return new_links
+
 class Command(NoArgsCommand):
     option_list = NoArgsCommand.option_list + (
         make_option('--all', action='store_true', dest='all',
@@ -57,6 +174,15 @@ class Command(NoArgsCommand):
             help="online update of data."),
         make_option('--committees', action='store_true', dest='committees',
             help="online update of committees data."),
+        make_option('--replay', action='store_true', dest='replay',
+            help="serve all the fetched pages from the fetch cache, without going online."),
+        make_option('--since', action='store', dest='since',
+            help="process only votes from this date on (YYYY-MM-DD)"),
+        make_option('--full-load', action='store_true', dest='full_load',
+            help="load the whole data files again, instead of only the lines added since the last load."),
+        make_option('--batch-size', action='store', dest='batch_size', type='int',
+            default=BATCH_SIZE,
+            help="number of lines of the data files loaded in each transaction."),
 
     )
     help = "Downloads data from sources, parses it and loads it to the Django DB."
@@ -127,23 +253,23 @@ class Command(NoArgsCommand):
         logger.info("update laws data")
         laws = self.download_laws()
         logger.debug("finished downloading laws data")
+        laws_matcher = MultiMatcher((i, l[1]) for i, l in enumerate(laws))
         votes = Vote.objects.all().order_by('-time')[:200]
         for v in votes:
             search_name = self.get_search_string(v.title.encode('UTF-8'))
-            for l in laws:
-                if search_name.find(l[1]) >= 0:
-                    #print "match"
-                    v.summary = l[2]
-                    v.save()
-                    try:
-                        (link, created) = Link.objects.get_or_create(title=u'מסמך הצעת החוק באתר הכנסת', url=l[3], content_type=ContentType.objects.get_for_model(v), object_pk=str(v.id))
-                        if created:
-                            link.save()
-                    except Exception, e:
-                        logger.error(e)
-
-            if v.full_text == None:
-                self.get_full_text(v)
+            for i in sorted(laws_matcher.find(search_name)):
+                l = laws[i]
+                #print "match"
+                v.summary = l[2]
+                v.save()
+                try:
+                    (link, created) = Link.objects.get_or_create(title=u'מסמך הצעת החוק באתר הכנסת', url=l[3], content_type=ContentType.objects.get_for_model(v), object_pk=str(v.id))
+                    if created:
+                        link.save()
+                except Exception, e:
+                    logger.error(e)
+
+        self.get_full_texts([v for v in votes if v.full_text == None])
         logger.debug("finished updating laws data")
 
     def update_vote_from_page(self, vote_id, vote_src_url, page):
@@ -236,59 +362,71 @@ class Command(NoArgsCommand):
             vote_id += 1
 
     def get_votes_data(self):
+        """
+        Downloads the votes after the last downloaded one, appending them to the
+        votes and results archives, and records the last downloaded vote id.
+        """
         self.update_last_downloaded_vote_id()
         r = range(self.last_downloaded_vote_id+1,17000) # this is the range of page ids to go over. currently its set manually.
-        for id in r:
-            f  = gzip.open(os.path.join(DATA_ROOT, 'results.tsv.gz'), "ab")
-            f2 = gzip.open(os.path.join(DATA_ROOT, 'votes.tsv.gz'),"ab")
-            (page, src_url) = self.read_votes_page(id)
-            title = self.get_page_title(page)
-            if(title == """הצבעות במליאה-חיפוש"""): # found no vote with this id
-                logger.debug("no vote found at id %d" % id)
-            else:
-                count_for = 0
-                count_against = 0
-                count_abstain = 0
-                count_no_vote = 0
-                (name, meeting_num, vote_num, date) = self.get_vote_data(page)
-                results = self.read_member_votes(page)
-                for (voter,party,vote) in results:
-                    f.write("%d\t%s\t%s\t%s\n" % (id,voter,party,vote))
-                    if(vote=="for"):
-                        count_for += 1
-                    if(vote=="against"):
-                        count_against += 1
-                    if(vote=="abstain"):
-                        count_abstain += 1
-                    if(vote=="no-vote"):
-                        count_no_vote += 1
-                f2.write("%d\t%s\t%s\t%s\t%s\t%s\t%d\t%d\t%d\t%d\n" % (id, src_url, name, meeting_num, vote_num, date, count_for, count_against, count_abstain, count_no_vote))
-                logger.debug("downloaded data with vote id %d" % id)
-            #print " %.2f%% done" % ( (100.0*(float(id)-r[0]))/(r[-1]-r[0]) )
+        f  = open_segment('results')
+        f2 = open_segment('votes')
+        try:
+            for id in r:
+                result = self.read_votes_page(id)
+                if result is None:
+                    # stop here, so the recorded last id stays below the vote that failed
+                    logger.warn("failed to read vote id %d, stopping" % id)
+                    break
+                (page, src_url) = result
+                title = self.get_page_title(page)
+                if(title == """הצבעות במליאה-חיפוש"""): # found no vote with this id
+                    logger.debug("no vote found at id %d" % id)
+                else:
+                    count_for = 0
+                    count_against = 0
+                    count_abstain = 0
+                    count_no_vote = 0
+                    (name, meeting_num, vote_num, date) = self.get_vote_data(page)
+                    results = self.read_member_votes(page)
+                    for (voter,party,vote) in results:
+                        f.write("%d\t%s\t%s\t%s\n" % (id,voter,party,vote))
+                        if(vote=="for"):
+                            count_for += 1
+                        if(vote=="against"):
+                            count_against += 1
+                        if(vote=="abstain"):
+                            count_abstain += 1
+                        if(vote=="no-vote"):
+                            count_no_vote += 1
+                    f2.write("%d\t%s\t%s\t%s\t%s\t%s\t%d\t%d\t%d\t%d\n" % (id, src_url, name, meeting_num, vote_num, date, count_for, count_against, count_abstain, count_no_vote))
+                    logger.debug("downloaded data with vote id %d" % id)
+                    self.last_downloaded_vote_id = id
+                #print " %.2f%% done" % ( (100.0*(float(id)-r[0]))/(r[-1]-r[0]) )
+        finally:
             f.close()
             f2.close()
+            SyncState.objects.filter(source='votes').update(last_id=self.last_downloaded_vote_id)
 
     def update_last_downloaded_member_id(self):
         """
-        Reads local members file, and sets self.last_downloaded_member_id to the highest id found in the file.
+        Sets self.last_downloaded_member_id to the highest member id downloaded, as recorded in the sync state.
+        The local members file is scanned only once, when there is no sync state yet.
         This is later used to skip downloading of data alreay downloaded.
         """
-        try:
-            f = gzip.open(os.path.join(DATA_ROOT, 'members.tsv.gz'))
-        except:
-            self.last_downloaded_member_id = 0
-            logger.debug("members file does not exist. setting last_downloaded_member_id to 0")
-            return
-        content = f.read().split('\n')
-        for line in content:
-            if(len(line)<2):
-                continue
-            s = line.split('\t')
-            id = int(s[0])
-            if id > self.last_downloaded_member_id:
-                self.last_downloaded_member_id = id
-        logger.debug("last member id found in local files is %d. " % self.last_downloaded_member_id)
-        f.close()
+        self.last_downloaded_member_id = self.last_downloaded_id('members')
+        logger.debug("last member id downloaded is %d. " % self.last_downloaded_member_id)
+
+    def last_downloaded_id(self, name):
+        """
+        Returns the last id downloaded to the tsv archive name. It is read from the sync state of name, which is
+        initialized from the highest id found in the archive the first time.
+        """
+        state = SyncState.objects.get_for(name)
+        if not state.last_id:
+            for _, _, fields in iter_archive(name):
+                state.last_id = max(state.last_id, int(fields[0]))
+            state.save()
+        return state.last_id
 
     def get_members_data(self, max_mk_id=1000):
         """downloads members data to local files
@@ -296,6 +434,8 @@ class Command(NoArgsCommand):
         # TODO - find max member id in knesset website and use for max_mk_id
 
         f  = gzip.open(os.path.join(DATA_ROOT, 'members.tsv.gz'), "wb")
+        SyncState.objects.get_for('members')
+        last_id = 0
 
         fields = ['img_link','טלפון','פקס','אתר נוסף',
                   'דואר אלקטרוני','מצב משפחתי',
@@ -318,7 +458,9 @@ class Command(NoArgsCommand):
                     value = m[field].encode(ENCODING)
                 f.write("%s\t" % (  value ))
             f.write("\n")
+            last_id = id
         f.close()
+        SyncState.objects.filter(source='members').update(last_id=last_id)
 
     def download_all(self):
         self.get_members_data()
@@ -328,25 +470,12 @@ class Command(NoArgsCommand):
 
     def update_last_downloaded_vote_id(self):
         """
-        Reads local votes file, and sets self.last_downloaded_id to the highest id found in the file.
+        Sets self.last_downloaded_vote_id to the highest vote id downloaded, as recorded in the sync state.
+        The local votes archive is scanned only once, when there is no sync state yet.
         This is later used to skip downloading of data alreay downloaded.
         """
-        try:
-            f = gzip.open(os.path.join(DATA_ROOT, 'votes.tsv.gz'))
-        except:
-            self.last_downloaded_vote_id = 0
-            logger.debug("votes file does not exist. setting last_downloaded_vote_id to 0")
-            return
-        content = f.read().split('\n')
-        for line in content:
-            if(len(line)<2):
-                continue
-            s = line.split('\t')
-            vote_id = int(s[0])
-            if vote_id > self.last_downloaded_vote_id:
-                self.last_downloaded_vote_id = vote_id
-        logger.debug("last id found in local files is %d. " % self.last_downloaded_vote_id)
-        f.close()
+        self.last_downloaded_vote_id = self.last_downloaded_id('votes')
+        logger.debug("last vote id downloaded is %d. " % self.last_downloaded_vote_id)
 
     def update_mks_is_current(self):
         """Set is_current=True if and only if mk is currently serving.
@@ -458,212 +587,279 @@ class Command(NoArgsCommand):
                     }
 
 
-    def update_db_from_files(self):
+    def load_archive(self, name, load, batch_size, full=False):
+        """
+        Calls load with chunks of up to batch_size lines of the tsv archive name that were not loaded yet, each in
+        its own transaction along with advancing the loaded position in the sync state of name. If full, the whole
+        archive is loaded again.
+        """
+        state = SyncState.objects.get_for(name)
+        if full:
+            state.segment, state.offset = 0, 0
+        for chunk in iter_chunks(iter_archive(name, state.segment, state.offset), batch_size):
+            with transaction.commit_on_success():
+                load([fields for _, _, fields in chunk])
+                state.segment, state.offset = chunk[-1][:2]
+                state.save()
+
+    def update_db_from_files(self, batch_size=BATCH_SIZE, full=False):
+        """
+        Loads the votes and results archives to the db, continuing from where the previous load stopped unless full.
+        """
         logger.debug("Update DB From Files")
 
         try:
             laws = [] # of lists: [name,name_for_search,explanation,link]
-            f = gzip.open(os.path.join(DATA_ROOT, 'laws.tsv.gz'))
-            content = f.read().split('\n')
-            for line in content:
-                law = line.split('\t')
+            for law in iter_tsv('laws.tsv.gz', min_length=0):
                 if len(law)==3:
                     name_for_search = self.get_search_string(law[0])
                     law.insert(1, name_for_search)
                     laws.append(law)
-            f.close()
+            laws_matcher = MultiMatcher((i, law[1]) for i, law in enumerate(laws))
 
             parties = dict() # key: party-name; value: Party
             members = dict() # key: member-name; value: Member
-            votes   = dict() # key: id; value: Vote
+            votes   = dict() # key: src id; value: (Vote id, Vote time)
             memberships = dict() # key: (member.id,party.id)
-            current_max_src_id = Vote.objects.aggregate(Max('src_id'))['src_id__max']
-            if current_max_src_id == None: # the db contains no votes, meaning its empty
-                current_max_src_id = 0
 
             logger.debug("processing votes data")
-            f = gzip.open(os.path.join(DATA_ROOT, 'votes.tsv.gz'))
-            content = f.read().split('\n')
-            for line in content:
-                if len(line) <= 1:
-                    continue
-                (vote_id, vote_src_url, vote_label, vote_meeting_num, vote_num, vote_time_string, _, _, _, _) = line.split('\t')
-                #if vote_id < current_max_src_id: # skip votes already parsed.
-                #    continue
-                vote_time_string = vote_time_string.replace('&nbsp;',' ')
-                for i in self.heb_months:
-                    if i in vote_time_string:
-                        month = self.heb_months.index(i)+1
-                day = re.search("""(\d\d?)""", vote_time_string).group(1)
-                year = re.search("""(\d\d\d\d)""", vote_time_string).group(1)
-                vote_hm = datetime.datetime.strptime ( vote_time_string.split(' ')[-1], "%H:%M" )
-                vote_date = datetime.date(int(year),int(month),int(day))
-                vote_time = datetime.datetime(int(year), int(month), int(day), vote_hm.hour, vote_hm.minute)
-                vote_label_for_search = self.get_search_string(vote_label)
-
-                #if vote_date < datetime.date(2009, 02, 24): # vote before 18th knesset
-                #    continue
-
-                try:
-                    v = Vote.objects.get(src_id=vote_id)
-                    created = False
-                except:
-                    v = Vote(title=vote_label, time_string=vote_time_string, importance=1, src_id=vote_id, time=vote_time)
-                    try:
-                        vote_meeting_num = int(vote_meeting_num)
-                        v.meeting_number = vote_meeting_num
-                    except:
-                        pass
-                    try:
-                        vote_num = int(vote_num)
-                        v.vote_number = vote_num
-                    except:
-                        pass
-                    v.src_url = vote_src_url
-                    for law in laws:
-                        (_,law_name_for_search,law_exp,law_link) = law
-                        if vote_label_for_search.find(law_name_for_search) >= 0:
-                            v.summary = law_exp
-                            v.full_text_url = law_link
-                    v.save()
-                    if v.full_text_url != None:
-                        l = Link(title=u'מסמך הצעת החוק באתר הכנסת', url=v.full_text_url, content_type=ContentType.objects.get_for_model(v), object_pk=str(v.id))
-                        l.save()
-                votes[int(vote_id)] = v
-            f.close()
+            self.load_archive('votes', lambda lines: self.load_votes(lines, laws, laws_matcher, votes, batch_size),
+                              batch_size, full)
 
             logger.debug("processing member votes data")
-            f = gzip.open(os.path.join(DATA_ROOT, 'results.tsv.gz'))
-            content = f.read().split('\n')
-            for line in content:
-                if(len(line)<2):
-                    continue
-                s = line.split('\t') # (id,voter,party,vote)
+            self.load_archive('results',
+                              lambda lines: self.load_vote_actions(lines, votes, parties, members, memberships,
+                                                                   batch_size),
+                              batch_size, full)
+            expire_vote_matrix()
+            #Member.objects.filter(end_date__isnull=True).delete() # remove members that haven't voted at all - no end date
+            logger.debug("done")
+        except:
+            exceptionType, exceptionValue, exceptionTraceback = sys.exc_info()
+            logger.error("%s", ''.join(traceback.format_exception(exceptionType, exceptionValue, exceptionTraceback)))
 
-                vote_id = int(s[0])
-                voter = s[1]
-                voter_party = s[2]
+    def parse_vote(self, fields, laws, laws_matcher):
+        """
+        Returns a new unsaved Vote from a line of votes.tsv. laws_matcher finds
+        the indexes in laws of the law names appearing in a vote label.
+        """
+        (vote_id, vote_src_url, vote_label, vote_meeting_num, vote_num, vote_time_string, _, _, _, _) = fields
+        vote_time_string = vote_time_string.replace('&nbsp;',' ')
+        for i in self.heb_months:
+            if i in vote_time_string:
+                month = self.heb_months.index(i)+1
+        day = re.search("""(\d\d?)""", vote_time_string).group(1)
+        year = re.search("""(\d\d\d\d)""", vote_time_string).group(1)
+        vote_hm = datetime.datetime.strptime ( vote_time_string.split(' ')[-1], "%H:%M" )
+        vote_time = datetime.datetime(int(year), int(month), int(day), vote_hm.hour, vote_hm.minute)
+        vote_label_for_search = self.get_search_string(vote_label)
 
-                # transform party names to canonical form
-                if(voter_party in self.party_aliases):
-                    voter_party = self.party_aliases[voter_party]
+        v = Vote(title=vote_label, time_string=vote_time_string, importance=1, src_id=int(vote_id), time=vote_time)
+        try:
+            v.meeting_number = int(vote_meeting_num)
+        except ValueError:
+            pass
+        try:
+            v.vote_number = int(vote_num)
+        except ValueError:
+            pass
+        v.src_url = vote_src_url
+        matches = laws_matcher.find(vote_label_for_search)
+        if matches: # the last matching law wins
+            (_,_,law_exp,law_link) = laws[max(matches)]
+            v.summary = law_exp
+            v.full_text_url = law_link
+        return v
+
+    def load_votes(self, lines, laws, laws_matcher, votes, batch_size):
+        """
+        Creates the votes of a chunk of votes.tsv lines that are not in the db
+        yet, and adds the (id, time) of all of them to votes.
+        """
+        lines = dict((int(fields[0]), fields) for fields in lines)
+        for src_id, vote_id, vote_time in Vote.objects.filter(
+                src_id__in=lines.keys()).values_list('src_id', 'id', 'time'):
+            votes[src_id] = (vote_id, vote_time)
+
+        new_votes = [self.parse_vote(fields, laws, laws_matcher)
+                     for src_id, fields in lines.items() if src_id not in votes]
+        if not new_votes:
+            return
+        Vote.objects.bulk_create(new_votes, batch_size=batch_size)
 
-                vote = s[3]
+        full_text_urls = dict((v.src_id, v.full_text_url) for v in new_votes if v.full_text_url != None)
+        vote_ct = ContentType.objects.get_for_model(Vote)
+        links = []
+        for src_id, vote_id, vote_time in Vote.objects.filter(
+                src_id__in=[v.src_id for v in new_votes]).values_list('src_id', 'id', 'time'):
+            votes[src_id] = (vote_id, vote_time)
+            if src_id in full_text_urls:
+                links.append(Link(title=u'מסמך הצעת החוק באתר הכנסת', url=full_text_urls[src_id],
+                                  content_type=vote_ct, object_pk=str(vote_id)))
+        Link.objects.bulk_create(links, batch_size=batch_size)
+
+    def load_vote_actions(self, lines, votes, parties, members, memberships, batch_size):
+        """
+        Creates the vote actions of a chunk of results.tsv lines that are not
+        in the db yet, updating the dates of the parties, members and
+        memberships on the way. Parties, members and memberships are cached in
+        the given dicts, and the ones whose dates changed are saved with the
+        chunk, so they are never behind the loaded position of the archive.
+        """
+        actions = [] # of (vote id, member id, type)
+        changed = dict() # key: (model, id); value: Party, Member or Membership
+        vote_times = dict() # key: Vote id; value: Vote time
+        missing = set(int(s[0]) for s in lines) - set(votes) # loaded in previous runs
+        for src_id, vote_id, vote_time in Vote.objects.filter(src_id__in=missing).values_list('src_id', 'id', 'time'):
+            votes[src_id] = (vote_id, vote_time)
+        for s in lines: # (id,voter,party,vote)
+            vote_id = int(s[0])
+            voter = s[1]
+            voter_party = s[2]
 
-                try:
-                    v = votes[vote_id]
-                except KeyError: #this vote was skipped in this read, also skip voteactions and members
-                    continue
-                vote_date = v.time.date()
+            # transform party names to canonical form
+            if(voter_party in self.party_aliases):
+                voter_party = self.party_aliases[voter_party]
 
-                # create/get the party appearing in this vote
-                if voter_party in parties:
-                    p = parties[voter_party]
-                    created = False
-                else:
-                    p,created = Party.objects.get_or_create(name=voter_party)
-                    parties[voter_party] = p
-                #if created: # this is magic needed because of unicode chars. if you don't do this, the object p will have gibrish as its name.
-                            #only when it comes back from the db it has valid unicode chars.
-                #    p = Party.objects.get(name=voter_party)
-
-                # use this vote's time to update the party's start date and end date
-                if (p.start_date is None) or (p.start_date > vote_date):
-                    p.start_date = vote_date
-                if (p.end_date is None) or (p.end_date < vote_date):
-                    p.end_date = vote_date
-                if created: # save on first time, so it would have an id, be able to link, etc. all other updates are saved in the end
-                    p.save()
-
-                # create/get the member voting
-                if voter in members:
-                    m = members[voter]
-                    created = False
-                else:
-                    try:
-                        m = Member.objects.get(name=voter)
-                    except:   # if there are several people with same age,
-                        m = Member.objects.filter(name=voter).order_by('-date_of_birth')[0] # choose the younger. TODO: fix this
-                    members[voter] = m
-                #m.party = p;
-                #if created: # again, unicode magic
-                #    m = Member.objects.get(name=voter)
-                # use this vote's date to update the member's dates.
-                if (m.start_date is None) or (m.start_date > vote_date):
-                    m.start_date = vote_date
-                if (m.end_date is None) or (m.end_date < vote_date):
-                    m.end_date = vote_date
-                #if created: # save on first time, so it would have an id, be able to link, etc. all other updates are saved in the end
-                #    m.save()
-
-
-                # create/get the membership (connection between member and party)
-                if ((m.id,p.id) in memberships):
-                    ms = memberships[(m.id,p.id)]
-                    created = False
-                else:
-                    ms,created = Membership.objects.get_or_create(member=m,party=p)
-                    memberships[(m.id,p.id)] = ms
-                #if created: # again, unicode magic
-                #    ms = Membership.objects.get(member=m,party=p)
-                # again, update the dates on the membership
-                if (ms.start_date is None) or (ms.start_date > vote_date):
-                    ms.start_date = vote_date
-                if (ms.end_date is None) or (ms.end_date < vote_date):
-                    ms.end_date = vote_date
-                if created: # save on first time, so it would have an id, be able to link, etc. all other updates are saved in the end
-                    ms.save()
-
-                # add the current member's vote
-
-                va,created = VoteAction.objects.get_or_create(vote = v, member = m, type = vote)
-                if created:
-                    va.save()
+            vote = s[3]
 
-            logger.debug("done")
-            logger.debug("saving data: %d parties, %d members, %d memberships " % (len(parties), len(members), len(memberships) ))
-            for p in parties:
-                parties[p].save()
-            for m in members:
-                members[m].save()
-            #Member.objects.filter(end_date__isnull=True).delete() # remove members that haven't voted at all - no end date
-            for ms in memberships:
-                memberships[ms].save()
-            #for va in voteactions:
-            #    voteactions[va].save()
-            logger.debug("done")
-            f.close()
-        except:
-            exceptionType, exceptionValue, exceptionTraceback = sys.exc_info()
-            logger.error("%s", ''.join(traceback.format_exception(exceptionType, exceptionValue, exceptionTraceback)))
+            try:
+                v_id, v_time = votes[vote_id]
+            except KeyError: #this vote was skipped, also skip voteactions and members
+                continue
+            vote_date = v_time.date()
+            vote_times[v_id] = v_time
 
+            # create/get the party appearing in this vote
+            if voter_party in parties:
+                p = parties[voter_party]
+                created = False
+            else:
+                p,created = Party.objects.get_or_create(name=voter_party)
+                parties[voter_party] = p
+
+            # use this vote's time to update the party's start date and end date
+            if (p.start_date is None) or (p.start_date > vote_date):
+                p.start_date = vote_date
+                changed[(Party, p.id)] = p
+            if (p.end_date is None) or (p.end_date < vote_date):
+                p.end_date = vote_date
+                changed[(Party, p.id)] = p
+            if created: # save on first time, so it would have an id, be able to link, etc. other updates are saved with the chunk
+                p.save()
+
+            # create/get the member voting
+            if voter in members:
+                m = members[voter]
+            else:
+                try:
+                    m = Member.objects.get(name=voter)
+                except:   # if there are several people with same age,
+                    m = Member.objects.filter(name=voter).order_by('-date_of_birth')[0] # choose the younger. TODO: fix this
+                members[voter] = m
+            # use this vote's date to update the member's dates.
+            if (m.start_date is None) or (m.start_date > vote_date):
+                m.start_date = vote_date
+                changed[(Member, m.id)] = m
+            if (m.end_date is None) or (m.end_date < vote_date):
+                m.end_date = vote_date
+                changed[(Member, m.id)] = m
+
+            # create/get the membership (connection between member and party)
+            if ((m.id,p.id) in memberships):
+                ms = memberships[(m.id,p.id)]
+                created = False
+            else:
+                ms,created = Membership.objects.get_or_create(member=m,party=p)
+                memberships[(m.id,p.id)] = ms
+            # again, update the dates on the membership
+            if (ms.start_date is None) or (ms.start_date > vote_date):
+                ms.start_date = vote_date
+                changed[(Membership, ms.id)] = ms
+            if (ms.end_date is None) or (ms.end_date < vote_date):
+                ms.end_date = vote_date
+                changed[(Membership, ms.id)] = ms
+            if created: # save on first time, so it would have an id, be able to link, etc. other updates are saved with the chunk
+                ms.save()
+
+            actions.append((v_id, m.id, vote))
+
+        logger.debug("saving dates of %d parties, members and memberships" % len(changed))
+        for o in changed.values():
+            o.save()
+
+        # add the members' votes that are not in the db yet
+        vote_ids = set(a[0] for a in actions)
+        existing = set(VoteAction.objects.filter(vote__id__in=vote_ids).values_list(
+            'vote_id', 'member_id', 'type'))
+        new_actions = []
+        for a in actions:
+            if a not in existing:
+                existing.add(a)
+                new_actions.append(a)
+        if not new_actions:
+            return
+        VoteAction.objects.bulk_create([VoteAction(vote_id=v_id, member_id=m_id, type=vote_type)
+                                        for v_id, m_id, vote_type in new_actions],
+                                       batch_size=batch_size)
+        self.vote_actions_created(new_actions, vote_times, batch_size)
 
-    def calculate_votes_importances(self):
+    def vote_actions_created(self, actions, vote_times, batch_size):
+        """
+        Does what the VoteAction post_save listeners do, for vote actions
+        created in bulk: records the members' activity, updates their voting
+        statistics and the agenda scores of the votes.
+        """
+        member_ct = ContentType.objects.get_for_model(Member)
+        vote_ct = ContentType.objects.get_for_model(Vote)
+        activity = []
+        counts = {}
+        for v_id, m_id, vote_type in actions:
+            activity.append(Action(actor_content_type=member_ct, actor_object_id=m_id, verb='voted',
+                                   description=VoteAction(type=vote_type).get_type_display(),
+                                   target_content_type=vote_ct, target_object_id=v_id,
+                                   timestamp=vote_times[v_id]))
+            deltas = counts.setdefault((m_id, month_of(vote_times[v_id])), [0] * 4)
+            for i, delta in enumerate(vote_action_counters(vote_type, False, False, False)):
+                deltas[i] += delta
+        Action.objects.bulk_create(activity, batch_size=batch_size)
+        MemberVotingStatistics.objects.add_counts(counts)
+
+        agenda_ids = set(AgendaVote.objects.filter(vote__id__in=set(a[0] for a in actions)).values_list(
+            'agenda_id', flat=True))
+        if agenda_ids:
+            AgendaMemberScore.objects.rebuild(agenda_ids=agenda_ids,
+                                              member_ids=set(a[1] for a in actions))
+
+
+    def calculate_votes_importances(self, since=None):
         """
         Calculates votes importances. currently uses rule of thumb: number of voters against + number of voters for / 120.
+        The vote counters and controversy are recomputed along the way. since limits it to the votes from that time on.
         """
-        for v in Vote.objects.all():
-            v.importance = float(v.votes.filter(voteaction__type='for').count() + v.votes.filter(voteaction__type='against').count()) / 120
-            v.save()
+        with transaction.commit_on_success():
+            count = update_votes_counts(since=since)
+        logger.debug('updated the importance of %d votes' % count)
+
+    def calculate_correlations(self):
+        """
+        Calculates the voting correlations between all pairs of members of the current knesset.
+        """
+        update_correlations(Knesset.objects.current_knesset())
 
-    def read_votes_page(self,voteId, retry=0):
+    def read_votes_page(self,voteId):
         """
-        Gets a votes page from the knesset website.
+        Gets a votes page from the knesset website, and starts fetching the next ones.
         returns a string (utf encoded)
         """
-        url = "http://www.knesset.gov.il/vote/heb/Vote_Res_Map.asp?vote_id_t=%d" % voteId
+        url = VOTE_PAGE_URL % voteId
+        fetcher = get_fetcher()
+        fetcher.prefetch([VOTE_PAGE_URL % i for i in range(voteId+1, voteId+1+VOTE_PAGES_PREFETCH)])
         try:
-            urlData = urllib2.urlopen(url)
-            page = urlData.read().decode('windows-1255').encode('utf-8')
-            time.sleep(2)
-        except Exception,e:
-            logger.warn(e)
-            if retry < 5:
-                logger.warn("waiting some time and trying again... (# of retries = %d)" % (retry+1) )
-                page = self.read_votes_page(voteId, retry+1)
-            else:
-                logger.error("failed too many times. last error: %s", e)
-                return None
+            page = fetcher.fetch(url).decode('windows-1255').encode('utf-8')
+        except FetchError, e:
+            logger.error("failed too many times. last error: %s", e)
+            return None
         return (page, url)
 
     def read_member_votes(self,page,return_ids=False):
@@ -754,17 +950,24 @@ class Command(NoArgsCommand):
             exceptionType, exceptionValue, exceptionTraceback = sys.exc_info()
             logger.error("%s%s", ''.join(traceback.format_exception(exceptionType, exceptionValue, exceptionTraceback)), '\nsearch_text='+search_text.encode('utf8')+'\nvote.title='+v.title.encode('utf8'))
 
-    def check_vote_mentioned_in_cm(self, v, cm):
+    def vote_search_text(self, v):
         m = v.title[v.title.find(' - ')+2:]
-        v_search_text = self.get_search_string(m.encode('utf8'))
+        return self.get_search_string(m.encode('utf8'))
+
+    def check_vote_mentioned_in_cm(self, v, cm):
+        v_search_text = self.vote_search_text(v)
         cm_search_text = self.get_search_string(cm.protocol_text.encode('utf8')).replace('\n','')
         if cm_search_text.find(v_search_text)>=0:
             cm.votes_mentioned.add(v)
 
     def find_votes_in_cms(self):
-        for cm in CommitteeMeeting.objects.all():
-            for v in Vote.objects.all():
-                self.check_vote_mentioned_in_cm(v, cm)
+        votes_matcher = MultiMatcher((v.id, self.vote_search_text(v)) for v in Vote.objects.only('id', 'title'))
+        cm_ids = CommitteeMeeting.objects.exclude(protocol_fingerprint='').values_list('id', flat=True)
+        for cm_id, protocol_text in ProtocolText.objects.iter_texts(cm_ids):
+            cm_search_text = self.get_search_string(protocol_text.encode('utf8')).replace('\n','')
+            vote_ids = votes_matcher.find(cm_search_text)
+            if vote_ids:
+                CommitteeMeeting(id=cm_id).votes_mentioned.add(*vote_ids)
 
     def get_protocols_page(self, page, page_num):
         logger.debug('get_protocols_page. page_num=%d' % page_num)
@@ -838,16 +1041,7 @@ class Command(NoArgsCommand):
         (last_page, page_res) = self.get_protocols_page(page, page_num)
         res = page_res[:]
 
-        mk_names = []
-        mks = []
-        mk_persons = Person.objects.filter(
-            mk__isnull=False,
-            mk__current_party__isnull=False).select_related('mk')
-        mks.extend([person.mk for person in mk_persons])
-        mk_aliases = PersonAlias.objects.filter(person__in=mk_persons)
-        mk_names.extend(mk_persons.values_list('name',flat=True))
-        mk_names.extend(mk_aliases.values_list('name',flat=True))
-        mks.extend([alias.person.mk for alias in mk_aliases])
+        name_matcher = get_member_name_matcher()
         while (not last_page) and (page_num < max_page):
             page_num += 1
             params = "__EVENTTARGET=gvProtocol&__EVENTARGUMENT=Page%%24%d&__LASTFOCUS=&__VIEWSTATE=%s&ComId=-1&knesset_id=-1&DtFrom=24%%2F02%%2F2009&DtTo=&subj=&__EVENTVALIDATION=%s" % (page_num, view_state, event_validation)
@@ -861,6 +1055,7 @@ class Command(NoArgsCommand):
 
         logger.debug('res contains %d entries' % len(res))
 
+        meetings = [] # of (CommitteeMeeting, protocol url) to update
         for (date_string, com, topic, link) in res:
             (c, created) = Committee.objects.get_or_create(name=com)
             if created:
@@ -891,9 +1086,14 @@ class Command(NoArgsCommand):
             else:
                 cm = CommitteeMeeting.objects.create(committee=c, date=d, topics=topic, date_string=date_string, src_url=link)
                 logger.debug('cm %d created' % cm.id)
+            meetings.append((cm, link))
+
+        # the missing protocols are downloaded and converted all at once, so they are parsed in parallel
+        protocol_texts = self.get_committee_protocol_texts([link for cm, link in meetings if not cm.has_protocol])
+        for cm, link in meetings:
             updated_protocol = False
-            if not cm.protocol_text:
-                cm.protocol_text = self.get_committee_protocol_text(link)
+            if not cm.has_protocol:
+                cm.protocol_text = protocol_texts[link]
                 # check if the protocol is from the wrong commitee
                 for i in committees_aliases:
                     if i[1] in cm.protocol_text[:300]:
@@ -906,21 +1106,20 @@ class Command(NoArgsCommand):
             if updated_protocol:
                 cm.create_protocol_parts()
 
-            self.find_attending_members(cm, mks, mk_names)
+            self.find_attending_members(cm, name_matcher)
 
             self.get_bg_material(cm)
 
-    def find_attending_members(self, cm, mks, mk_names):
+    def find_attending_members(self, cm, name_matcher):
+        """
+        Adds the members named in the committee members section of the meeting's protocol, who were members of a
+        party at the time of the meeting, to its attending members. name_matcher is a MemberNameMatcher.
+        """
         try:
             r = re.search("חברי הו?ועדה(.*?)(\n[^\n]*(ייעוץ|יועץ|רישום|רש(מים|מות|מו|מ|מת|ם|מה)|קצר(נים|ניות|ן|נית))[\s|:])".decode('utf8'),cm.protocol_text, re.DOTALL).group(1)
-            s = r.split('\n')
-            for (i, name) in enumerate(mk_names):
-                if not mks[i].party_at(cm.date):  # not a member at time of
-                                                  # this meeting?
-                    continue  # then don't search for this MK.
-                for s0 in s:
-                    if s0.find(name) >= 0:
-                        cm.mks_attended.add(mks[i])
+            member_ids = name_matcher.find_at(r, cm.date)
+            if member_ids:
+                cm.mks_attended.add(*member_ids)
         except Exception:
             exceptionType, exceptionValue, exceptionTraceback = sys.exc_info()
             logger.debug("%s%s",
@@ -934,36 +1133,25 @@ class Command(NoArgsCommand):
             cm.mks_attended.count()))
 
     def get_committee_protocol_text(self, url):
-        logger.debug('get_committee_protocol_text. url=%s' % url)
-        if url.find('html'):
-            url = url.replace('html','rtf')
-        file_str = StringIO()
-        count = 0
-        flag = True
-        while count<10 and flag:
+        return self.get_committee_protocol_texts([url])[url]
+
+    def get_committee_protocol_texts(self, urls):
+        """
+        Downloads the rtf protocols of the given committee meeting urls and converts them in parallel.
+        Returns a dict of url -> protocol text, which is empty for the protocols that couldn't be read.
+        """
+        rtf_urls = dict((url, url.replace('html','rtf')) for url in urls)
+        get_fetcher().prefetch(set(rtf_urls.values()), max_age=document_max_age())
+        documents = []
+        for url in urls:
+            logger.debug('get_committee_protocol_text. url=%s' % url)
             try:
-                file_str.write(urllib2.urlopen(url).read())
-                flag = False
-            except Exception:
-                count += 1
-        if flag:
-            logger.error("can't open url %s. tried %d times" % (url, count))
-        try:
-            doc = Rtf15Reader.read(file_str)
-        except Exception:
-            return ''
-        text = []
-        attended_list = False
-        for paragraph in doc.content:
-            for sentence in paragraph.content:
-                if 'bold' in sentence.properties and attended_list:
-                    attended_list = False
-                    text.append('')
-                if 'מוזמנים'.decode('utf8') in sentence.content[0] and 'bold' in sentence.properties:
-                    attended_list = True
-                text.append(sentence.content[0])
-        all_text = '\n'.join(text)
-        return re.sub(r'\n:\n',r':\n',all_text)
+                documents.append(fetch(rtf_urls[url], max_age=document_max_age()))
+            except FetchError, e:
+                logger.error("can't open url %s: %s" % (rtf_urls[url], e))
+                documents.append('')
+        texts = get_converter().convert('protocol', documents)
+        return dict((url, text or '') for url, text in zip(urls, texts))
 
     def get_bg_material(self,cm):
         links = cm.get_bg_material()
@@ -974,43 +1162,32 @@ class Command(NoArgsCommand):
 
 
     def get_full_text(self,v):
-        try:
-            l = Link.objects.get(object_pk=str(v.id), title=u'מסמך הצעת החוק באתר הכנסת')
-        except Exception:
-            return
-        try:
-            if l.url.endswith('.rtf'):
-                logger.info('get_full_text url=%s' % l.url)
-                file_str = StringIO()
-                file_str.write(urllib2.urlopen(l.url).read())
-                doc = Rtf15Reader.read(file_str)
-                content_list = []
-                is_bold = False
-                for j in [1,2]:
-                    for i in range(len(doc.content[j].content)):
-                        part = doc.content[j].content[i]
-                        if 'bold' in part.properties:           # this part is bold
-                            if not is_bold:                          # last part was not bold
-                                content_list.append('<br/><b>')         # add new line and bold
-                                is_bold = True                          # remember that we are now in bold
-                            content_list.append(part.content[0]+' ') # add this part
-
-                        else:                                   # this part is not bold
-                            if len(part.content[0]) <= 1:           # this is a dummy node, ignore it
-                                pass
-                            else:                                   # this is a real node
-                                if is_bold:                         # last part was bold. need to unbold
-                                    content_list.append('</b>')
-                                    is_bold = False
-                                content_list.append('<br/>'+part.content[0]) #add this part in a new line
-
-                    content_list.append('<br/>')
-
-                v.full_text = ''.join(content_list)
-                v.save()
-        except Exception:
-            exceptionType, exceptionValue, exceptionTraceback = sys.exc_info()
-            logger.error("%s%s", ''.join(traceback.format_exception(exceptionType, exceptionValue, exceptionTraceback)), '\nvote.title='+v.title.encode('utf8'))
+        self.get_full_texts([v])
+
+    def get_full_texts(self, votes):
+        """
+        Downloads the rtf full texts of the bills of the given votes, converts them to html in parallel and saves
+        them in the votes' full_text.
+        """
+        links = dict(Link.objects.filter(object_pk__in=[str(v.id) for v in votes], url__endswith='.rtf',
+                                         title=u'מסמך הצעת החוק באתר הכנסת').values_list('object_pk', 'url'))
+        votes = [v for v in votes if str(v.id) in links]
+        get_fetcher().prefetch(set(links.values()), max_age=document_max_age())
+        fetched = []
+        for v in votes:
+            url = links[str(v.id)]
+            logger.info('get_full_text url=%s' % url)
+            try:
+                fetched.append((v, fetch(url, max_age=document_max_age())))
+            except FetchError, e:
+                logger.error("can't open url %s: %s\nvote.title=%s" % (url, e, v.title.encode('utf8')))
+        html = get_converter().convert('full_text', [document for v, document in fetched])
+        for (v, _), full_text in zip(fetched, html):
+            if full_text is None:
+                logger.error("can't convert %s\nvote.title=%s" % (links[str(v.id)], v.title.encode('utf8')))
+                continue
+            v.full_text = full_text
+            v.save()
 
     def dump_to_file(self):
         f = open('votes.tsv','wt')
@@ -1298,111 +1475,87 @@ class Command(NoArgsCommand):
                 pp['t1'] = pp['law__title'] + ' ' + pp['title']
             pp['c2'] = cannonize(pp['title'] + pp['law__title'])
 
-        self.find_proposals_in_committee_meetings(gps,kps,pps)
-        self.find_proposals_in_votes(gps,kps,pps)
+        with transaction.commit_on_success():
+            stage_bill_ids = self.find_proposals_in_committee_meetings(gps,kps,pps)
+            votes_bill_ids = self.find_proposals_in_votes(gps,kps,pps)
+            # recompute each affected bill once. update_votes also updates the stage
+            for bill in Bill.objects.filter(id__in=stage_bill_ids | votes_bill_ids):
+                if bill.id in votes_bill_ids:
+                    bill.update_votes()
+                else:
+                    bill.update_stage()
+
+    def get_proposals_matcher(self, gps, kps, pps, both_orders):
+        """
+        Returns a matcher finding the ('gov'|'knesset'|'private', id) keys of the proposals whose
+        canonical name c1 (and c2, if both_orders) appears in a cannonized text.
+        Matchers are kept for the whole run, and only rebuilt when the proposals change.
+        """
+        patterns = []
+        for kind, proposals in (('gov', gps), ('knesset', kps), ('private', pps)):
+            for p in proposals:
+                patterns.append(((kind, p['id']), p['c1']))
+                if both_orders:
+                    patterns.append(((kind, p['id']), p['c2']))
+        patterns = tuple(patterns)
+        matchers = self.__dict__.setdefault('_proposals_matchers', {})
+        if both_orders not in matchers or matchers[both_orders][0] != patterns:
+            matchers[both_orders] = (patterns, MultiMatcher(patterns))
+        return matchers[both_orders][1]
 
     def find_proposals_in_committee_meetings(self, gps, kps, pps):
         """
-        Find Private proposals and Knesset proposals in committee meetings. update bills that are connected.
+        Find Private proposals and Knesset proposals in committee meetings, and link the new
+        meetings found to the proposals and their bills.
         kps and pps are dicts computed by find_proposals_in_other_data with canonical names.
+        Returns the ids of the bills that got new meetings, whose stage should be updated.
         """
-
+        matcher = self.get_proposals_matcher(gps, kps, pps, both_orders=True)
         d = datetime.date.today()-datetime.timedelta(60) # only look through cms in last 60 days.
-        for cm in CommitteeMeeting.objects.filter(date__gt=d,committee__type='committee').exclude(protocol_text=None):
-            c = cannonize(cm.protocol_text)
-            for gp in gps:
-                if c.find(gp['c1'])>=0 or c.find(gp['c2'])>=0:
-                    p = GovProposal.objects.get(pk=gp['id'])
-                    if cm not in p.committee_meetings.all():
-                        p.committee_meetings.add(cm)
-                        if p.bill:
-                            p.bill.second_committee_meetings.add(cm)
-                            p.bill.update_stage()
-                        logger.debug('gov proposal %d found in cm %d' % (p.id,cm.id))
-            for kp in kps:
-                if c.find(kp['c1'])>=0 or c.find(kp['c2'])>=0:
-                    p = KnessetProposal.objects.get(pk=kp['id'])
-                    if cm not in p.committee_meetings.all():
-                        p.committee_meetings.add(cm)
-                        if p.bill:
-                            p.bill.second_committee_meetings.add(cm)
-                            p.bill.update_stage()
-                        #print "add KP %d to CM %d" % (kp['id'], cm.id)
-            for pp in pps:
-                if c.find(pp['c1'])>=0 or c.find(pp['c2'])>=0:
-                    p = PrivateProposal.objects.get(pk=pp['id'])
-                    if cm not in p.committee_meetings.all():
-                        p.committee_meetings.add(cm)
-                        if p.bill:
-                            p.bill.first_committee_meetings.add(cm)
-                            p.bill.update_stage()
-                        #print "add PP %d to CM %d" % (pp['id'], cm.id)
+        found = dict((kind, set()) for kind in PROPOSAL_MODELS) # kind -> set of (proposal id, cm id)
+        cm_ids = CommitteeMeeting.objects.filter(date__gt=d,committee__type='committee').exclude(
+                protocol_fingerprint='').values_list('id', flat=True)
+        for cm_id, protocol_text in ProtocolText.objects.iter_texts(cm_ids):
+            for kind, proposal_id in matcher.find(cannonize(protocol_text)):
+                found[kind].add((proposal_id, cm_id))
+
+        bill_ids = set()
+        for kind, model in PROPOSAL_MODELS.items():
+            new_links = add_missing_links(model, 'committee_meetings', found[kind])
+            logger.debug('%d new cms found for %s proposals' % (len(new_links), kind))
+            bills = dict(model.objects.filter(id__in=set(p for p, cm in new_links), bill__isnull=False).values_list(
+                'id', 'bill'))
+            bill_links = [(bills[p], cm) for p, cm in new_links if p in bills]
+            add_missing_links(Bill, 'first_committee_meetings' if kind == 'private' else 'second_committee_meetings',
+                              bill_links)
+            bill_ids.update(b for b, cm in bill_links)
+        return bill_ids
 
     def find_proposals_in_votes(self,gps,kps,pps):
         """
-        Find Private proposals and Knesset proposals in votes. update bills that are connected.
+        Find Private proposals and Knesset proposals in votes, and link the new votes found to
+        the proposals.
         kps and pps are dicts computed by find_proposals_in_other_data with canonical names.
+        Returns the ids of the bills of the proposals that got new votes, whose votes should be updated.
         """
-        votes = Vote.objects.filter(title__contains='חוק').values('id','title')
-
-        for v in votes:
-            v['c'] = cannonize(v['title'])
-
-            for gp in gps:
-                if v['c'].find(gp['c1'])>=0:
-                    p = GovProposal.objects.get(pk=gp['id'])
-                    this_v = Vote.objects.get(pk=v['id'])
-                    if this_v not in p.votes.all():
-                        p.votes.add(this_v)
-                        if p.bill:
-                            p.bill.update_votes()
-                        logger.debug('gov proposal %d found in vote %s' % (p.id,this_v.title))
-
-            for kp in kps:
-                if v['c'].find(kp['c1'])>=0:
-                    p = KnessetProposal.objects.get(pk=kp['id'])
-                    this_v = Vote.objects.get(pk=v['id'])
-                    if this_v not in p.votes.all():
-                        p.votes.add(this_v)
-                        #print "add KP %d to Vote %d" % (kp['id'], this_v.id)
-                        if p.bill:
-                            p.bill.update_votes()
-
-            for pp in pps:
-                if v['c'].find(pp['c1'])>=0:
-                    p = PrivateProposal.objects.get(pk=pp['id'])
-                    this_v = Vote.objects.get(pk=v['id'])
-                    if this_v not in p.votes.all():
-                        p.votes.add(this_v)
-                        #print "add PP %d to Vote %d" % (pp['id'], this_v.id)
-                        if p.bill:
-                            p.bill.update_votes()
+        matcher = self.get_proposals_matcher(gps, kps, pps, both_orders=False)
+        found = dict((kind, set()) for kind in PROPOSAL_MODELS) # kind -> set of (proposal id, vote id)
+        for vote_id, title in Vote.objects.filter(title__contains='חוק').values_list('id','title'):
+            for kind, proposal_id in matcher.find(cannonize(title)):
+                found[kind].add((proposal_id, vote_id))
+
+        bill_ids = set()
+        for kind, model in PROPOSAL_MODELS.items():
+            new_links = add_missing_links(model, 'votes', found[kind])
+            logger.debug('%d new votes found for %s proposals' % (len(new_links), kind))
+            bill_ids.update(model.objects.filter(id__in=set(p for p, v in new_links), bill__isnull=False).values_list(
+                'bill', flat=True))
+        return bill_ids
 
     def merge_duplicate_laws(self):
         """Find and merge duplicate laws, and identical bills of each law"""
-
-        laws = Law.objects.values('id','title','merged_into')
-
-        for l in laws:
-            l['c'] = cannonize(l['title'])
-
-        for (i,l) in enumerate(laws):
-            for j in range(i+1, len(laws)):
-                l2 = laws[j]
-                if l2['c']==l['c'] and l2['merged_into']==None and None==l['merged_into']:
-                    law1 = Law.objects.get(pk=l['id'])
-                    law2 = Law.objects.get(pk=l2['id'])
-                    if law1.bills.count() > law2.bills.count():
-                        law1.merge(law2)
-                    else:
-                        law2.merge(law1)
-
-        for l in Law.objects.all():
-            bills = l.bills.all()
-            for (i,b) in enumerate(bills):
-                for i2 in range(i+1,len(bills)):
-                    if cannonize(b.title)==cannonize(bills[i2].title):
-                        b.merge(bills[i2])
+        law_merges, bill_merges = merge_duplicates()
+        logger.debug('merged %d groups of laws and %d groups of bills' % (len(law_merges), len(bill_merges)))
 
     def correct_votes_matching(self):
         """tries to find votes that are matched to bills in incorrect places
@@ -1516,59 +1669,78 @@ class Command(NoArgsCommand):
         update = options.get('update', False)
         laws = options.get('laws',False)
         committees = options.get('committees', False)
-
-        if all_options:
-            download = True
-            load = True
-            process = True
-            dump_to_file = True
-
-        if (all([not(all_options),not(download),not(load),not(process),
-                 not(dump_to_file),not(update),not(laws), not(committees)])):
-            print "no arguments found. doing nothing. \ntry -h for help.\n--all to run the full syncdata flow.\n--update for an online dynamic update."
-
-        if download:
-            print "beginning download phase"
-            self.download_all()
-            #self.get_laws_data()
-
-        if load:
-            print "beginning load phase"
-            self.update_members_from_file()
-            self.update_db_from_files()
-
-        if process:
-            print "beginning process phase"
-            self.calculate_votes_importances()
-            #self.calculate_correlations()
-
-        if laws:
-            self.parse_laws()
-            self.find_proposals_in_other_data()
-            self.merge_duplicate_laws()
-            self.correct_votes_matching()
-
-        if dump_to_file:
-            print "writing votes to tsv file"
-            self.dump_to_file()
-
-        if update:
-            self.update_votes()
-            self.update_laws_data()
-            self.update_presence()
-            self.get_protocols()
-            self.parse_laws()
-            self.find_proposals_in_other_data()
-            self.merge_duplicate_laws()
-            self.update_mk_role_descriptions()
-            self.update_mks_is_current()
-            self.update_gov_law_decisions()
-            self.correct_votes_matching()
-            logger.debug('finished update')
-
-        if committees:
-            self.get_protocols()
-            logger.debug('finished committees update')
+        if options.get('replay'):
+            get_fetcher().replay = True
+        since = options.get('since')
+        if since:
+            try:
+                since = datetime.datetime.strptime(since, '%Y-%m-%d')
+            except ValueError:
+                raise CommandError('--since should be in the form YYYY-MM-DD')
+
+        converter = get_converter()
+        if all_options or update or committees:
+            # the rtf conversion processes are forked before the fetcher starts
+            # its threads, and without the db connection
+            connection.close()
+            converter.start()
+        try:
+            if all_options:
+                download = True
+                load = True
+                process = True
+                dump_to_file = True
+
+            if (all([not(all_options),not(download),not(load),not(process),
+                     not(dump_to_file),not(update),not(laws), not(committees)])):
+                print "no arguments found. doing nothing. \ntry -h for help.\n--all to run the full syncdata flow.\n--update for an online dynamic update."
+
+            if download:
+                print "beginning download phase"
+                self.download_all()
+                #self.get_laws_data()
+
+            if load:
+                print "beginning load phase"
+                self.update_members_from_file()
+                self.update_db_from_files(options.get('batch_size') or BATCH_SIZE, options.get('full_load', False))
+
+            if process:
+                print "beginning process phase"
+                self.calculate_votes_importances(since)
+                refresh_group_voting_statistics()
+                self.calculate_correlations()
+
+            if laws:
+                self.parse_laws()
+                self.find_proposals_in_other_data()
+                self.merge_duplicate_laws()
+                self.correct_votes_matching()
+
+            if dump_to_file:
+                print "writing votes to tsv file"
+                self.dump_to_file()
+
+            if update:
+                self.update_votes()
+                refresh_group_voting_statistics()
+                self.update_laws_data()
+                self.update_presence()
+                self.get_protocols()
+                self.parse_laws()
+                self.find_proposals_in_other_data()
+                self.merge_duplicate_laws()
+                self.update_mk_role_descriptions()
+                self.update_mks_is_current()
+                self.update_gov_law_decisions()
+                self.correct_votes_matching()
+                logger.debug('finished update')
+
+            if committees:
+                self.get_protocols()
+                logger.debug('finished committees update')
+        finally:
+            converter.close()
 
 
 def iso_year_start(iso_year):
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding model 'SyncState'
+        db.create_table('simple_syncstate', (
+            ('id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('source', self.gf('django.db.models.fields.CharField')(unique=True, max_length=50)),
+            ('last_id', self.gf('django.db.models.fields.IntegerField')(default=0)),
+            ('segment', self.gf('django.db.models.fields.IntegerField')(default=0)),
+            ('offset', self.gf('django.db.models.fields.IntegerField')(default=0)),
+            ('updated', self.gf('django.db.models.fields.DateTimeField')(auto_now=True, blank=True)),
+        ))
+        db.send_create_signal('simple', ['SyncState'])
+
+
+    def backwards(self, orm):
+        # Deleting model 'SyncState'
+        db.delete_table('simple_syncstate')
+
+
+    models = {
+        'simple.syncstate': {
+            'Meta': {'object_name': 'SyncState'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'last_id': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'offset': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'segment': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'source': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '50'}),
+            'updated': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'})
+        }
+    }
+
+    complete_apps = ['simple']
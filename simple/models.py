@@ -1,3 +1,23 @@
 from django.db import models
 
 
+class SyncStateManager(models.Manager):
+
+    def get_for(self, source):
+        return self.get_or_create(source=source)[0]
+
+
+class SyncState(models.Model):
+    """How far syncdata got with a data source: the highest id downloaded
+    from it, and the position in its tsv archive up to which it was loaded
+    to the db (the number of lines of segment already loaded)"""
+    source = models.CharField(max_length=50, unique=True)
+    last_id = models.IntegerField(default=0)
+    segment = models.IntegerField(default=0)
+    offset = models.IntegerField(default=0)
+    updated = models.DateTimeField(auto_now=True)
+
+    objects = SyncStateManager()
+
+    def __unicode__(self):
+        return u"{} ({}, {}:{})".format(self.source, self.last_id, self.segment, self.offset)
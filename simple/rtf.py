@@ -0,0 +1,169 @@
+#encoding: utf-8
+'''
+Conversion of the RTF documents downloaded by syncdata.
+
+Parsing RTF with pyth is slow pure Python, so the documents are converted in
+a multiprocessing pool, one process per core. Results are cached on disk by
+the sha1 of the document and the conversion, so documents that didn't change
+are never parsed again.
+
+The pool is started once, by start(), before the process starts any threads
+(such as the fetcher's): forking a process that runs other threads can
+deadlock the children on locks held by those threads.
+'''
+import hashlib
+import logging
+import os
+import re
+import sys
+import tempfile
+import traceback
+from cStringIO import StringIO
+from multiprocessing import Pool
+
+from django.conf import settings
+from pyth.plugins.rtf15.reader import Rtf15Reader
+
+logger = logging.getLogger("open-knesset.simple.rtf")
+
+
+def protocol_text(rtf):
+    """Returns the text of a committee meeting protocol"""
+    doc = Rtf15Reader.read(StringIO(rtf))
+    text = []
+    attended_list = False
+    for paragraph in doc.content:
+        for sentence in paragraph.content:
+            if 'bold' in sentence.properties and attended_list:
+                attended_list = False
+                text.append('')
+            if 'מוזמנים'.decode('utf8') in sentence.content[0] and 'bold' in sentence.properties:
+                attended_list = True
+            text.append(sentence.content[0])
+    all_text = '\n'.join(text)
+    return re.sub(r'\n:\n',r':\n',all_text)
+
+
+def full_text_html(rtf):
+    """Returns the html of the full text of a bill, from its second and third
+    paragraphs"""
+    doc = Rtf15Reader.read(StringIO(rtf))
+    content_list = []
+    is_bold = False
+    for j in [1,2]:
+        for i in range(len(doc.content[j].content)):
+            part = doc.content[j].content[i]
+            if 'bold' in part.properties:           # this part is bold
+                if not is_bold:                          # last part was not bold
+                    content_list.append('<br/><b>')         # add new line and bold
+                    is_bold = True                          # remember that we are now in bold
+                content_list.append(part.content[0]+' ') # add this part
+
+            else:                                   # this part is not bold
+                if len(part.content[0]) <= 1:           # this is a dummy node, ignore it
+                    pass
+                else:                                   # this is a real node
+                    if is_bold:                         # last part was bold. need to unbold
+                        content_list.append('</b>')
+                        is_bold = False
+                    content_list.append('<br/>'+part.content[0]) #add this part in a new line
+
+        content_list.append('<br/>')
+    return ''.join(content_list)
+
+
+CONVERSIONS = {'protocol': protocol_text, 'full_text': full_text_html}
+
+
+def _convert(args):
+    """Runs a conversion in a pool worker. Returns None if it failed"""
+    kind, rtf = args
+    try:
+        return CONVERSIONS[kind](rtf)
+    except Exception:
+        exceptionType, exceptionValue, exceptionTraceback = sys.exc_info()
+        logger.debug("%s", ''.join(traceback.format_exception(exceptionType, exceptionValue, exceptionTraceback)))
+        return None
+
+
+class RtfConverter(object):
+
+    def __init__(self, cache_dir=None, workers=None):
+        """
+        :param cache_dir: directory of the converted documents cache, or None
+                          for no cache
+        :param workers: number of conversion processes, defaults to the
+                        number of cores
+        """
+        self.cache_dir = cache_dir
+        self.workers = workers
+        self._pool = None
+
+    def start(self):
+        """Starts the conversion processes. Without them documents are
+        converted in this process"""
+        if self._pool is None and self.workers != 1:
+            self._pool = Pool(self.workers)
+
+    def close(self):
+        """Stops the conversion processes"""
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def convert(self, kind, documents):
+        """Converts the given RTF documents (strs) with the conversion kind
+        (a key of CONVERSIONS). Returns a list of the results, which are None
+        for the documents that couldn't be converted"""
+        keys = [self._key(kind, rtf) for rtf in documents]
+        results = [self._read(key) for key in keys]
+        todo = [i for i, result in enumerate(results) if result is None]
+        if len(todo) > 1 and self._pool is not None:
+            converted = self._pool.map(_convert, [(kind, documents[i]) for i in todo])
+        else:
+            converted = [_convert((kind, documents[i])) for i in todo]
+        for i, result in zip(todo, converted):
+            results[i] = result
+            if result is not None:
+                self._write(keys[i], result)
+        return results
+
+    def _key(self, kind, rtf):
+        return '%s-%s' % (kind, hashlib.sha1(rtf).hexdigest())
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[-2:], key)
+
+    def _read(self, key):
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self._path(key), 'rb') as f:
+                return f.read().decode('utf8')
+        except IOError:
+            return None
+
+    def _write(self, key, result):
+        if not self.cache_dir:
+            return
+        path = self._path(key)
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        fd, tmp = tempfile.mkstemp(dir=directory)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(result.encode('utf8'))
+        os.rename(tmp, path)
+
+
+_converter = None
+
+
+def get_converter():
+    """Returns the process wide converter, configured by the RTF_* settings"""
+    global _converter
+    if _converter is None:
+        _converter = RtfConverter(cache_dir=getattr(settings, 'RTF_CACHE_DIR', None),
+                                  workers=getattr(settings, 'RTF_WORKERS', None))
+    return _converter
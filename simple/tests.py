@@ -1,5 +1,5 @@
 #encoding: utf-8
-import re, os, datetime, cPickle,logging
+import re, os, datetime, cPickle,logging, gzip, shutil, tempfile, time
 
 from django.test import TestCase
 from django.test.client import Client
@@ -7,6 +7,14 @@ from django.conf import settings
 from simple.management.commands import parse_knesset_bill_pdf
 from simple.management.commands.parse_government_bill_pdf import pdftools
 from simple.management.commands.parse_laws import GovProposalParser
+from simple.management.commands import syncdata
+from knesset.matcher import MultiMatcher
+from knesset.fetcher import Fetcher, FetchError
+from knesset import fetcher as fetcher_module
+from simple.models import SyncState
+from simple import rtf
+from mks.models import Member, Membership
+from laws.models import Vote, VoteAction, MemberVotingStatistics, Law, Bill, PrivateProposal
 
 logger = logging.getLogger("open-knesset.simple")
 
@@ -52,6 +60,170 @@ class SyncdataTest(TestCase):
     def tearDown(self):
         pass
 
+class MultiMatcherTest(TestCase):
+
+    def test_find(self):
+        matcher = MultiMatcher([(1, 'he'), (2, 'she'), (3, 'his'), (4, 'hers'), (5, ''), (6, 'he')])
+        self.assertEqual(matcher.find('ushers'), set([1, 2, 4, 6]))
+        self.assertEqual(matcher.find('hi'), set())
+        matcher = MultiMatcher([('law', u'חוקהחינוך')])
+        self.assertEqual(matcher.find(u'הצעתחוקהחינוךתיקון'), set(['law']))
+
+class ProposalsLinkingTest(TestCase):
+
+    def test_find_proposals_in_votes(self):
+        law = Law.objects.create(title=u'חוק החינוך')
+        bill = Bill.objects.create(stage='1', title=u'חוק החינוך', law=law)
+        pp = PrivateProposal.objects.create(law=law, title=u'חוק חדש', bill=bill,
+                                            date=datetime.date(2010, 1, 1))
+        vote = Vote.objects.create(title=u'הצעת חוק החינוך - קריאה טרומית',
+                                   time=datetime.datetime(2010, 2, 1))
+        Vote.objects.create(title=u'הצעת חוק הביטוח - קריאה טרומית',
+                            time=datetime.datetime(2010, 2, 1))
+        for i in range(2): # linking again should not add anything
+            syncdata.Command().find_proposals_in_other_data()
+            self.assertEqual(list(pp.votes.all()), [vote])
+            self.assertEqual(list(bill.pre_votes.all()), [vote])
+
+class UpdateDbFromFilesTest(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.data_root = syncdata.DATA_ROOT
+        syncdata.DATA_ROOT = self.dir
+        self.mk_1 = Member.objects.create(name='mk 1')
+        self.mk_2 = Member.objects.create(name='mk 2')
+        self.write('laws.tsv.gz', [])
+        self.write('votes.tsv.gz', ['\t'.join([str(i), 'http://example.com/%d' % i, 'vote %d' % i,
+                                               '1', str(i), '%d פברואר 2010 12:30' % i, '', '', '', ''])
+                                    for i in (1, 2, 3)])
+        self.write('results.tsv.gz', ['1\tmk 1\tparty\tfor', '1\tmk 2\tparty\tagainst',
+                                      '2\tmk 1\tparty\tfor', '3\tmk 2\tparty\tabstain'])
+
+    def write(self, filename, lines):
+        f = gzip.open(os.path.join(self.dir, filename), 'wb')
+        f.write('\n'.join(lines))
+        f.close()
+
+    def test_update_db_from_files(self):
+        for i in range(2): # loading again should not duplicate anything
+            syncdata.Command().update_db_from_files(batch_size=2)
+            self.assertEqual(Vote.objects.count(), 3)
+            self.assertEqual(VoteAction.objects.count(), 4)
+        vote = Vote.objects.get(src_id=1)
+        self.assertEqual(vote.time, datetime.datetime(2010, 2, 1, 12, 30))
+        self.assertEqual(set(vote.voteaction_set.values_list('member__name', 'type')),
+                         set([('mk 1', 'for'), ('mk 2', 'against')]))
+        self.assertEqual(MemberVotingStatistics.objects.get(member=self.mk_1).votes, 2)
+        ms = Membership.objects.get(member=self.mk_2, party__name='party')
+        self.assertEqual((ms.start_date, ms.end_date),
+                         (datetime.date(2010, 2, 1), datetime.date(2010, 2, 3)))
+
+    def test_incremental_load(self):
+        syncdata.Command().update_db_from_files(batch_size=2)
+        state = SyncState.objects.get(source='votes')
+        self.assertEqual((state.segment, state.offset), (0, 3))
+        Vote.objects.filter(src_id=3).delete() # lines already loaded are not parsed again
+        self.write('votes.1.tsv.gz', ['\t'.join(['4', 'http://example.com/4', 'vote 4',
+                                                 '1', '4', '4 פברואר 2010 12:30', '', '', '', ''])])
+        self.write('results.1.tsv.gz', ['4\tmk 1\tparty\tagainst', '2\tmk 2\tparty\tfor'])
+        syncdata.Command().update_db_from_files(batch_size=2)
+        self.assertEqual(sorted(Vote.objects.values_list('src_id', flat=True)), [1, 2, 4])
+        self.assertEqual(VoteAction.objects.filter(vote__src_id__in=[2, 4]).count(), 3)
+        state = SyncState.objects.get(source='results')
+        self.assertEqual((state.segment, state.offset), (1, 2))
+        syncdata.Command().update_db_from_files(batch_size=2, full=True)
+        self.assertEqual(Vote.objects.count(), 4)
+        self.assertEqual(syncdata.Command().last_downloaded_id('votes'), 4)
+
+    def test_failed_load_keeps_loaded_dates(self):
+        command = syncdata.Command()
+        load_vote_actions = command.load_vote_actions
+        def fail_second_chunk(lines, *args):
+            if lines[0][0] == '2':
+                raise ValueError('failed chunk')
+            return load_vote_actions(lines, *args)
+        command.load_vote_actions = fail_second_chunk
+        command.update_db_from_files(batch_size=2)
+        # the dates of the loaded chunk are saved along with its position
+        self.assertEqual(SyncState.objects.get(source='results').offset, 2)
+        self.assertEqual(Member.objects.get(pk=self.mk_2.id).end_date, datetime.date(2010, 2, 1))
+
+    def tearDown(self):
+        syncdata.DATA_ROOT = self.data_root
+        shutil.rmtree(self.dir)
+
+class FetcherTest(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def test_replay(self):
+        fetcher = Fetcher(cache_dir=self.dir, replay=True)
+        fetcher._write_entry(fetcher._key('http://example.com/a', None),
+                             {'url': 'http://example.com/a', 'fetched': 0,
+                              'object': fetcher._write_object('page a')})
+        self.assertEqual(fetcher.fetch('http://example.com/a'), 'page a')
+        fetcher.prefetch(['http://example.com/a'])
+        self.assertEqual(fetcher.fetch('http://example.com/a'), 'page a')
+        self.assertRaises(FetchError, fetcher.fetch, 'http://example.com/a', 'x=1')
+        self.assertRaises(FetchError, fetcher.fetch, 'http://example.com/b')
+
+    def test_max_age(self):
+        fetcher = Fetcher(cache_dir=self.dir, retries=0)
+        fetcher._write_entry(fetcher._key('http://localhost:1/a', None),
+                             {'url': 'http://localhost:1/a', 'fetched': time.time(),
+                              'object': fetcher._write_object('page a')})
+        # pages are revalidated by default, and documents may be served from the cache
+        self.assertRaises(FetchError, fetcher.fetch, 'http://localhost:1/a')
+        self.assertEqual(fetcher.fetch('http://localhost:1/a', max_age=3600), 'page a')
+
+    def test_prefetch_results_are_bounded(self):
+        fetcher = Fetcher(cache_dir=self.dir, replay=True)
+        urls = ['http://example.com/%d' % i for i in range(fetcher_module.MAX_PENDING + 10)]
+        fetcher.prefetch(urls)
+        for result in fetcher._pending.values():
+            result.wait()
+        fetcher.prefetch(['http://example.com/last'])
+        self.assertTrue(len(fetcher._pending) <= fetcher_module.MAX_PENDING)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+class RtfConverterTest(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.calls = []
+        def upper(document):
+            self.calls.append(document)
+            if not document:
+                raise ValueError('empty document')
+            return document.decode('utf8').upper()
+        rtf.CONVERSIONS['upper'] = upper
+
+    def test_convert(self):
+        converter = rtf.RtfConverter(cache_dir=self.dir, workers=1)
+        self.assertEqual(converter.convert('upper', ['a', '', 'b']), [u'A', None, u'B'])
+        self.assertEqual(converter.convert('upper', ['b', 'a', '']), [u'B', u'A', None])
+        # converted documents are cached, failures are not
+        self.assertEqual(self.calls, ['a', '', 'b', ''])
+
+    def test_convert_in_pool(self):
+        converter = rtf.RtfConverter(cache_dir=self.dir, workers=2)
+        converter.start()
+        try:
+            self.assertEqual(converter.convert('upper', ['a', '', 'b']), [u'A', None, u'B'])
+        finally:
+            converter.close()
+        # without the pool documents are converted here, from the cache
+        self.assertEqual(converter.convert('upper', ['b', 'a', 'c']), [u'B', u'A', u'C'])
+        self.assertEqual(self.calls, ['c'])
+
+    def tearDown(self):
+        del rtf.CONVERSIONS['upper']
+        shutil.rmtree(self.dir)
+
 if __name__ == '__main__':
     # hack the sys.path to include knesset and the level above it
     import sys
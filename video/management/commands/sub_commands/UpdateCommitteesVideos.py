@@ -3,9 +3,10 @@
 from video.management.commands.sub_commands import SubCommand
 from committees.models import Committee
 from BeautifulSoup import BeautifulSoup
-import urllib,re,datetime,traceback,sys
+import re,datetime,traceback,sys
 from video.utils import get_videos_queryset
 from video.models import Video
+from knesset.fetcher import fetch
 
 class UpdateCommitteesVideos(SubCommand):
 
@@ -46,8 +47,7 @@ class UpdateCommitteesVideos(SubCommand):
     def _get_committees_index_page(self):
         self._debug('fetching committee index page from '+self.PORTAL_KNESSET_COMMITTEES_INDEX_PAGE_URL)
         try:
-            rf=urllib.urlopen(self.PORTAL_KNESSET_COMMITTEES_INDEX_PAGE_URL)
-            return rf.read().decode('windows-1255').encode('utf-8')
+            return fetch(self.PORTAL_KNESSET_COMMITTEES_INDEX_PAGE_URL).decode('windows-1255').encode('utf-8')
         except Exception, e:
             self._warn('could not fetch committees_index_page, exception: '+str(e))
             traceback.print_exc(file=sys.stdout)
@@ -96,7 +96,7 @@ class UpdateCommitteesVideos(SubCommand):
             return ret
         
     def _get_committee_mainpage_soup(self,href):
-        return BeautifulSoup(urllib.urlopen(href).read())
+        return BeautifulSoup(fetch(href))
               
     def _update_committee_broadcasts_url(self,comm):
         try:
@@ -158,7 +158,7 @@ class UpdateCommitteesVideos(SubCommand):
         comm.save()
     
     def _get_committee_videos_soup(self,bcasturl):
-        return BeautifulSoup(urllib.urlopen(bcasturl).read())
+        return BeautifulSoup(fetch(bcasturl))
     
     def _get_committee_videos(self,bcasturl):
         videos=[]